@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+""" Micro-benchmarks for the hot paths of galileo
+
+usage: ./benchmark.py [name ...]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+from galileo import megadumpDecrypter, xtea
+from galileo import utils
+from galileo.dump import CRC16
+
+
+def bitwiseCRC(data):
+    """ The per-byte, per-bit, reference implementation """
+    crc = CRC16()
+    for c in data:
+        crc.update_byte_MSB(c)
+    return crc.final()
+
+
+def tableCRC(data):
+    crc = CRC16()
+    crc.update(data)
+    return crc.final()
+
+
+def bench_crc(number=10):
+    """ CRC16 over a megadump-sized buffer """
+    data = bytearray(os.urandom(64 * 1024))
+    assert bitwiseCRC(data) == tableCRC(data)
+    results = []
+    for name, fn in (('bitwise', bitwiseCRC), ('table', tableCRC)):
+        t = timeit.timeit(lambda: fn(data), number=number) / number
+        results.append((name, t))
+        print('crc16 %-8s %8.2f ms / 64KiB' % (name, t * 1000))
+    print('crc16 speedup: %.1fx' % (results[0][1] / results[1][1]))
+
+
+def blockwiseCTR(key, nonce, data):
+    """ One block at a time, as `XTEA_CTR` used to do """
+    c = megadumpDecrypter.counter(nonce)
+    stream = bytearray()
+    while len(stream) < len(data):
+        stream.extend(xtea.xtea_encrypt(key, next(c)))
+    return bytearray(x ^ y for (x, y) in zip(data, stream))
+
+
+def bulkCTR(key, nonce, data):
+    return megadumpDecrypter.XTEA_CTR(key, nonce).decrypt(data)
+
+
+def bench_ctr(number=3):
+    """ XTEA-CTR decryption of a megadump-sized buffer """
+    key = bytearray(range(16))
+    nonce = bytearray(8)
+    data = bytearray(os.urandom(16 * 1024))
+    assert blockwiseCTR(key, nonce, data) == bulkCTR(key, nonce, data)
+    numpy = megadumpDecrypter.numpy
+    for name, fn, np in (('blockwise', blockwiseCTR, None),
+                         ('python', bulkCTR, None),
+                         ('numpy', bulkCTR, numpy)):
+        if name == 'numpy' and numpy is None:
+            continue
+        megadumpDecrypter.numpy = xtea.numpy = np
+        t = timeit.timeit(lambda: fn(key, nonce, data), number=number) / number
+        print('xtea-ctr %-9s %8.2f ms / 16KiB' % (name, t * 1000))
+    megadumpDecrypter.numpy = xtea.numpy = numpy
+
+
+def bench_hex(number=10):
+    """ hexa formatting and parsing of a megadump-sized buffer """
+    data = bytearray(os.urandom(64 * 1024))
+    text = utils.a2x(data)
+    for name, fn, arg in (('a2x-byte', lambda d: utils._a2x(d, ' '), data),
+                          ('a2x', utils.a2x, data),
+                          ('x2a-byte', utils._x2a, text),
+                          ('x2a', utils.x2a, text)):
+        t = timeit.timeit(lambda: fn(arg), number=number) / number
+        print('hex %-9s %8.2f ms / 64KiB' % (name, t * 1000))
+
+
+def bench_int(number=100000):
+    """ per-call cost of the integer conversions """
+    data = bytearray(range(4))
+    for name, loop, fast, arg in (
+            ('a2lsbi', utils._a2lsbi, utils.a2lsbi, (data,)),
+            ('a2msbi', utils._a2msbi, utils.a2msbi, (data,)),
+            ('i2lsba', utils._i2lsba, utils.i2lsba, (0x12345678, 4)),
+            ('i2msba', utils._i2msba, utils.i2msba, (0x12345678, 4))):
+        for kind, fn in (('loop', loop), ('struct', fast)):
+            t = timeit.timeit(lambda: fn(*arg), number=number) / number
+            print('%s %-6s %8.3f us / call' % (name, kind, t * 1000000))
+
+
+BENCHMARKS = {
+    'crc': bench_crc,
+    'ctr': bench_ctr,
+    'hex': bench_hex,
+    'int': bench_int,
+}
+
+
+def main(names):
+    for name in names or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+""" Convert the text dumps (dump-<timestamp>.txt) to the binary format """
+
+from __future__ import print_function
+
+import argparse
+import os
+import re
+
+from galileo.dump import convertTextDump
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert text dumps to the binary format')
+    parser.add_argument('dumpDir', nargs='?', default='~/.galileo')
+    parser.add_argument('--remove', action='store_true',
+                        help="remove the text dumps once converted")
+    args = parser.parse_args()
+
+    for root, dirs, files in os.walk(os.path.expanduser(args.dumpDir)):
+        for filename in sorted(files):
+            if not re.match(r'dump-\d+\.txt$', filename):
+                continue
+            filename = os.path.join(root, filename)
+            try:
+                binFilename = convertTextDump(filename)
+            except ValueError as ve:
+                print('Unable to convert %s: %s' % (filename, ve))
+                continue
+            print('%s -> %s' % (filename, binFilename))
+            if args.remove:
+                os.remove(filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,153 @@
+import collections
 import logging
+import os
+import time
 logger = logging.getLogger(__name__)
 
 from ..dump import Dump, DumpResponse, MEGADUMP, CRC16
-from ..utils import a2x, i2lsba, a2lsbi
+from ..utils import a2x, i2lsba, a2lsbi, loadJSON, saveJSON
+
+class ReceiveRing(object):
+    """ A bounded FIFO of the data received, the oldest ones are dropped
+    when it is full.
+
+    highWater is the maximum amount of data that has been waiting, dropped
+    is the amount that has been lost.
+    """
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._queue = collections.deque()
+        self.highWater = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __bool__(self):
+        return bool(self._queue)
+    __nonzero__ = __bool__
+
+    def append(self, data):
+        if len(self._queue) >= self.capacity:
+            self._queue.popleft()
+            self.dropped += 1
+            logger.warning("Receive queue full (%d), dropping data",
+                           self.capacity)
+        self._queue.append(data)
+        self.highWater = max(self.highWater, len(self._queue))
+
+    def popleft(self):
+        return self._queue.popleft()
+
+    def drain(self):
+        """ :returns: the list of all the data waiting, in order """
+        data = list(self._queue)
+        self._queue.clear()
+        return data
+
+
+class UploadWindows(object):
+    """ How many chunks of a response are sent ahead of their
+    acknowledgement, per tracker product.
+
+    Each product starts with stop-and-wait (a window of 1), its window
+    doubles after each successful upload, up to `maximum`. A failure brings
+    it back to stop-and-wait, and it then never grows up to the window that
+    failed again.
+    """
+    FILENAME = 'windows.json'
+    # The acknowledgements only carry 4 bits of the sequence number
+    MAXIMUM = 15
+
+    def __init__(self, maximum=1, dirname=None):
+        """ :param dirname: where to keep the windows across the runs, in
+                            memory only if None """
+        self.maximum = max(1, min(maximum, self.MAXIMUM))
+        self.filename = None
+        if dirname is not None:
+            self.filename = os.path.join(os.path.expanduser(dirname),
+                                         self.FILENAME)
+        self._windows = {}
+        self._limits = {}
+        self.load()
+
+    def load(self):
+        # json keys are strings
+        content = loadJSON(self.filename, 'upload windows', lambda c: (
+            dict((int(p), w) for p, w in c['windows'].items()),
+            dict((int(p), l) for p, l in c['limits'].items())))
+        if content is not None:
+            self._windows, self._limits = content
+
+    def save(self):
+        saveJSON(self.filename,
+                 {'windows': dict((str(p), w) for p, w in
+                                  self._windows.items()),
+                  'limits': dict((str(p), l) for p, l in
+                                 self._limits.items())},
+                 'upload windows', sort_keys=True)
+
+    def get(self, productId):
+        # The maximum might have been lowered since it was learnt
+        return min(self._windows.get(productId, 1), self.maximum)
+
+    def succeeded(self, productId, window):
+        limit = self._limits.get(productId, self.maximum)
+        newWindow = max(self.get(productId), min(window * 2, limit))
+        if newWindow != self.get(productId):
+            logger.debug("Upload window for product 0x%02x: %d", productId,
+                         newWindow)
+        self._windows[productId] = newWindow
+
+    def failed(self, productId, window):
+        self._windows[productId] = 1
+        if window > 1:
+            logger.warning("Upload with a window of %d failed for product"
+                           " 0x%02x, back to stop-and-wait", window,
+                           productId)
+            self._limits[productId] = min(
+                self._limits.get(productId, self.maximum), window - 1)
+
+
+# msec, to collect the answers still coming after a failure
+DRAIN_TIMEOUT = 200
+
 
 class API(object):
+    # Can the instances for different radios be used from different threads
+    threadSafe = False
+    # The `UploadWindows` shared by the radios, None for stop-and-wait
+    uploadWindows = None
+    # The `TimeoutPolicy` shared by the radios, None for the fixed timeouts
+    timeouts = None
+    # msec the discovery lasts at least, for the trackers not expected
+    MIN_DISCOVERY = 1000
+
+    @property
+    def currentModel(self):
+        """ The product id of the tracker we're talking to, if known """
+        return None
+
+    @classmethod
+    def all(klass, logsize):
+        """ :returns: one instance per radio available """
+        return [klass(logsize)]
+
+    @property
+    def name(self):
+        return self.__class__.__name__
+
     def setup(self):
         raise NotImplementedError
     def disconnectAll(self):
         pass
     def getHardwareInfo(self):
         return True
-    def discover(self, UUID, service1, read, write, minRSSI, timeout):
+    def discover(self, UUID, service1, read, write, minRSSI, timeout,
+                 expected=None):
+        """ :param expected: the ids of the trackers expected, the discovery
+                             stops once all of them were heard, but not
+                             before `MIN_DISCOVERY` """
         raise NotImplementedError
     def connect(self, tracker):
         raise NotImplementedError
@@ -21,8 +157,40 @@ class API(object):
         raise NotImplementedError
     def _readData(self, timeout=0):
         raise NotImplementedError
+    def _readDataBatch(self, timeout=None):
+        """ :returns: the list of the data received (at least one), empty
+                      if nothing came within `timeout` """
+        if timeout is None:
+            d = self._readData()
+        else:
+            d = self._readData(timeout)
+        if d is None:
+            return []
+        return [d]
     def info(self):
         raise NotImplementedError
+    def close(self):
+        """ The radio is not used anymore """
+        pass
+
+    def _wait(self, read, step, ceiling):
+        """ :returns: what `read(timeout)` returns, the timeout for `step`
+                      is the one of the `TimeoutPolicy`, if any, but never
+                      more than `ceiling` msec """
+        if self.timeouts is None:
+            return read(ceiling)
+        model = self.currentModel
+        timeout = self.timeouts.timeout(model, step, ceiling)
+        start = time.time()
+        d = read(timeout)
+        if d is not None:
+            self.timeouts.record(model, step, (time.time() - start) * 1000)
+        elif timeout < ceiling:
+            logger.info("No answer within the %dms learnt for %s", timeout,
+                        step)
+            # Make it wait longer next time
+            self.timeouts.record(model, step, ceiling)
+        return d
 
 
 
@@ -36,11 +204,11 @@ class API(object):
             data.extend(i2lsba(n, 2))
         #data = data + [1]
         self._writeData(DM([0xc0, 0xa] + data))
-        d = self._readData(10000)
+        d = self._wait(self._readData, 'initializeAirlink', 10000)
         if d is None:
             return False
         while d == DM([0xc0]):
-            d = self._readData(10000)
+            d = self._wait(self._readData, 'initializeAirlink', 10000)
         if d is None:
             return False
         if d.data[:2] != bytearray([0xc0, 0x14]):
@@ -60,8 +228,10 @@ class API(object):
         r = self._readData()
         return (r is not None) and (r.data == bytearray([0xc0, 2]))
 
-    def getDump(self, dumptype):
-        """ :returns: a `Dump` object or None """
+    def getDump(self, dumptype, dump=None):
+        """ :param dump: the `Dump` object to fill, a new one is created if
+                         not given.
+        :returns: a `Dump` object or None """
         logger.debug('Getting dump type %d', dumptype)
 
         # begin dump of appropriate type
@@ -71,17 +241,23 @@ class API(object):
             logger.error("Tracker did not acknowledged the dump type: %s", r)
             return None
 
-        dump = Dump(dumptype)
-        # Retrieve the dump
-        d = self._readData()
-        if d is None:
-            return None
-        dump.add(d.data)
-        while d.data[0] != 0xc0:
-            d = self._readData()
-            if d is None:
+        if dump is None:
+            dump = Dump(dumptype)
+        # Retrieve the dump, up to its footer
+        done = False
+        while not done:
+            chunks = self._readDataBatch()
+            if not chunks:
                 return None
-            dump.add(d.data)
+            for i, d in enumerate(chunks):
+                dump.add(d.data)
+                if d.data[0] == 0xc0:
+                    done = True
+                    if i != len(chunks) - 1:
+                        logger.warning("Discarding %d messages received after"
+                                       " the dump", len(chunks) - i - 1)
+                    break
+        dump.finish()
         # Analyse the dump
         if not dump.isValid():
             logger.error('Dump not valid')
@@ -91,10 +267,38 @@ class API(object):
                      dump.esc[1])
         return dump
 
-    def _uploadResponse(self, response, fastAirlink):
+    def _uploadResponse(self, response, fastAirlink, productId=None):
         """
+        :param productId: the product of the tracker, for the size of the
+                          window of chunks sent ahead of their
+                          acknowledgements (see `UploadWindows`)
         :returns: a boolean about the success of the operation.
         """
+        window = 1
+        windows = None
+        if not fastAirlink and productId is not None:
+            windows = self.uploadWindows
+        if windows is not None:
+            window = windows.get(productId)
+
+        result = self._sendResponse(response, fastAirlink, window)
+        if result is None and window > 1:
+            windows.failed(productId, window)
+            logger.info("Sending the response again, chunk by chunk")
+            # The acknowledgements of the chunks sent ahead
+            while self._readDataBatch(DRAIN_TIMEOUT):
+                pass
+            result = self._sendResponse(response, fastAirlink, 1)
+        elif result and windows is not None:
+            windows.succeeded(productId, window)
+        return bool(result)
+
+    def _sendResponse(self, response, fastAirlink, window):
+        """ Send the response with up to `window` chunks waiting for their
+        acknowledgement
+        :returns: True on success, None if a chunk was not acknowledged,
+                  False for the other failures
+        """
         dumptype = 4  # ???
         crc = CRC16()
         crc.update(response)
@@ -109,25 +313,30 @@ class API(object):
             return False
 
         CHUNK_LEN = 20
-        response = DumpResponse(response, CHUNK_LEN)
+        chunks = list(DumpResponse(response, CHUNK_LEN))
 
-        for i, chunk in enumerate(response):#range(0, len(response), CHUNK_LEN):
-            self._writeData(DM(chunk))
+        sent = acked = 0
+        while acked < len(chunks):
+            while sent < len(chunks) and sent - acked < window:
+                self._writeData(DM(chunks[sent]))
+                sent += 1
+            if fastAirlink:
+                acked = sent
+                continue
             # This one can also take some time (Charge HR tracker)
-            if not fastAirlink:
-                d = self._readData(20000)
-                expected = DM([0xc0, 0x13, (((i+1) % 16) << 4) + dumptype, 0, 0])
-                if d != expected:
-                    logger.error("Wrong sequence number: %s, expected: %s", d, expected)
-                    return False
+            d = self._wait(self._readData, 'uploadChunk', 20000)
+            expected = DM([0xc0, 0x13, (((acked+1) % 16) << 4) + dumptype, 0, 0])
+            if d != expected:
+                logger.error("Wrong sequence number: %s, expected: %s", d, expected)
+                return None
+            acked += 1
 
         self._writeData(DM([0xc0, 2]))
         # Next one can be very long. He is probably erasing the memory there
-        d = self._readData(60000)
+        d = self._wait(self._readData, 'uploadDone', 60000)
         if d != DM([0xc0, 2]):
             logger.error("Unexpected answer from tracker: %s", d)
             return False
-
         return True
 
 
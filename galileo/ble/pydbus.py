@@ -12,14 +12,25 @@ try:
 except ImportError:
     pydbus = None
 
+from ..trace import IN, OUT, newLog, tracing
 from ..tracker import Tracker
 from ..utils import x2a, a2x
-from . import API, DM
+from . import API, DM, ReceiveRing
 
 class DbusTracker(Tracker):
-    def __init__(self, id, serviceData, path):
+    def __init__(self, id, serviceData, path, RSSI=-255):
         Tracker.__init__(self, id, serviceData)
         self.path = path
+        self.RSSI = RSSI
+
+def addressToId(address, asString=True):
+    """ Somehow, the Address is the inverse of what fitbit calls the
+    tracker_id. """
+    tracker_id = x2a(address)
+    tracker_id.reverse()
+    if asString:
+        return a2x(tracker_id, delim="")
+    return tracker_id
 
 def maskUUID(base, mask):
     """ returns a UUID with the mask OR'd to the first field """
@@ -27,21 +38,111 @@ def maskUUID(base, mask):
     base[0] |= mask
     return uuid.UUID(fields=base)
 
+class ObjectIndex(object):
+    """ A local copy of the objects managed by BlueZ, indexed by interface.
+
+    It is loaded once with GetManagedObjects, then kept up to date with the
+    InterfacesAdded, InterfacesRemoved and PropertiesChanged signals.
+    """
+    PROPERTIES = 'org.freedesktop.DBus.Properties'
+
+    def __init__(self, manager, bus=None):
+        self.manager = manager
+        # path -> {interface: properties}
+        self._objects = {}
+        # interface -> set of paths
+        self._byInterface = {}
+        self._subscriptions = [
+            manager.InterfacesAdded.connect(self.interfacesAdded),
+            manager.InterfacesRemoved.connect(self.interfacesRemoved)]
+        if bus is not None:
+            self._subscriptions.append(bus.subscribe(
+                sender='org.bluez', iface=self.PROPERTIES,
+                signal='PropertiesChanged', signal_fired=self._signal))
+        self.load()
+
+    def load(self):
+        """ (Re)load everything """
+        self._objects = {}
+        self._byInterface = {}
+        for path, interfaces in self.manager.GetManagedObjects().items():
+            self.interfacesAdded(path, interfaces)
+
+    def close(self):
+        for subscription in self._subscriptions:
+            subscription.disconnect()
+        self._subscriptions = []
+
+    def interfacesAdded(self, path, interfaces):
+        obj = self._objects.setdefault(path, {})
+        for interface, properties in interfaces.items():
+            obj[interface] = dict(properties)
+            self._byInterface.setdefault(interface, set()).add(path)
+
+    def interfacesRemoved(self, path, interfaces):
+        obj = self._objects.get(path, {})
+        for interface in interfaces:
+            obj.pop(interface, None)
+            self._byInterface.get(interface, set()).discard(path)
+        if not obj:
+            self._objects.pop(path, None)
+
+    def propertiesChanged(self, path, interface, changed, invalidated):
+        properties = self._objects.get(path, {}).get(interface)
+        if properties is None:
+            # Not one we know about
+            return
+        properties.update(changed)
+        for name in invalidated:
+            properties.pop(name, None)
+
+    def _signal(self, sender, path, iface, signal, params):
+        self.propertiesChanged(path, *params)
+
+    def objects(self, interface, prefix=None):
+        """ :returns: a generator of (path, properties) of the objects
+                      implementing `interface`, below `prefix` if given """
+        for path in list(self._byInterface.get(interface, ())):
+            if prefix is None or path.startswith(prefix):
+                yield path, self._objects[path][interface]
+
+
 class PyDBUS(API):
-    def __init__(self, logsize):
+    def __init__(self, logsize, adapterPath=None):
+        """ :param adapterPath: the adapter to use, the first one found
+                                otherwise """
+        self.adapterPath = adapterPath
         self.tracker = None
         self.read = None
-        self.readqueue = []
-
-    def _getObjects(self, classtype=None, filter_=None):
-        for path, obj in self.manager.GetManagedObjects().items():
-            if classtype is None or classtype in obj:
-                if classtype is not None:
-                    obj = obj[classtype]
-                if filter_ is not None and not filter_(obj):
-                    logger.debug("Filter excluded %s", path)
-                    continue
-                yield path, obj
+        self.readqueue = ReceiveRing()
+        self.log = newLog(logsize)
+        self.index = None
+
+    @classmethod
+    def all(klass, logsize):
+        """ One instance per bluetooth adapter """
+        if pydbus is None:
+            return [klass(logsize)]
+        try:
+            manager = pydbus.SystemBus().get('org.bluez', '/')
+        except GLib.GError:
+            # setup will tell what is wrong
+            return [klass(logsize)]
+        return [klass(logsize, path) for path, obj in
+                manager.GetManagedObjects().items()
+                if 'org.bluez.Adapter1' in obj]
+
+    @property
+    def name(self):
+        return self.adapterPath or 'bluez'
+
+    def _getObjects(self, classtype, filter_=None, prefix=None):
+        """ The objects implementing `classtype` (below the `prefix` path) """
+        for path, obj in self.index.objects(classtype, prefix):
+            if filter_ is not None and not filter_(obj):
+                logger.debug("Filter excluded %s", path)
+                continue
+            yield path, obj
 
     def setup(self):
         if pydbus is None:
@@ -65,21 +166,31 @@ class PyDBUS(API):
                 logger.error("bluez service unknown. Is bluez installed ?")
                 return False
             raise
+        # The index of a previous setup would still follow the signals
+        self.close()
+        self.index = ObjectIndex(self.manager, self.bus)
         adapterpaths = list(self._getObjects('org.bluez.Adapter1'))
         if len(adapterpaths) == 0:
             logger.error("No bluetooth adapters found")
             return False
         logger.info('Found %d adapters: %s', len(adapterpaths), adapterpaths)
-        logger.info('Using: %s', adapterpaths[0][0])
-        self.adapter = self.bus.get('org.bluez', adapterpaths[0][0])
+        if self.adapterPath is None:
+            self.adapterPath = adapterpaths[0][0]
+        logger.info('Using: %s', self.adapterPath)
+        self.adapter = self.bus.get('org.bluez', self.adapterPath)
         if not self.adapter.Powered:
             logger.info("Adapter wasn't powered, powering it up.")
             self.adapter.Powered = True
         return True
 
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
     def disconnectAll(self):
         """ Remove all not-connected devices from the managed objects """
-        for path, obj in self._getObjects('org.bluez.Device1', lambda obj: not obj['Connected']):
+        for path, obj in self._getObjects('org.bluez.Device1', lambda obj: not obj['Connected'], self.adapterPath + '/'):
             try:
                 self.adapter.RemoveDevice(path)
             except GLib.GError as gerr:
@@ -89,15 +200,28 @@ class PyDBUS(API):
                 raise
         return True
 
-    def discover(self, baseUUID, service1, read, write, minRSSI, timeout):
+    def discover(self, baseUUID, service1, read, write, minRSSI, timeout,
+                 expected=None):
         service = str(maskUUID(baseUUID, service1))
         self.readUUID = str(maskUUID(baseUUID, read))
         self.writeUUID = str(maskUUID(baseUUID, write))
 
         trackers = []
+        remaining = set(expected or [])
         def new_iface(*args):
             logger.debug("Discovered: %s", args)
             trackers.append(args[0])
+            if not remaining:
+                return
+            address = args[1].get('org.bluez.Device1', {}).get('Address')
+            if address is not None:
+                remaining.discard(addressToId(address))
+                if not remaining:
+                    logger.info("All the expected trackers were heard")
+                    # Still give the other trackers a chance to show up
+                    GLib.source_remove(timeout_id)
+                    wait = self.MIN_DISCOVERY - (time.time() - start) * 1000
+                    GLib.timeout_add(max(0, int(wait)), stop_discovery)
 
         def stop_discovery():
             self.adapter.StopDiscovery()
@@ -109,7 +233,8 @@ class PyDBUS(API):
         # listen for InterfaceAdded
         self.manager.onInterfacesAdded = new_iface
         # add a timeout stop function
-        GLib.timeout_add(timeout, stop_discovery)
+        start = time.time()
+        timeout_id = GLib.timeout_add(timeout, stop_discovery)
         # Start the discovery
         try:
             self.adapter.SetDiscoveryFilter({'UUIDs': GLib.Variant('as', [service]), 'Transport': GLib.Variant('s', 'le')})
@@ -123,21 +248,20 @@ class PyDBUS(API):
         self.manager.onInterfacesAdded = None
 
         # Go through the one that have actually been added
-        for path, obj in self._getObjects('org.bluez.Device1', lambda obj: service in obj['UUIDs']):
+        for path, obj in self._getObjects('org.bluez.Device1', lambda obj: service in obj['UUIDs'], self.adapterPath + '/'):
             if path not in trackers:
                 # Old one, was not discovered this round
                 continue
             logger.info("Found: %s", obj)
-            tracker_id = x2a(obj['Address'])
-            # Somehow, the Address is the inverse of what fitbit calls the tracker_id.
-            tracker_id.reverse()
+            tracker_id = addressToId(obj['Address'], False)
             try:
                 serviceData = obj['ServiceData'].get('0000180a-0000-1000-8000-00805f9b34fb')
             except KeyError:
                 # ServiceData not present
                 logger.error("bluez version too old (no ServiceData from advertisement)")
                 continue
-            yield DbusTracker(tracker_id, serviceData, path)
+            yield DbusTracker(tracker_id, serviceData, path,
+                              obj.get('RSSI', -255))
 
     def connect(self, tracker):
         self.tracker = self.bus.get('org.bluez', tracker.path)
@@ -168,8 +292,8 @@ class PyDBUS(API):
             return False
 
         logger.debug("Fetching the communication Characteristics")
-        # We should make sure that we are selecting the one from the device we want to connect to ...
-        for path, obj in self._getObjects('org.bluez.GattCharacteristic1', lambda obj: obj['UUID'] in (self.readUUID, self.writeUUID)):
+        # Only the ones of the device we're connected to
+        for path, obj in self._getObjects('org.bluez.GattCharacteristic1', lambda obj: obj['UUID'] in (self.readUUID, self.writeUUID), tracker.path + '/'):
             if obj['UUID'] == self.readUUID:
                 logger.debug("read is: %s", path)
                 self.read = self.bus.get('org.bluez', path)
@@ -178,18 +302,11 @@ class PyDBUS(API):
                 self.write = self.bus.get('org.bluez', path)
 
         if self.read is None:
-            log.error("Unable to get the Connection Characteristics")
+            logger.error("Unable to get the Connection Characteristics")
             return False
 
-        def received(iface, changed, invalidated):
-            value = changed.get('Value')
-            if value is None:
-                logger.debug("No Value received")
-                return
-            self.readqueue.append(changed['Value'])
-
         logger.debug("Installing my read handler.")
-        self.read.onPropertiesChanged = received
+        self.read.onPropertiesChanged = self._received
         self.read.StartNotify()
 
         try:
@@ -203,22 +320,68 @@ class PyDBUS(API):
         return True
 
     def _writeData(self, data):
-        logger.debug('=> %s', data)
+        if tracing(logger):
+            logger.debug('=> %s', data)
+        self.log.add(OUT, data.data, 0x01)
         self.write.WriteValue(data.data, {})
 
 
+    def _received(self, iface, changed, invalidated):
+        """ Called by GLib on the notification of the read characteristic """
+        value = changed.get('Value')
+        if value is None:
+            logger.debug("No Value received")
+            return
+        self.readqueue.append(value)
+
+    def _waitFor(self, condition, timeout):
+        """ Dispatch the GLib events until `condition()` is true, or
+        `timeout` msec elapsed
+        :returns: the last value of `condition()`
+        """
+        if condition():
+            return True
+        expired = []
+        def onTimeout():
+            expired.append(True)
+            # remove the timeout from the sources
+            return False
+        timeout_id = GLib.timeout_add(timeout, onTimeout)
+        context = self.loop.get_context()
+        while not condition() and not expired:
+            # Blocks until something happens: a notification or the timeout
+            context.iteration(True)
+        if not expired:
+            GLib.source_remove(timeout_id)
+        return condition()
+
     def _readData(self, timeout=3000):
-        """ So, read data only empty the queue """
-        while not self.readqueue:
-            if timeout <= 0:
+        """ Wait for a notification to be in the queue """
+        if not self._waitFor(lambda: self.readqueue, timeout):
+            if tracing(logger):
                 logger.debug("<= ...")
-                return None
-            timeout -= 100
-            time.sleep(.1)
-            self.loop.get_context().iteration(False)
+            return None
 
-        data = DM(bytearray(self.readqueue.pop(0)), decode=False)
-        logger.debug('<= %s', data)
+        data = DM(bytearray(self.readqueue.popleft()), decode=False)
+        self.log.add(IN, data.data, 0x81)
+        if tracing(logger):
+            logger.debug('<= %s', data)
+        return data
+
+    def _readDataBatch(self, timeout=3000):
+        """ All the notifications received so far, at once """
+        if not self._waitFor(lambda: self.readqueue, timeout):
+            if tracing(logger):
+                logger.debug("<= ...")
+            return []
+        data = [DM(bytearray(value), decode=False)
+                for value in self.readqueue.drain()]
+        for d in data:
+            self.log.add(IN, d.data, 0x81)
+        if tracing(logger):
+            logger.debug('<= %d messages (up to %d waiting, %d dropped)',
+                         len(data), self.readqueue.highWater,
+                         self.readqueue.dropped)
         return data
 
     def uploadResponse(self, response):
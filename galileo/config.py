@@ -12,8 +12,10 @@ except ImportError:
 from . import ble  # ble.API
 # the various ble implementations
 from .ble import pydbus
+from . import replay  # ReplayDongle
 from . import tracker
 from . import databases  # Database
+from . import dumpstore  # DumpStore
 # Load the various database implementations
 from .databases import local, rest, xml
 
@@ -292,15 +294,30 @@ class Config(object):
                 IntParameter('daemonPeriod', 'daemon-period', ('--daemon-period',), 180000, False, "sleep time in msec between sync runs when in daemon mode"),
                 SetParameter('includeTrackers', 'include', ('-I', '--include'), None, False, "list of tracker IDs to sync (all if not specified)"),
                 SetParameter('excludeTrackers', 'exclude', ('-X', '--exclude'), set(), False, "list of tracker IDs to not sync"),
+                IntParameter('discoveryTimeout', 'discovery-timeout', ('--discovery-timeout',), 4000, False, "time in msec during which the trackers are discovered"),
+                BoolParameter('adaptiveDiscovery', 'adaptive-discovery', ('adaptive-discovery',), False, False, "stop the discovery once the trackers included, or heard recently, are heard again, and wait at most twice the time they usually take"),
                 LogLevelParameter(),
                 ClassChooserParameter(ble.API, 'bluetoothConn', 'bluetooth_connection', ('--bluetooth',), tracker.FitbitClient, False, "Bluetooth API to use"),
+                BoolParameter('multiRadio', 'multi-radio', ('multi-radio',), False, False, "use all the Fitbit dongles or bluetooth adapters at once"),
                 BoolParameter('forceSync', 'force-sync', ('force',), False, False, "synchronize even if tracker reports a recent sync"),
                 BoolParameter('keepDumps', 'keep-dumps', ('dump',), True, False, "enable saving of the megadump to file"),
+                ClassChooserParameter(dumpstore.DumpStore, 'dumpStore', 'dump-store', ('--dump-store',), dumpstore.TextDumpStore, False, "how to store the megadumps on disk"),
                 BoolParameter('doUpload', 'do-upload',  ('upload',), True, False, "upload the dump to the database"),
+                IntParameter('statusTTL', 'status-ttl', ('--status-ttl',), 60000, False, "time in msec during which the status of the server is not requested again"),
+                IntParameter('httpTimeout', 'http-timeout', ('--http-timeout',), 60000, False, "time in msec to wait for the answer of the server"),
+                IntParameter('httpPoolSize', 'http-pool-size', ('--http-pool-size',), 4, False, "number of connections to the server kept open"),
+                BoolParameter('httpKeepAlive', 'http-keep-alive', ('http-keep-alive',), True, False, "keep the connections to the server open between requests"),
+                IntParameter('uploadWorkers', 'upload-workers', ('--upload-workers',), 0, False, "number of dumps uploaded in the background while the next trackers are synchronized (0 to upload each dump before going on)"),
+                BoolParameter('adaptiveTimeouts', 'adaptive-timeouts', ('adaptive-timeouts',), False, False, "learn how long the trackers take to answer, and wait for them accordingly"),
+                IntParameter('uploadWindow', 'upload-window', ('--upload-window',), 1, False, "maximum number of chunks of the answer of the server sent to the tracker ahead of their acknowledgement (1 to wait for each of them)"),
                 ClassChooserParameter(databases.Database, 'database', 'database', ('--db', '--database'), rest.RemoteRESTDatabase, False, "database to use for synchronisation"),
                 BoolParameter('httpsOnly', 'https-only', ('https-only',), True, False, "use http if https is not available"),
                 StrParameter('fitbitServer', 'fitbit-server', ('-s', '--fitbit-server',), "client.fitbit.com", False, "server used for synchronisation"),
-                IntParameter('logSize', 'log-size', ('--log-size',), 10, False, "Amount of communication to display in case of error"),
+                StrParameter('recordFile', 'record-file', ('--record',), None, False, "file to record the messages exchanged with the radios to"),
+                StrParameter('replayFile', 'replay-file', ('--replay',), None, False, "recorded session played back by the ReplayDongle bluetooth connection"),
+                IntParameter('replaySpeed', 'replay-speed', ('--replay-speed',), 0, False, "speed of the replay, in percent of the recorded one (0 for as fast as possible)"),
+                BoolParameter('trace', 'trace', ('trace',), True, False, "trace the messages exchanged with the radios, in the debug output and for the crash reports"),
+                IntParameter('logSize', 'log-size', ('--log-size',), 10, False, "number of messages (of up to 64 bytes) kept for the report of an error"),
                 BoolParameter('syslog', 'syslog', ('syslog',), False, False, "send output to syslog instead of stderr"),
                 Argument(),
                 HardCodedUIConfig(),
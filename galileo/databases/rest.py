@@ -5,6 +5,7 @@ logger = logging.getLogger(__name__)
 
 import requests
 
+from ..netUtils import ConnectionErrorToMessage
 from ..utils import s2a
 from .xml import RemoteXMLDatabase
 from . import SyncError
@@ -34,10 +35,20 @@ class RemoteRESTDatabase(RemoteXMLDatabase):
         auth = base64.b64encode(("%s:%s" % (user, authpass)).encode('utf-8'))
         headers['Authorization'] = "Basic "  + auth.decode()
 
-        r = requests.post(url, data=megadump.toBase64(), headers=headers)
+        try:
+            r = self._session().post(url, data=megadump.toBase64(),
+                                  headers=headers, timeout=self.timeout)
+        except requests.exceptions.Timeout:
+            self.invalidateStatus()
+            raise SyncError('Timeout: no answer after %ss' % self.timeout)
+        except requests.exceptions.ConnectionError as ce:
+            self.invalidateStatus()
+            error_msg = ConnectionErrorToMessage(ce)
+            raise SyncError('ConnectionError: %s' % error_msg)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as he:
+            self.invalidateStatus()
             status_code = 500
             if getattr(he, 'response', None) is not None:
                 status_code = he.response.status_code
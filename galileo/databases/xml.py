@@ -2,6 +2,8 @@
 from __future__ import absolute_import
 
 import base64
+import threading
+import time
 
 from io import BytesIO
 
@@ -14,21 +16,43 @@ logger = logging.getLogger(__name__)
 import requests
 
 from .. import __version__
-from ..netUtils import BackOffException, ConnectionErrorToMessage, tuplesToXML, toXML, XMLToTuple
+from ..netUtils import BackOffException, ConnectionErrorToMessage, newSession, threadSession, tuplesToXML, toXML, XMLToTuple
 from ..utils import s2a
 from . import Database, SyncError
 
 
 class RemoteXMLDatabase(Database):
+    """ The uploads can happen in other threads than the status requests:
+    the state learnt from the server (server state, redirect, status
+    validity) is only accessed with the lock held, and each thread gets its
+    own session, they all share the connection pools of `session`.
+    """
     ID = '6de4df71-17f9-43ea-9854-67f842021e05'
 
-    def __init__(self, scheme, host, path, port=None):
+    def __init__(self, scheme, host, path, port=None, session=None,
+                 timeout=None, statusTTL=0):
+        """ :param session: the `requests.Session` to use, a new one is
+                            created if not given
+            :param timeout: in seconds, for the server to answer
+            :param statusTTL: in seconds, how long a successful status
+                              request is valid """
         self.scheme = scheme
         self.host = host
         self.path = path
         self._port = port
+        if session is None:
+            session = newSession()
+        self.session = session
+        self.timeout = timeout
+        self.statusTTL = statusTTL
+        self._statusTime = None
+        # Bumped each time the status gets invalidated
+        self._statusEpoch = 0
         self.server_state = None
         self._version = None
+        self._lock = threading.RLock()
+        self._thread = threading.current_thread()
+        self._local = threading.local()
 
     @property
     def port(self):
@@ -44,6 +68,17 @@ class RemoteXMLDatabase(Database):
             'port': self.port,
             'path': self.path}
 
+    def _session(self):
+        """ :returns: the session of the current thread """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            if threading.current_thread() is self._thread:
+                session = self.session
+            else:
+                session = threadSession(self.session)
+            self._local.session = session
+        return session
+
     @property
     def version(self):
         if self._version is not None:
@@ -52,6 +87,9 @@ class RemoteXMLDatabase(Database):
         return __version__
 
     def post(self, mode, dongle=None, data=None):
+        with self._lock:
+            url = self.url
+            server_state = self.server_state
         client = toXML('galileo-client', {'version': "2.0"})
         info = toXML('client-info', childs=[
             ('client-id', {}, [], self.ID),
@@ -63,8 +101,8 @@ class RemoteXMLDatabase(Database):
                 {'major': str(dongle.major),
                  'minor': str(dongle.minor)}))
         client.append(info)
-        if self.server_state is not None:
-            client.append(toXML('server-state', body=self.server_state))
+        if server_state is not None:
+            client.append(toXML('server-state', body=server_state))
         if data is not None:
             for XMLElem in tuplesToXML(data):
                 client.append(XMLElem)
@@ -75,9 +113,10 @@ class RemoteXMLDatabase(Database):
         tree.write(f, "utf-8", xml_declaration=True)
 
         logger.debug('HTTP POST=%s', f.getvalue())
-        r = requests.post(self.url,
-                          data=f.getvalue(),
-                          headers={"Content-Type": "text/xml"})
+        r = self._session().post(url,
+                              data=f.getvalue(),
+                              headers={"Content-Type": "text/xml"},
+                              timeout=self.timeout)
         f.close()
         r.raise_for_status()
 
@@ -110,15 +149,19 @@ class RemoteXMLDatabase(Database):
                     if sstag == 'min': minD = int(ssbody)
                     if sstag == 'max': maxD = int(ssbody)
                 excpt = BackOffException(minD, maxD)
+                self.invalidateStatus()
             elif stag == 'server-state':
-                self.server_state = sbody
+                with self._lock:
+                    self.server_state = sbody
             elif stag == 'redirect':
-                for schild in schilds:
-                    sstag, _, _, ssbody = schild
-                    if sstag == 'protocol': self.scheme = ssbody
-                    if sstag == 'host': self.host = ssbody
-                    if sstag == 'port': self._port = int(ssbody)
-                logger.info('Found redirect to %s' % self.url)
+                with self._lock:
+                    for schild in schilds:
+                        sstag, _, _, ssbody = schild
+                        if sstag == 'protocol': self.scheme = ssbody
+                        if sstag == 'host': self.host = ssbody
+                        if sstag == 'port': self._port = int(ssbody)
+                    logger.info('Found redirect to %s' % self.url)
+                    self.invalidateStatus()
             elif stag == 'tracker':
                 # We rely on the fact that this tag comes at last
                 if excpt is not None:
@@ -130,7 +173,30 @@ class RemoteXMLDatabase(Database):
 
         return childs
 
+    def invalidateStatus(self):
+        """ The next `requestStatus` will ask the server again """
+        with self._lock:
+            self._statusTime = None
+            self._statusEpoch += 1
+
     def requestStatus(self, allowHTTP=False):
+        with self._lock:
+            fresh = (self._statusTime is not None and
+                     time.time() - self._statusTime < self.statusTTL)
+            epoch = self._statusEpoch
+        if fresh:
+            logger.debug('Status requested less than %ds ago, skipping',
+                         self.statusTTL)
+            return True
+        if self._requestStatus(allowHTTP):
+            with self._lock:
+                # Unless invalidated by an upload in the meantime
+                if self._statusEpoch == epoch:
+                    self._statusTime = time.time()
+            return True
+        return False
+
+    def _requestStatus(self, allowHTTP):
         try:
             self.post('status')
         except requests.exceptions.ConnectionError as ce:
@@ -149,7 +215,8 @@ class RemoteXMLDatabase(Database):
             return False
 
         logger.info('Trying http as a backup.')
-        self.scheme = 'http'
+        with self._lock:
+            self.scheme = 'http'
         try:
             self.post('status')
         except requests.exceptions.ConnectionError as ce:
@@ -168,10 +235,15 @@ class RemoteXMLDatabase(Database):
             server = self.post('sync', dongle, (
                 'tracker', {'tracker-id': trackerId}, (
                     'data', {}, [], megadump.toBase64())))
+        except requests.exceptions.Timeout:
+            self.invalidateStatus()
+            raise SyncError('Timeout: no answer after %ss' % self.timeout)
         except requests.exceptions.ConnectionError as ce:
+            self.invalidateStatus()
             error_msg = ConnectionErrorToMessage(ce)
             raise SyncError('ConnectionError: %s' % error_msg)
         except requests.exceptions.HTTPError as he:
+            self.invalidateStatus()
             status_code = 500
             if getattr(he, 'response', None) is not None:
                 status_code = he.response.status_code
@@ -22,66 +22,25 @@ except ImportError as ie:
 #    raise ie
 
 from .ble import DM
+from .trace import IN, OUT, newLog, tracing
 from .utils import a2x, a2s
 
-IN, OUT = 1, -1
-
-class DataRing(object):
-    """ A 'stupid' data structure that store not more that capacity elements,
-    and keeps them in order
-
-    head points to the next spot
-    queue points to the last spot
-    fill tell us how much is filled
-    """
-    def __init__(self, capacity):
-        self.capacity = capacity
-        self.ring = [None] * self.capacity
-        self.head = 0
-        self.queue = 0
-        # We can't distinguish empty from full without the fillage
-        self.fill = 0
-
-    @property
-    def empty(self):
-        return self.fill == 0
-
-    @property
-    def full(self):
-        return self.fill == self.capacity
-
-    def add(self, data):
-        if self.capacity == 0:
-            # Special case, do nothing
-            return
-        if self.full:
-            # full, don't forget to increase the queue
-            self.queue = (self.queue + 1) % self.capacity
-        self.ring[self.head] = data
-        self.head = (self.head + 1) % self.capacity
-        self.fill = min(self.fill + 1, self.capacity)
-
-    def remove(self):
-        """ For the fun, doesnt fit into our use case """
-        if self.empty:
-            # NOOP
-            return
-        self.queue = (self.queue - 1)  % self.capacity
-
-    def getData(self):
-        if self.empty:
-            return []
-        elif self.queue < self.head:
-            return self.ring[self.queue:self.head]
-        else:
-            return self.ring[self.queue:] + self.ring[:self.head]
-
 
 class USBDevice(object):
-    def __init__(self, vid, pid):
+    def __init__(self, vid, pid, dev=None):
+        """ :param dev: the pyusb device to use, the first one found
+                        otherwise """
         self.vid = vid
         self.pid = pid
-        self._dev = None
+        self._dev = dev
+
+    @staticmethod
+    def findAll(vid, pid):
+        """ :returns: the list of all the matching pyusb devices """
+        if usb is None:
+            logger.info("pyusb does not seems to be installed")
+            return []
+        return list(usb.core.find(find_all=True, idVendor=vid, idProduct=pid))
 
     @property
     def dev(self):
@@ -167,13 +126,25 @@ class FitBitDongle(USBDevice):
     VID = 0x2687
     PID = 0xfb01
 
-    def __init__(self, logsize):
-        USBDevice.__init__(self, self.VID, self.PID)
+    def __init__(self, logsize, dev=None):
+        USBDevice.__init__(self, self.VID, self.PID, dev)
         self.hasVersion = False
         self.useEstablishLinkEx = False
         self.newerPyUSB = None
-        global log
-        log = DataRing(logsize)
+        # Each dongle keeps its own communication log
+        self.log = newLog(logsize)
+
+    @classmethod
+    def all(klass, logsize):
+        """ One instance per Fitbit dongle plugged in """
+        return [klass(logsize, dev) for dev in klass.findAll(klass.VID,
+                                                             klass.PID)]
+
+    @property
+    def name(self):
+        if self._dev is None:
+            return 'dongle'
+        return 'dongle %s:%s' % (self._dev.bus, self._dev.address)
 
     def setup(self):
         if self.dev is None:
@@ -217,7 +188,7 @@ class FitBitDongle(USBDevice):
             interface = {0x02: self.CtrlIF.bInterfaceNumber,
                          0x01: self.DataIF.bInterfaceNumber}[endpoint]
             params = (endpoint, data, interface, timeout)
-        log.add((OUT, data))
+        self.log.add(OUT, data, endpoint)
         try:
             return self.dev.write(*params)
         except TypeError:
@@ -255,11 +226,12 @@ class FitBitDongle(USBDevice):
             if not isATimeout(ue):
                 raise
             logger.info('Got an I/O Timeout (> %dms) while reading!', timeout)
-        log.add((IN, data))
+        self.log.add(IN, data, endpoint)
         return data
 
     def ctrl_write(self, msg, timeout=2000):
-        logger.debug('--> %s', msg)
+        if tracing(logger):
+            logger.debug('--> %s', msg)
         l = self.write(0x02, msg.asList(), timeout)
         if l != msg.len:
             logger.error('Bug, sent %d, had %d', l, msg.len)
@@ -271,7 +243,9 @@ class FitBitDongle(USBDevice):
         if data is not None:
             # 'None' parameter in next line means incoming
             msg = CM(None, list(data))
-        if msg is None:
+        if not tracing(logger):
+            pass
+        elif msg is None:
             logger.debug('<-- ...')
         elif isStatus(msg, logError=False):
             logger.debug('<-- %s', a2s(msg.payload))
@@ -280,7 +254,8 @@ class FitBitDongle(USBDevice):
         return msg
 
     def data_write(self, msg, timeout=2000):
-        logger.debug('==> %s', msg)
+        if tracing(logger):
+            logger.debug('==> %s', msg)
         l = self.write(0x01, msg.asList(), timeout)
         if l != msg.LENGTH:
             logger.error('Bug, sent %d, had %d', l, msg.LENGTH)
@@ -291,7 +266,8 @@ class FitBitDongle(USBDevice):
         data = self.read(0x81, DM.LENGTH, timeout)
         if data is not None:
             msg = DM(data, decode=True)
-        logger.debug('<== %s', msg or '...')
+        if tracing(logger):
+            logger.debug('<== %s', msg or '...')
         return msg
 
     _readData = data_read
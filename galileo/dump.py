@@ -1,26 +1,74 @@
 import base64
 import logging
+import mmap
+import os
+import re
+import struct
 
 logger = logging.getLogger(__name__)
 
-from .utils import a2x, a2lsbi, a2b
+from .utils import a2x, a2lsbi, a2b, x2a
 
 MICRODUMP = 3
 MEGADUMP = 13
 
 
 class CRC16(object):
-    """ A rather generic CRC16 class """
+    """ A rather generic CRC16 class
+
+    The computation is table driven: the lookup tables only depend on the
+    polynom and on the direction, they are computed once and shared between
+    all instances.
+    """
+
+    # (poly, Invert) -> tables for slice-by-8
+    _tables = {}
+
     def __init__(self, poly=0x1021, Invert=True, IV=0x0000, FV=0x0000):
         self.poly = poly
         self.value = IV
         self.FV = FV
+        self.Invert = Invert
+        self.tables = self.getTables(poly, Invert)
         if Invert:
-            self.update_byte = self.update_byte_MSB
+            self.update_byte = self.update_byte_MSB_table
+            self._update = self._update_MSB
         else:
-            self.update_byte = self.update_byte_LSB
+            self.update_byte = self.update_byte_LSB_table
+            self._update = self._update_LSB
+
+    @classmethod
+    def getTables(klass, poly, Invert):
+        """ Returns the 8 tables needed to process 8 bytes at once
+
+        tables[k][i] is the value of the register after processing the byte
+        i followed by k zero bytes, starting from a zero register.
+        """
+        key = (poly, Invert)
+        if key not in klass._tables:
+            crc = object.__new__(klass)
+            crc.poly = poly
+            first = []
+            for i in range(256):
+                crc.value = 0
+                if Invert:
+                    crc.update_byte_MSB(i)
+                else:
+                    crc.update_byte_LSB(i)
+                first.append(crc.value)
+            tables = [first]
+            for k in range(1, 8):
+                if Invert:
+                    tables.append([((v << 8) & 0xffff) ^ first[v >> 8]
+                                   for v in tables[-1]])
+                else:
+                    tables.append([(v >> 8) ^ first[v & 0xff]
+                                   for v in tables[-1]])
+            klass._tables[key] = tables
+        return klass._tables[key]
 
     def update_byte_MSB(self, byte):
+        """ bitwise implementation, used to build the tables """
         self.value ^= byte << 8
         for i in range(8):
             if self.value & 0x8000:
@@ -30,6 +78,7 @@ class CRC16(object):
         self.value &= 0xffff
 
     def update_byte_LSB(self, byte):
+        """ bitwise implementation, used to build the tables """
         self.value ^= byte
         for i in range(8):
             if self.value & 0x0001:
@@ -37,9 +86,48 @@ class CRC16(object):
             else:
                 self.value >>= 1
 
+    def update_byte_MSB_table(self, byte):
+        self.value = (((self.value << 8) & 0xffff) ^
+                      self.tables[0][(self.value >> 8) ^ byte])
+
+    def update_byte_LSB_table(self, byte):
+        self.value = (self.value >> 8) ^ self.tables[0][(self.value ^ byte) & 0xff]
+
     def update(self, array):
-        for c in array:
-            self.update_byte(c)
+        """ array can be anything that gives ints when iterated over, buffers
+        (`bytes`, `bytearray`, `memoryview`) are processed without copy """
+        try:
+            view = memoryview(array)
+        except TypeError:
+            view = memoryview(bytearray(array))
+        if view.format != 'B' or view.ndim != 1:
+            view = view.cast('B')
+        with view:
+            self._update(view)
+
+    def _update_MSB(self, view):
+        T0, T1, T2, T3, T4, T5, T6, T7 = self.tables
+        value = self.value
+        aligned = len(view) & ~7
+        it = iter(view[:aligned])
+        for b0, b1, b2, b3, b4, b5, b6, b7 in zip(it, it, it, it, it, it, it, it):
+            value = (T7[(value >> 8) ^ b0] ^ T6[(value & 0xff) ^ b1] ^
+                     T5[b2] ^ T4[b3] ^ T3[b4] ^ T2[b5] ^ T1[b6] ^ T0[b7])
+        for b in view[aligned:]:
+            value = ((value << 8) & 0xffff) ^ T0[(value >> 8) ^ b]
+        self.value = value
+
+    def _update_LSB(self, view):
+        T0, T1, T2, T3, T4, T5, T6, T7 = self.tables
+        value = self.value
+        aligned = len(view) & ~7
+        it = iter(view[:aligned])
+        for b0, b1, b2, b3, b4, b5, b6, b7 in zip(it, it, it, it, it, it, it, it):
+            value = (T7[(value & 0xff) ^ b0] ^ T6[(value >> 8) ^ b1] ^
+                     T5[b2] ^ T4[b3] ^ T3[b4] ^ T2[b5] ^ T1[b6] ^ T0[b7])
+        for b in view[aligned:]:
+            value = (value >> 8) ^ T0[(value ^ b) & 0xff]
+        self.value = value
 
     def final(self):
         return self.value ^ self.FV
@@ -76,20 +164,62 @@ class TrackerBlock(object):
     def toFile(self, filename):
         logger.debug("Dumping megadump to %s", filename)
         try:
+            data = self.data
             with open(filename, 'wt') as dumpfile:
-                for i in range(0, self.len, 20):
-                    dumpfile.write(a2x(self.data[i:i + 20]) + '\n')
+                for i in range(0, len(data), 20):
+                    dumpfile.write(a2x(data[i:i + 20]) + '\n')
                 dumpfile.write(a2x(self.footer) + '\n')
         except EnvironmentError as err:
             logger.warn("Unable to write the dump to file: %s", err)
 
 
+# The protocol uses a particular version of SLIP (RFC 1055)
+SLIP_END = 0xC0
+SLIP_ESC = 0xDB
+SLIP_ESC_ = {0xDC: SLIP_END,
+             0xDD: SLIP_ESC}
+
+
 class Dump(TrackerBlock):
-    def __init__(self, _type):
+    """ A dump as received from the tracker
+
+    The chunks are written in a receive buffer that grows geometrically, the
+    `size` parameter allows to preallocate it. `finish` gives back what is
+    left unused once the dump is complete.
+    """
+    def __init__(self, _type, size=0):
         TrackerBlock.__init__(self)
         self._type = _type
         self.crc = CRC16()
         self.esc = [0, 0]
+        self.reserve(size)
+
+    @property
+    def data(self):
+        """ A copy of what was received so far """
+        if len(self._buffer) == self._len:
+            return bytes(self._buffer)
+        with memoryview(self._buffer) as buffer:
+            return bytes(buffer[:self._len])
+
+    @data.setter
+    def data(self, value):
+        self._buffer = bytearray(value)
+        self._len = len(self._buffer)
+
+    @property
+    def len(self):
+        return self._len
+
+    def reserve(self, size):
+        """ Make sure the receive buffer can hold `size` bytes """
+        missing = size - len(self._buffer)
+        if missing > 0:
+            self._buffer.extend(bytearray(missing))
+
+    def finish(self):
+        """ Trim the unused part of the receive buffer """
+        del self._buffer[self._len:]
 
     @property
     def serial(self):
@@ -103,28 +233,35 @@ class Dump(TrackerBlock):
             return None
         return a2lsbi(self.data[15:16])
 
-    def unSLIP1(self, data):
-        """ The protocol uses a particular version of SLIP (RFC 1055) applied
-        only on the first byte of the data"""
-        END = 0xC0
-        ESC = 0xDB
-        ESC_ = {0xDC: END,
-                0xDD: ESC}
-        if data[0] == ESC:
-            # increment the escape counter
-            self.esc[data[1] - 0xDC] += 1
-            # return the escaped value
-            return bytearray([ESC_[data[1]]]) + data[2:]
-        return data
-
     def add(self, data):
-        if data[0] == 0xc0:
-            assert len(self.footer) == 0
-            self.footer = bytearray(data)
-            return
-        data = self.unSLIP1(data)
-        self.crc.update(data)
-        self.data.extend(data)
+        """ Add a chunk of data, it gets un-escaped directly into the receive
+        buffer: the protocol uses a particular version of SLIP (RFC 1055)
+        applied only on the first byte of each chunk """
+        try:
+            view = memoryview(data)
+        except TypeError:
+            view = memoryview(bytearray(data))
+        with view:
+            if view[0] == SLIP_END:
+                assert len(self.footer) == 0
+                self.footer = bytearray(view)
+                return
+            start = self._len
+            escaped = view[0] == SLIP_ESC
+            end = start + len(view) - int(escaped)
+            if end > len(self._buffer):
+                # Grow geometrically
+                self.reserve(max(end, 2 * len(self._buffer)))
+            if escaped:
+                # increment the escape counter
+                self.esc[view[1] - 0xDC] += 1
+                self._buffer[start] = SLIP_ESC_[view[1]]
+                self._buffer[start + 1:end] = view[2:]
+            else:
+                self._buffer[start:end] = view
+        with memoryview(self._buffer) as buffer:
+            self.crc.update(buffer[start:end])
+        self._len = end
 
     def isValid(self):
         if not self.footer:
@@ -152,6 +289,332 @@ class Dump(TrackerBlock):
         return base64.b64encode(a2b(self.data + self.footer)).decode('utf-8')
 
 
+class Base64Encoder(object):
+    """ Incremental base64 encoding, the input is encoded by multiples of 3
+    bytes as it comes """
+    def __init__(self):
+        self._pending = bytearray()
+        self._parts = []
+
+    def update(self, data):
+        pending = self._pending
+        pending.extend(data)
+        complete = len(pending) - len(pending) % 3
+        if complete:
+            self._parts.append(base64.b64encode(bytes(pending[:complete])))
+            del pending[:complete]
+
+    def final(self):
+        self._parts.append(base64.b64encode(bytes(self._pending)))
+        self._pending = bytearray()
+        return b''.join(self._parts).decode('utf-8')
+
+
+class TextDumpWriter(object):
+    """ Write a dump in the format of `TrackerBlock.toFile` while it is being
+    received """
+    LINE_LEN = 20
+
+    def __init__(self, filename):
+        self.filename = filename
+        logger.debug("Dumping megadump to %s", filename)
+        self._file = open(filename, 'wt')
+        self._line = bytearray()
+
+    def data(self, data):
+        line = self._line
+        line.extend(data)
+        if len(line) < self.LINE_LEN:
+            return
+        complete = len(line) - len(line) % self.LINE_LEN
+        self._file.write(''.join(a2x(line[i:i + self.LINE_LEN]) + '\n'
+                                 for i in range(0, complete, self.LINE_LEN)))
+        del line[:complete]
+
+    def footer(self, footer):
+        if self._line:
+            self._file.write(a2x(self._line) + '\n')
+            self._line = bytearray()
+        self._file.write(a2x(footer) + '\n')
+        self._file.close()
+
+    def commit(self):
+        """ The dump is valid, keep it """
+
+    def response(self, response):
+        logger.debug("Appending answer from server to %s", self.filename)
+        with open(self.filename, 'at') as dumpfile:
+            dumpfile.write('\n')
+            for i in range(0, len(response), self.LINE_LEN):
+                dumpfile.write(a2x(response[i:i + self.LINE_LEN]) + '\n')
+
+    def discard(self):
+        """ Remove the (incomplete) dump from the disk """
+        self._file.close()
+        os.remove(self.filename)
+
+
+# The header of the binary dump format:
+# magic, format version, dump type, tracker id, timestamp, transport CRC,
+# length of the data, of the footer, and of the response
+BINARY_HEADER = struct.Struct('<4sBB6sQHIHI')
+BINARY_MAGIC = b'GLDP'
+BINARY_VERSION = 1
+
+
+class BinaryDumpWriter(object):
+    """ Write a dump in the binary format while it is being received
+
+    The file is made of the header (`BINARY_HEADER`) followed by the raw
+    data, footer and response. The header is rewritten once the lengths are
+    known. With `append`, the dump gets written at the end of an existing
+    file, starting at `offset`. The file stays open until the dump is either
+    committed or discarded.
+    """
+    def __init__(self, filename, trackerId, timestamp, dumpType=MEGADUMP,
+                 append=False):
+        self.filename = filename
+        self.trackerId = bytes(bytearray.fromhex(trackerId))
+        if len(self.trackerId) != 6:
+            raise ValueError("Not a tracker id: %s" % trackerId)
+        self.timestamp = int(timestamp)
+        self.dumpType = dumpType
+        self.append = append
+        self.crc = 0
+        self.dataLen = 0
+        self.footerLen = 0
+        self.responseLen = 0
+        logger.debug("Dumping megadump to %s", filename)
+        if append and os.path.exists(filename):
+            self._file = open(filename, 'r+b')
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(filename, 'wb')
+        self.offset = self._file.tell()
+        self._file.write(self._header())
+
+    def _header(self):
+        return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, self.dumpType,
+                                  self.trackerId, self.timestamp, self.crc,
+                                  self.dataLen, self.footerLen,
+                                  self.responseLen)
+
+    def data(self, data):
+        self._file.write(data)
+        self.dataLen += len(data)
+
+    @property
+    def size(self):
+        return (BINARY_HEADER.size + self.dataLen + self.footerLen +
+                self.responseLen)
+
+    def footer(self, footer):
+        self._file.write(footer)
+        self.footerLen = len(footer)
+        if len(footer) >= 5:
+            self.crc = a2lsbi(footer[3:5])
+        self._file.seek(self.offset)
+        self._file.write(self._header())
+        self._file.seek(0, os.SEEK_END)
+        self._file.flush()
+
+    def commit(self):
+        """ The dump is valid, keep it """
+        self._file.close()
+
+    def response(self, response):
+        logger.debug("Appending answer from server to %s", self.filename)
+        with open(self.filename, 'r+b') as dumpfile:
+            dumpfile.seek(self.offset + self.size)
+            dumpfile.write(bytes(bytearray(response)))
+            self.responseLen += len(response)
+            dumpfile.seek(self.offset)
+            dumpfile.write(self._header())
+
+    def discard(self):
+        """ Remove the dump from the disk, an appended one is only cut off
+        while it is still at the end of the file """
+        self._file.close()
+        if not self.append:
+            os.remove(self.filename)
+        elif os.path.getsize(self.filename) == self.offset + self.size:
+            with open(self.filename, 'r+b') as f:
+                f.truncate(self.offset)
+
+
+def writeBinaryDump(filename, trackerId, timestamp, dumpType, data, footer,
+                    response=None):
+    """ Write a complete dump in the binary format, the file only shows up
+    once complete """
+    tmpname = filename + '.tmp'
+    writer = BinaryDumpWriter(tmpname, trackerId, timestamp, dumpType)
+    try:
+        writer.data(bytes(data))
+        writer.footer(bytes(footer))
+        writer.commit()
+        if response:
+            writer.response(response)
+    except:
+        writer.discard()
+        raise
+    os.rename(tmpname, filename)
+
+
+class BinaryDump(object):
+    """ A dump in the binary format, `data`, `footer` and `response` are
+    memoryviews over `buffer`, starting at `offset`. For a dump mapped from
+    a file, they (and their slices) are only valid until it is closed (the
+    end of the ``with`` block), copy what is needed longer. """
+    def __init__(self, buffer, offset=0):
+        (magic, version, self.dumpType, trackerId, self.timestamp, self.crc,
+         dataLen, footerLen, responseLen) = BINARY_HEADER.unpack_from(
+             buffer, offset)
+        if magic != BINARY_MAGIC:
+            raise ValueError("Not a binary dump: %r" % magic)
+        if version != BINARY_VERSION:
+            raise ValueError("Unsupported binary dump version: %d" % version)
+        self.trackerId = a2x(bytearray(trackerId), delim='')
+        self._view = memoryview(buffer)
+        start = offset + BINARY_HEADER.size
+        self.data = self._view[start:start + dataLen]
+        start += dataLen
+        self.footer = self._view[start:start + footerLen]
+        start += footerLen
+        self.response = self._view[start:start + responseLen]
+        self.size = start + responseLen - offset
+        self._file = None
+        self._mmap = None
+
+    @classmethod
+    def fromFile(klass, filename):
+        """ Map the file in memory, nothing is copied """
+        f = open(filename, 'rb')
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            f.close()
+            raise
+        dump = klass(m)
+        dump._file = f
+        dump._mmap = m
+        return dump
+
+    def toDump(self):
+        """ Returns a `Dump` object with a copy of the data """
+        dump = Dump(self.dumpType)
+        dump.data = self.data
+        dump.crc.update(self.data)
+        dump.footer = bytearray(self.footer)
+        return dump
+
+    def close(self):
+        for view in (self.data, self.footer, self.response, self._view):
+            view.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # It gets unmapped once the last of them is gone
+                logger.warning("Views on the dump from %s still in use after"
+                               " closing it", self._file.name)
+            self._file.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def readTextDump(f):
+    """ Read a dump in the format of `TrackerBlock.toFile` from the file
+    object `f`.
+    :returns: a tuple (data, footer, response) of bytearrays
+    """
+    pieces = f.read().strip().split('\n\n')
+    dump = pieces[0].strip()
+    # The footer is the last line
+    split = dump.rfind('\n')
+    data = x2a(dump[:split]) if split > 0 else bytearray()
+    footer = x2a(dump[split + 1:])
+    response = bytearray()
+    if len(pieces) > 1 and pieces[1].strip():
+        response = x2a(pieces[1].strip())
+    return data, footer, response
+
+
+def convertTextDump(filename, binFilename=None, trackerId=None, timestamp=None):
+    """ Convert a `dump-<timestamp>.txt` file into the binary format
+
+    The tracker id defaults to the name of the directory the file is in, and
+    the timestamp is taken from the filename.
+    """
+    if binFilename is None:
+        binFilename = os.path.splitext(filename)[0] + '.bin'
+    if trackerId is None:
+        trackerId = os.path.basename(os.path.dirname(os.path.abspath(filename)))
+    if timestamp is None:
+        match = re.search(r'dump-(\d+)', os.path.basename(filename))
+        timestamp = int(match.group(1)) if match else 0
+    with open(filename, 'rt') as f:
+        data, footer, response = readTextDump(f)
+    dumpType = footer[2] if len(footer) > 2 else MEGADUMP
+    writeBinaryDump(binFilename, trackerId, timestamp, dumpType, data,
+                    footer, response)
+    return binFilename
+
+
+class StreamingDump(Dump):
+    """ A Dump that gets archived by `writer` and base64 encoded while it is
+    received, the data to upload is ready as soon as the footer arrives. """
+    def __init__(self, _type, writer=None, size=0):
+        Dump.__init__(self, _type, size)
+        self.writer = writer
+        self._base64 = Base64Encoder()
+        self._encoded = None
+
+    def _write(self, method, *args):
+        if self.writer is None:
+            return
+        try:
+            getattr(self.writer, method)(*args)
+        except EnvironmentError as err:
+            logger.warn("Unable to write the dump to file: %s", err)
+            self.writer = None
+
+    def add(self, data):
+        start = self._len
+        Dump.add(self, data)
+        if self.footer and self._encoded is None:
+            self._base64.update(self.footer)
+            self._encoded = self._base64.final()
+            self._write('footer', self.footer)
+            return
+        with memoryview(self._buffer) as buffer:
+            chunk = buffer[start:self._len]
+            self._base64.update(chunk)
+            self._write('data', chunk)
+
+    def commit(self):
+        """ The dump is valid, keep its archive """
+        self._write('commit')
+
+    def response(self, response):
+        """ Archive the answer from the server """
+        self._write('response', response)
+
+    def discard(self):
+        """ The dump is not valid, forget about its archive """
+        self._write('discard')
+        self.writer = None
+
+    def toBase64(self):
+        if self._encoded is not None:
+            return self._encoded
+        return Dump.toBase64(self)
+
+
 class DumpResponse(TrackerBlock):
     def __init__(self, data, chunk_len):
         TrackerBlock.__init__(self)
@@ -0,0 +1,225 @@
+"""\
+The various ways to keep the dumps on disk
+
+A store gives a writer (see `TextDumpWriter`) for each new dump, the writer
+is then fed while the dump is received, and finally either committed or
+discarded depending on the validity of the dump.
+"""
+
+import collections
+import logging
+import mmap
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+
+from .dump import (MEGADUMP, BINARY_HEADER, BINARY_MAGIC, BINARY_VERSION,
+                   BinaryDump, BinaryDumpWriter, TextDumpWriter)
+
+
+class DumpStore(object):
+    def __init__(self, dumpDir):
+        self.dumpDir = os.path.expanduser(dumpDir)
+
+    def trackerDir(self, trackerId):
+        dirname = os.path.join(self.dumpDir, trackerId)
+        if not os.path.exists(dirname):
+            logger.debug("Creating non-existent directory for dumps %s",
+                         dirname)
+            os.makedirs(dirname)
+        return dirname
+
+    def newDump(self, trackerId, timestamp, dumpType=MEGADUMP):
+        """ :returns: a writer for a new dump """
+        raise NotImplementedError("This is a method of an abstract class!")
+
+    def close(self):
+        """ Called once the synchronisation is over """
+
+
+class TextDumpStore(DumpStore):
+    """ One text file (dump-<timestamp>.txt) per dump """
+    def newDump(self, trackerId, timestamp, dumpType=MEGADUMP):
+        return TextDumpWriter(os.path.join(self.trackerDir(trackerId),
+                                           'dump-%d.txt' % int(timestamp)))
+
+
+class BinaryDumpStore(DumpStore):
+    """ One binary file (dump-<timestamp>.bin) per dump """
+    def newDump(self, trackerId, timestamp, dumpType=MEGADUMP):
+        return BinaryDumpWriter(os.path.join(self.trackerDir(trackerId),
+                                             'dump-%d.bin' % int(timestamp)),
+                                trackerId, timestamp, dumpType)
+
+
+# timestamp, kind, segment number, offset in the segment, length
+INDEX_ENTRY = struct.Struct('<QBIQI')
+IndexEntry = collections.namedtuple('IndexEntry', 'timestamp kind segment'
+                                    ' offset length')
+DUMP, RESPONSE = 0, 1
+
+
+class SegmentDumpWriter(BinaryDumpWriter):
+    """ Writes a dump at the end of the current segment of the store """
+    def __init__(self, store, trackerId, timestamp, dumpType=MEGADUMP):
+        self.store = store
+        self.trackerIdStr = trackerId
+        self.segment = store.currentSegment(trackerId)
+        self.entry = None
+        BinaryDumpWriter.__init__(
+            self, store.segmentName(trackerId, self.segment), trackerId,
+            timestamp, dumpType, append=True)
+
+    def commit(self):
+        BinaryDumpWriter.commit(self)
+        self.entry = IndexEntry(self.timestamp, DUMP, self.segment,
+                                self.offset, self.size)
+        self.store.addEntry(self.trackerIdStr, self.entry, self.filename)
+
+    def discard(self):
+        if self.entry is not None:
+            self.store.removeEntry(self.trackerIdStr, self.entry)
+            self.entry = None
+        BinaryDumpWriter.discard(self)
+
+    def response(self, response):
+        self.store.addResponse(self.trackerIdStr, self.timestamp, response)
+
+
+class SegmentDumpStore(DumpStore):
+    """ The dumps of a tracker are appended to segment files, which are
+    rotated once they reach `segmentSize`. The index file allows to find the
+    dumps by time, its entries (`INDEX_ENTRY`) are sorted by timestamp.
+    The responses are stored as separate records with the timestamp of
+    their dump.
+
+    The files are only synced to the disk every `syncEvery` records.
+    """
+    SEGMENT_SIZE = 16 * 1024 * 1024
+    SYNC_EVERY = 16
+
+    def __init__(self, dumpDir, segmentSize=SEGMENT_SIZE, syncEvery=SYNC_EVERY):
+        DumpStore.__init__(self, dumpDir)
+        self.segmentSize = segmentSize
+        self.syncEvery = syncEvery
+        self._segments = {}
+        self._dirty = set()
+        self._unsynced = 0
+
+    def segmentName(self, trackerId, segment):
+        return os.path.join(self.trackerDir(trackerId),
+                            'segment-%06d.seg' % segment)
+
+    def indexName(self, trackerId):
+        return os.path.join(self.trackerDir(trackerId), 'index')
+
+    def currentSegment(self, trackerId):
+        """ The segment the next record goes to """
+        if trackerId not in self._segments:
+            segments = [int(name[8:14]) for name in os.listdir(
+                self.trackerDir(trackerId)) if name.startswith('segment-')]
+            self._segments[trackerId] = max(segments or [0])
+        segment = self._segments[trackerId]
+        filename = self.segmentName(trackerId, segment)
+        if (os.path.exists(filename) and
+                os.path.getsize(filename) >= self.segmentSize):
+            segment += 1
+            logger.debug("Rotating to segment %d for tracker %s", segment,
+                         trackerId)
+            self._segments[trackerId] = segment
+        return segment
+
+    def newDump(self, trackerId, timestamp, dumpType=MEGADUMP):
+        return SegmentDumpWriter(self, trackerId, timestamp, dumpType)
+
+    def addResponse(self, trackerId, timestamp, response):
+        response = bytes(bytearray(response))
+        segment = self.currentSegment(trackerId)
+        filename = self.segmentName(trackerId, segment)
+        logger.debug("Appending answer from server to %s", filename)
+        with open(filename, 'ab') as f:
+            offset = f.tell()
+            f.write(BINARY_HEADER.pack(
+                BINARY_MAGIC, BINARY_VERSION, 0,
+                bytes(bytearray.fromhex(trackerId)), int(timestamp), 0, 0, 0,
+                len(response)))
+            f.write(response)
+        self.addEntry(trackerId, IndexEntry(
+            int(timestamp), RESPONSE, segment, offset,
+            BINARY_HEADER.size + len(response)), filename)
+
+    def addEntry(self, trackerId, entry, segmentName):
+        indexName = self.indexName(trackerId)
+        with open(indexName, 'ab') as f:
+            f.write(INDEX_ENTRY.pack(*entry))
+        self._dirty.update((segmentName, indexName))
+        self._unsynced += 1
+        if self._unsynced >= self.syncEvery:
+            self.sync()
+
+    def removeEntry(self, trackerId, entry):
+        """ Forget about an entry of the index, usually the last one """
+        indexName = self.indexName(trackerId)
+        record = INDEX_ENTRY.pack(*entry)
+        with open(indexName, 'r+b') as f:
+            index = f.read()
+            for pos in range(len(index) - INDEX_ENTRY.size, -1,
+                             -INDEX_ENTRY.size):
+                if index[pos:pos + INDEX_ENTRY.size] == record:
+                    f.seek(pos)
+                    f.write(index[pos + INDEX_ENTRY.size:])
+                    f.truncate()
+                    break
+        self._dirty.add(indexName)
+
+    def sync(self):
+        """ Make sure everything written so far is on the disk """
+        for filename in self._dirty:
+            with open(filename, 'rb') as f:
+                os.fsync(f.fileno())
+        self._dirty = set()
+        self._unsynced = 0
+
+    def close(self):
+        self.sync()
+
+    def find(self, trackerId, start=0, end=None):
+        """ :returns: the `IndexEntry`s with start <= timestamp < end """
+        indexName = self.indexName(trackerId)
+        if not os.path.exists(indexName) or os.path.getsize(indexName) == 0:
+            return []
+        with open(indexName, 'rb') as f:
+            index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            count = len(index) // INDEX_ENTRY.size
+            entries = []
+            i = self._bisect(index, count, start)
+            while i < count:
+                entry = IndexEntry(*INDEX_ENTRY.unpack_from(
+                    index, i * INDEX_ENTRY.size))
+                if end is not None and entry.timestamp >= end:
+                    break
+                entries.append(entry)
+                i += 1
+            return entries
+        finally:
+            index.close()
+
+    @staticmethod
+    def _bisect(index, count, timestamp):
+        """ The position of the first entry not older than timestamp """
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if INDEX_ENTRY.unpack_from(index, mid * INDEX_ENTRY.size)[0] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def read(self, trackerId, entry):
+        """ :returns: the `BinaryDump` for the index entry """
+        with open(self.segmentName(trackerId, entry.segment), 'rb') as f:
+            f.seek(entry.offset)
+            return BinaryDump(bytearray(f.read(entry.length)))
@@ -93,6 +93,7 @@ def main(_config):
 
 from .ble import DM
 from .dongle import CM
+from .trace import OUT, readCommLog
 from .utils import x2a
 
 import uuid
@@ -104,7 +105,7 @@ tracker = None
 @command('s', "Setup the bluetooth connection")
 def connect():
     global fitbit
-    fitbit = config.bluetoothConn(0)
+    fitbit = config.bluetoothConn(config.logSize)
     fitbit.setup()
     print('Ok')
 
@@ -213,3 +214,32 @@ def getDump(type="13"):
 def uploadResponse(*response):
     response = x2a(' '.join(response))
     fitbit.uploadResponse(response)
+
+@command('W', "Write the communication log to a file")
+@needfitbit
+def writeLog(filename='galileo.comlog'):
+    fitbit.log.dump(filename)
+    print('%d messages written to %s' % (len(fitbit.log), filename))
+
+@command('P', "Replay the messages sent in a communication log file")
+@needfitbit
+def replayLog(filename='galileo.comlog'):
+    for direction, endpoint, timestamp, data in readCommLog(filename):
+        if direction == OUT:
+            if endpoint == 0x02:
+                m = CM(None, list(data))
+                fitbit.ctrl_write(CM(m.INS, m.payload))
+            else:
+                fitbit._writeData(DM(data, decode=True))
+            continue
+        # The answer we got at the time
+        if endpoint == 0x82:
+            expected = CM(None, list(data)) if data else None
+            received = fitbit.ctrl_read()
+        else:
+            expected = DM(data, decode=True) if data else None
+            received = fitbit._readData()
+        if received == expected or (received is None and expected is None):
+            print('Same answer: %s' % received)
+        else:
+            print('Different answer: %s, was: %s' % (received, expected))
@@ -3,6 +3,7 @@ from __future__ import print_function
 import datetime
 import os
 import sys
+import threading
 import time
 import uuid
 
@@ -10,137 +11,501 @@ import logging
 import logging.handlers
 logger = logging.getLogger(__name__)
 
+try:
+    from concurrent import futures
+except ImportError:
+    # python2 without the 'futures' backport
+    futures = None
+try:
+    import queue
+except ImportError:
+    # python2
+    import Queue as queue
+
 import requests
 
 from . import __version__
 from .config import Config, ConfigError
+from .ble import UploadWindows
 from .conversation import Conversation
 from .databases import SyncError
-from .dump import MEGADUMP
-from .netUtils import BackOffException
+from .dump import MEGADUMP, StreamingDump
+from .netUtils import BackOffException, newSession
+from .registry import TrackerRegistry
+from .timeouts import TimeoutPolicy
 from .ui import InteractiveUI
 from .utils import a2x
 from . import dongle as dgl
+from . import radio
+from . import replay
+from . import trace
 from . import interactive
 
 FitBitUUID = uuid.UUID('{ADAB0000-6E7D-4601-BDA2-BFFAA68956BA}')
+# The parameters of `API.discover`, but the timeout
+DISCOVERY = (FitBitUUID, 0xfb00, 0xfb01, 0xfb02, -255)
 
 
 def syncAllTrackers(config):
-    logger.debug('%s initialising', os.path.basename(sys.argv[0]))
-    fitbit = config.bluetoothConn(config.logSize)
-    if not fitbit.setup():
-        logger.error("No dongle connected, aborting")
-        return
+    """ One synchronisation of all the trackers """
+    session = SyncSession(config)
+    try:
+        for tracker in session.sync():
+            yield tracker
+    finally:
+        session.close()
 
-    galileo = config.database('https', config.fitbitServer,
-                              'tracker/client/message')
 
+def prepareRadio(fitbit):
+    """ :returns: False if the radio can't be used """
     if not fitbit.disconnectAll():
         logger.error("Dirty state, not able to start synchronisation.")
-        return
+        return False
 
     if not fitbit.getHardwareInfo():
         logger.warning('Failed to get connected Fitbit dongle information')
+    return True
+
+
+class SyncSession(object):
+    """ The radios (Fitbit dongles or bluetooth adapters) with their database
+    and dump store. They are set up once and kept across the
+    synchronisations (in daemon mode), until something goes wrong.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.radios = []
+        self.databases = {}
+        self.stores = {}
+        # Did the last synchronisation go to the end ?
+        self.clean = False
+        # Once set, the radio workers stop after their current tracker
+        self.stopping = threading.Event()
+        # Kept with the dumps
+        dumpDir = config.dumpDir if config.keepDumps else None
+        self.registry = TrackerRegistry(dumpDir)
+        self.timeouts = None
+        if config.adaptiveTimeouts:
+            self.timeouts = TimeoutPolicy(dumpDir)
+        # What is learnt about the trackers is shared by all the radios
+        self.uploadWindows = UploadWindows(config.uploadWindow, dumpDir)
+
+    def setup(self):
+        """ :returns: False if no radio can be used """
+        config = self.config
+        logger.debug('%s initialising', os.path.basename(sys.argv[0]))
+        if config.multiRadio:
+            radios = [r for r in config.bluetoothConn.all(config.logSize)
+                      if r.setup()]
+        else:
+            fitbit = config.bluetoothConn(config.logSize)
+            radios = [fitbit] if fitbit.setup() else []
+        if not radios:
+            logger.error("No dongle connected, aborting")
+            return False
+
+        if config.recordFile:
+            for i, fitbit in enumerate(radios):
+                filename = config.recordFile
+                if len(radios) > 1:
+                    filename = '%s.%d' % (filename, i + 1)
+                logger.info('Recording the session with %s to %s',
+                            fitbit.name, filename)
+                fitbit.log = replay.Recorder(fitbit.log, filename)
+
+        self.radios = []
+        for fitbit in radios:
+            if prepareRadio(fitbit):
+                self.radios.append(fitbit)
+                continue
+            logger.warning('Not using %s: it could not be brought back to'
+                           ' a clean state', fitbit.name)
+            if isinstance(getattr(fitbit, 'log', None), replay.Recorder):
+                fitbit.log.close()
+            fitbit.close()
+        for fitbit in self.radios:
+            fitbit.uploadWindows = self.uploadWindows
+            fitbit.timeouts = self.timeouts
+        # The connections to the server are shared by all the radios
+        session = newSession(config.httpPoolSize, config.httpKeepAlive)
+        # ... and so is what the server told (state, redirect, status)
+        database = config.database(
+            'https', config.fitbitServer, 'tracker/client/message',
+            session=session, timeout=config.httpTimeout / 1000.,
+            statusTTL=config.statusTTL / 1000.)
+        for fitbit in self.radios:
+            self.databases[fitbit] = database
+            self.stores[fitbit] = None
+            if config.keepDumps:
+                self.stores[fitbit] = config.dumpStore(config.dumpDir)
+        self.clean = True
+        return bool(self.radios)
+
+    def close(self):
+        """ The session is over, finish the recordings and release the
+        radios """
+        for fitbit in self.radios:
+            if isinstance(getattr(fitbit, 'log', None), replay.Recorder):
+                fitbit.log.close()
+            fitbit.close()
+
+    def reset(self):
+        """ Start from scratch next time """
+        logger.info('Resetting the synchronisation session')
+        self.close()
+        self.radios = []
+        self.databases = {}
+        self.stores = {}
+
+    def sync(self):
+        """ Synchronise all the trackers
+        :returns: a generator of the trackers
+        """
+        if not self.radios:
+            if not self.setup():
+                return
+        elif not self.clean:
+            logger.info('Last synchronisation was interrupted, cleaning up')
+            if not all(prepareRadio(r) for r in self.radios):
+                self.reset()
+                if not self.setup():
+                    return
+        self.clean = False
+        trackers = None
+        try:
+            if len(self.radios) == 1:
+                trackers = self._syncOne(self.radios[0])
+            else:
+                trackers = self._syncAll()
+            for tracker in trackers:
+                yield tracker
+        except BackOffException:
+            # Only the server is concerned
+            raise
+        except Exception:
+            self.reset()
+            raise
+        finally:
+            if trackers is not None:
+                # Waits for the workers when interrupted
+                trackers.close()
+            if self.timeouts is not None:
+                self.timeouts.save()
+            self.uploadWindows.save()
+            for fitbit in self.radios:
+                if isinstance(getattr(fitbit, 'log', None), replay.Recorder):
+                    fitbit.log.flush()
+        self.clean = True
+
+    def _syncTrackers(self, fitbit, trackers):
+        return syncTrackers(self.config, fitbit, trackers,
+                            self.databases[fitbit], self.stores[fitbit])
+
+    def _discovery(self):
+        """ :returns: the args and the trackers expected for `API.discover`
+        """
+        config = self.config
+        timeout = config.discoveryTimeout
+        expected = None
+        if config.adaptiveDiscovery:
+            if config.includeTrackers is not None:
+                expected = set(config.includeTrackers)
+            else:
+                expected = self.registry.known() - set(config.excludeTrackers)
+            timeout = self.registry.timeout(timeout)
+        logger.debug('Discovery timeout: %dms, expecting %s', timeout,
+                     ', '.join(sorted(expected)) if expected else 'anything')
+        return DISCOVERY + (timeout,), expected or None
+
+    def _syncOne(self, fitbit):
+        logger.info('Discovering trackers to synchronize')
+
+        args, expected = self._discovery()
+        trackers = [t for t in self.registry.watch(
+            fitbit.discover(*args, expected=expected), expected)]
+        self.registry.save()
+
+        logger.info('%d trackers discovered', len(trackers))
+        for tracker in trackers:
+            logger.debug('Discovered tracker with ID %s', tracker.id)
+
+        return self._syncTrackers(fitbit, trackers)
+
+    def _syncAll(self):
+        """ One worker per radio """
+        radios = self.radios
+        logger.info('Using %d radios: %s', len(radios),
+                    ', '.join(r.name for r in radios))
+
+        logger.info('Discovering trackers to synchronize')
+        args, expected = self._discovery()
+        assignment = radio.assignTrackers(radios, radio.discoverAll(
+            radios, *args, expected=expected, registry=self.registry))
+        self.registry.save()
+        logger.info('%d trackers discovered',
+                    sum(len(ts) for ts in assignment.values()))
+
+        if not self.config.bluetoothConn.threadSafe:
+            logger.info("%s can't be used in parallel, one radio after"
+                        " the other", self.config.bluetoothConn.__name__)
+            for fitbit in radios:
+                for tracker in self._syncTrackers(fitbit, assignment[fitbit]):
+                    yield tracker
+            return
+
+        # The workers put (tracker, None), (None, exception) when they fail,
+        # and (None, None) when they're done
+        results = queue.Queue()
+        self.stopping.clear()
+
+        def worker(fitbit, trackers):
+            synced = self._syncTrackers(fitbit, trackers)
+            try:
+                for tracker in synced:
+                    results.put((tracker, None))
+                    if self.stopping.is_set():
+                        break
+            except Exception as e:
+                logger.error('Synchronisation with %s failed', fitbit.name)
+                if hasattr(fitbit, 'log'):
+                    logCommunications(fitbit.log, logging.ERROR)
+                results.put((None, e))
+            finally:
+                synced.close()
+            results.put((None, None))
+
+        threads = []
+        for fitbit in radios:
+            thread = threading.Thread(target=worker, name=fitbit.name,
+                                      args=(fitbit, assignment[fitbit]))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # The radios are only given up once no worker uses them anymore
+        error = None
+        try:
+            running = len(threads)
+            while running:
+                tracker, e = results.get()
+                if e is not None:
+                    if error is None:
+                        error = e
+                        self.stopping.set()
+                elif tracker is None:
+                    running -= 1
+                else:
+                    yield tracker
+        finally:
+            self.stopping.set()
+            for thread in threads:
+                thread.join()
+        if error is not None:
+            raise error
+
+
+def syncTrackers(config, fitbit, trackers, galileo, store=None):
+    """ Synchronise the `trackers` using `fitbit`, the dumps go to the
+    `galileo` database and the `store` (if any) """
+    executor = None
+    if config.doUpload and config.uploadWorkers > 0:
+        if futures is None:
+            logger.warning("concurrent.futures not available, uploading"
+                           " sequentially")
+        else:
+            executor = futures.ThreadPoolExecutor(config.uploadWorkers)
+    # (tracker, dump, future) of the dumps being uploaded in the background
+    pending = []
 
-    logger.info('Discovering trackers to synchronize')
-
-    trackers = [t for t in fitbit.discover(FitBitUUID, 0xfb00, 0xfb01, 0xfb02, -255, 4000)]
+    try:
+        for tracker in trackers:
 
-    logger.info('%d trackers discovered', len(trackers))
-    for tracker in trackers:
-        logger.debug('Discovered tracker with ID %s', tracker.id)
+            # Give their answer to the trackers whose upload is over
+            for t in collectUploads(fitbit, pending, False):
+                yield t
 
-    for tracker in trackers:
+            # Skip this tracker based on include/exclude lists.
+            if config.shouldSkip(tracker):
+                logger.info('Tracker %s skipped due to configuration', tracker.id)
+                yield tracker
+                continue
 
-        # Skip this tracker based on include/exclude lists.
-        if config.shouldSkip(tracker):
-            logger.info('Tracker %s skipped due to configuration', tracker.id)
-            yield tracker
-            continue
+            logger.info('Attempting to synchronize tracker %s', tracker.id)
 
-        logger.info('Attempting to synchronize tracker %s', tracker.id)
+            if config.doUpload:
+                logger.debug('Connecting to Fitbit server and requesting status')
+                if not galileo.requestStatus(not config.httpsOnly):
+                    yield tracker
+                    break
 
-        if config.doUpload:
-            logger.debug('Connecting to Fitbit server and requesting status')
-            if not galileo.requestStatus(not config.httpsOnly):
+            dump = downloadDump(fitbit, tracker, store)
+            if dump is None:
                 yield tracker
-                break
-
-        logger.debug('Establishing link with tracker')
-        if not fitbit.connect(tracker):
-            logger.warning('Unable to connect with tracker %s. Skipping',
-                           tracker.id)
-            fitbit.disconnect(tracker)
-            tracker.status = 'Unable to establish a connection.'
+                continue
+
+            if not config.doUpload:
+                logger.info("Not uploading, as asked ...")
+            elif executor is not None:
+                # The radio goes on with the next tracker during the upload,
+                # we'll reconnect to give the answer.
+                logger.info('Sending tracker data to Fitbit in the background')
+                disconnect(fitbit, tracker)
+                pending.append((tracker, dump, executor.submit(
+                    galileo.sync, fitbit, tracker.id, dump)))
+                continue
+            else:
+                logger.info('Sending tracker data to Fitbit')
+                try:
+                    response = galileo.sync(fitbit, tracker.id, dump)
+                except SyncError as e:
+                    syncFailed(tracker, e)
+                else:
+                    pushResponse(fitbit, tracker, dump, response)
+
+            disconnect(fitbit, tracker)
             yield tracker
-            continue
 
-        #fitbit.displayCode()
-        #time.sleep(5)
+        for t in collectUploads(fitbit, pending, True):
+            yield t
+
+    except GeneratorExit:
+        # Not reported anymore, but the trackers whose dump is being
+        # uploaded still get their answer
+        for t in collectUploads(fitbit, pending, True):
+            logger.info('Tracker %s: %s', t.id, t.status)
+        raise
+    finally:
+        if executor is not None:
+            # Only left on errors
+            for tracker, dump, future in pending:
+                future.cancel()
+                tracker.status = ("Synchronisation interrupted before the"
+                                  " answer from the server")
+                logger.warning('Tracker %s: %s', tracker.id, tracker.status)
+            executor.shutdown(True)
+        if store is not None:
+            # Flush what got written
+            store.close()
+
+
+def downloadDump(fitbit, tracker, store):
+    """ Connect to the tracker and get its megadump
+    :returns: the dump, or None (the tracker is then disconnected)
+    """
+    logger.debug('Establishing link with tracker')
+    if not fitbit.connect(tracker):
+        logger.warning('Unable to connect with tracker %s. Skipping',
+                       tracker.id)
+        fitbit.disconnect(tracker)
+        tracker.status = 'Unable to establish a connection.'
+        return None
+
+    #fitbit.displayCode()
+    #time.sleep(5)
+
+    writer = None
+    if store is not None:
+        # Write the dump somewhere for archiving ...
+        try:
+            writer = store.newDump(tracker.id, time.time())
+        except EnvironmentError as err:
+            logger.warn("Unable to write the dump to file: %s", err)
+    else:
+        logger.debug("Not dumping anything to disk")
+
+    logger.info('Getting data from tracker')
+    # The dump gets archived and encoded for upload while it is received
+    streaming = StreamingDump(MEGADUMP, writer)
+    dump = fitbit.getDump(MEGADUMP, streaming)
+    if dump is None:
+        logger.error("Error downloading the dump from tracker")
+        streaming.discard()
+        fitbit.disconnect(tracker)
+        tracker.status = "Failed to download the dump"
+    else:
+        streaming.commit()
+    return dump
+
 
-        logger.info('Getting data from tracker')
-        dump = fitbit.getDump(MEGADUMP)
-        if dump is None:
-            logger.error("Error downloading the dump from tracker")
-            fitbit.disconnect(tracker)
-            tracker.status = "Failed to download the dump"
-            yield tracker
-            continue
+def syncFailed(tracker, e):
+    logger.error("Fitbit server refused data from tracker %s,"
+                 " reason: %s", tracker.id, e.errorstring)
+    tracker.status = "Synchronisation failed: %s" % e.errorstring
 
-        if config.keepDumps:
-            # Write the dump somewhere for archiving ...
-            dirname = os.path.expanduser(os.path.join(config.dumpDir,
-                                                      tracker.id))
-            if not os.path.exists(dirname):
-                logger.debug("Creating non-existent directory for dumps %s",
-                             dirname)
-                os.makedirs(dirname)
-
-            filename = os.path.join(dirname, 'dump-%d.txt' % int(time.time()))
-            dump.toFile(filename)
-        else:
-            logger.debug("Not dumping anything to disk")
 
-        if not config.doUpload:
-            logger.info("Not uploading, as asked ...")
-        else:
-            logger.info('Sending tracker data to Fitbit')
-            try:
-                response = galileo.sync(fitbit, tracker.id, dump)
-
-                if config.keepDumps:
-                    logger.debug("Appending answer from server to %s",
-                                 filename)
-                    with open(filename, 'at') as dumpfile:
-                        dumpfile.write('\n')
-                        for i in range(0, len(response), 20):
-                            dumpfile.write(a2x(response[i:i + 20]) + '\n')
-
-                # Even though the next steps might fail, fitbit has accepted
-                # the data at this point.
-                tracker.status = "Dump successfully uploaded"
-                logger.info('Successfully sent tracker data to Fitbit')
-
-                logger.info('Passing Fitbit response to tracker')
-                if not fitbit.uploadResponse(response):
-                    logger.warning("Error while trying to give Fitbit response"
-                                   " to tracker %s", tracker.id)
-                    tracker.status = "Failed to upload fitbit response to tracker"
-                else:
-                    tracker.status = "Synchronisation successful"
+def pushResponse(fitbit, tracker, dump, response):
+    """ Give the answer from the server to the (connected) tracker """
+    dump.response(response)
 
-            except SyncError as e:
-                logger.error("Fitbit server refused data from tracker %s,"
-                             " reason: %s", tracker.id, e.errorstring)
-                tracker.status = "Synchronisation failed: %s" % e.errorstring
+    # Even though the next steps might fail, fitbit has accepted
+    # the data at this point.
+    tracker.status = "Dump successfully uploaded"
+    logger.info('Successfully sent tracker data to Fitbit')
 
-        logger.debug('Disconnecting from tracker')
-        if not fitbit.disconnect(tracker):
-            logger.warning('Error while disconnecting from tracker %s',
-                           tracker.id)
-            tracker.status += " (Error disconnecting)"
-        yield tracker
+    logger.info('Passing Fitbit response to tracker')
+    if not fitbit.uploadResponse(response):
+        logger.warning("Error while trying to give Fitbit response"
+                       " to tracker %s", tracker.id)
+        tracker.status = "Failed to upload fitbit response to tracker"
+    else:
+        tracker.status = "Synchronisation successful"
+
+
+def disconnect(fitbit, tracker):
+    logger.debug('Disconnecting from tracker')
+    if not fitbit.disconnect(tracker):
+        logger.warning('Error while disconnecting from tracker %s',
+                       tracker.id)
+        tracker.status += " (Error disconnecting)"
+
+
+def collectUploads(fitbit, pending, wait):
+    """ Reconnect to the trackers whose dump has been uploaded to give them
+    the answer from the server.
+    :param pending: list of (tracker, dump, future), the trackers done are
+                    removed from it.
+    :param wait: wait for all the uploads to be over
+    :returns: a generator of the trackers done
+    """
+    while pending:
+        done = [item for item in pending if item[2].done()]
+        if not done:
+            if not wait:
+                return
+            futures.wait([item[2] for item in pending],
+                         return_when=futures.FIRST_COMPLETED)
+            continue
+        for item in done:
+            pending.remove(item)
+            tracker, dump, future = item
+            try:
+                response = future.result()
+            except SyncError as e:
+                syncFailed(tracker, e)
+                yield tracker
+                continue
+            except BackOffException:
+                raise
+            except Exception as e:
+                logger.error("Upload of the dump from tracker %s failed: %s",
+                             tracker.id, e)
+                tracker.status = "Synchronisation failed: %s" % e
+                yield tracker
+                continue
+            logger.debug('Reconnecting to tracker %s to give the answer',
+                         tracker.id)
+            if not fitbit.connect(tracker):
+                logger.warning('Unable to reconnect with tracker %s',
+                               tracker.id)
+                fitbit.disconnect(tracker)
+                dump.response(response)
+                tracker.status = ("Dump successfully uploaded, but unable to"
+                                  " reconnect to give the response")
+                yield tracker
+                continue
+            pushResponse(fitbit, tracker, dump, response)
+            disconnect(fitbit, tracker)
+            yield tracker
 
 PERMISSION_DENIED_HELP = """
 To be able to run the fitbit utility as a non-privileged user, you first
@@ -154,6 +519,13 @@ The dongle must then be removed and reinserted to receive the new permissions.""
     'VID': dgl.FitBitDongle.VID, 'PID': dgl.FitBitDongle.PID}
 
 
+def logCommunications(log, level=logging.CRITICAL):
+    """ Log the content of the communication log (a `CommLog`) """
+    logger.log(level, '# Last communications:')
+    for dir, endpoint, timestamp, dat in log:
+        logger.log(level, '# %s %s' % ({trace.IN: '<', trace.OUT: '>'}.get(dir, '-'), a2x(dat)))
+
+
 def version(verbose, delim='\n'):
     s = ['%s: %s' % (sys.argv[0], __version__)]
     if verbose:
@@ -204,25 +576,47 @@ def sync(config):
     print('\n'.join(statuses))
 
 
+# Synchronisations failing in a row before the daemon gives up
+DAEMON_MAX_FAILURES = 5
+
+
 def daemon(config):
+    # The radios are set up once for all
+    session = SyncSession(config)
+    failures = 0
     goOn = True
-    while goOn:
-        try:
-            # TODO: Extract the initialization part, and do it once for all
+    try:
+        while goOn:
             try:
-                for tracker in syncAllTrackers(config):
-                    logger.info("Tracker %s: %s" % (tracker.id, tracker.status))
-            except BackOffException as boe:
-                logger.warning("Received a back-off notice from the server,"
-                               " waiting for a bit longer.")
-                time.sleep(boe.getAValue() / 1000.)
-            else:
-                logger.info("Sleeping for %d seconds before next sync",
-                            config.daemonPeriod / 1000)
-                time.sleep(config.daemonPeriod / 1000.)
-        except KeyboardInterrupt:
-            logger.info("Ctrl-C, caught, stopping ...")
-            goOn = False
+                try:
+                    for tracker in session.sync():
+                        logger.info("Tracker %s: %s" % (tracker.id, tracker.status))
+                except BackOffException as boe:
+                    logger.warning("Received a back-off notice from the server,"
+                                   " waiting for a bit longer.")
+                    time.sleep(boe.getAValue() / 1000.)
+                except EnvironmentError as ee:
+                    # USB or network trouble, the session got reset
+                    failures += 1
+                    if failures >= DAEMON_MAX_FAILURES:
+                        logger.error("%d synchronisations failed in a row,"
+                                     " giving up", failures)
+                        raise
+                    logger.error("Synchronisation failed: %s, trying again in %d"
+                                 " seconds", ee, config.daemonPeriod / 1000)
+                    if trace.last is not None:
+                        logCommunications(trace.last, logging.ERROR)
+                    time.sleep(config.daemonPeriod / 1000.)
+                else:
+                    failures = 0
+                    logger.info("Sleeping for %d seconds before next sync",
+                                config.daemonPeriod / 1000)
+                    time.sleep(config.daemonPeriod / 1000.)
+            except KeyboardInterrupt:
+                logger.info("Ctrl-C, caught, stopping ...")
+                goOn = False
+    finally:
+        session.close()
 
 
 def main():
@@ -270,6 +664,9 @@ def main():
     # --- All logger actions from now on will be effective ---
 
     logger.debug("Configuration: %s", config)
+    trace.enabled = config.trace
+    replay.ReplayDongle.filename = config.replayFile
+    replay.ReplayDongle.speed = config.replaySpeed / 100.
 
     ui = InteractiveUI(config.hardcoded_ui)
 
@@ -288,10 +685,7 @@ def main():
         logger.critical("# information on the galileo bug tracker:")
         logger.critical("#    https://github.com/benallard/galileo/issues/new")
         logger.critical('# %s', version(True, '\n# '))
-        if hasattr(dgl, 'log'):
-            logger.critical('# Last communications:')
-            for comm in dgl.log.getData():
-                dir, dat = comm
-                logger.critical('# %s %s' % ({dgl.IN: '<', dgl.OUT: '>'}.get(dir, '-'), a2x(dat or [])))
+        if trace.last is not None:
+            logCommunications(trace.last)
         logger.critical("#", exc_info=True)
         sys.exit(os.EX_SOFTWARE)
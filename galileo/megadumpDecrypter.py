@@ -1,19 +1,35 @@
-from .utils import a2msbi, i2msba, a2lsbi, i2lsba
-from .xtea import xtea_encrypt
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def ba_xor(a, b):
-    """ xor between 2 bytearrays """
-    assert len(a) == len(b)
-    return i2msba(a2msbi(a) ^ a2msbi(b), len(a))
+import struct
+
+from .utils import a2msbi, i2msba, a2lsbi, i2lsba, U64BE
+from .xtea import XTEA, WORDS
+
+def schedule(key):
+    """ Returns an `XTEA` cipher for `key`, which can already be one """
+    if isinstance(key, XTEA):
+        return key
+    return XTEA(key)
 
 class XTEA_CMAC(object):
+    """ A streaming CMAC (RFC 4493) over XTEA
+
+    Only the last (incomplete) block of the message is kept, so that the
+    memory use doesn't depend on the message length, and the chaining value
+    is kept as two 32 bits words.
+    """
+    MASK = 0xffffffff
+
     def __init__(self, key, msg=None):
-        self.key = key
-        self._iv = bytearray(8)
+        self.cipher = schedule(key)
+        self._v0, self._v1 = 0, 0
 
         # we need k1, k2
         Rb = 0x1b # 8 bytes cipher block
-        l = xtea_encrypt(key, bytearray(8))
+        l = self.cipher.encrypt_block(bytearray(8))
         self.k1 = a2msbi(l) << 1
         if (l[0] & 0x80):
             self.k1 ^= Rb
@@ -25,35 +41,57 @@ class XTEA_CMAC(object):
         self.k1 = self.k1 % 2**64
         self.k2 = self.k2 % 2**64
 
-        self._msg = bytearray()
+        # Up to one block, we can only process it once we know if it is the
+        # last one or not
+        self._pending = bytearray()
         if msg is not None:
             self.update(msg)
 
-    def update(self, block):
-        """ Add some blocks to the current calculation """
-        self._msg.extend(block)
-        # Process the complete blocks
-        while len(self._msg) > 8:
-            block = self._msg[:8]
-            self._msg = self._msg[8:]
-            self._iv = ba_xor(self._iv, block)
-            self._iv = xtea_encrypt(self.key, self._iv)
+    def _process(self, data, offset):
+        """ Chain the block of `data` starting at `offset` """
+        v0, v1 = WORDS.unpack_from(data, offset)
+        self._v0, self._v1 = self.cipher.encrypt_words(self._v0 ^ v0,
+                                                       self._v1 ^ v1)
+
+    def update(self, data):
+        """ Add some data of any length to the current calculation """
+        pending = self._pending
+        if len(pending) + len(data) <= 8:
+            pending.extend(data)
+            return
+        try:
+            view = memoryview(data)
+        except TypeError:
+            view = memoryview(bytearray(data))
+        length = len(view)
+        offset = 0
+        if pending:
+            # Complete the pending block, more data comes after it
+            offset = 8 - len(pending)
+            pending.extend(view[:offset])
+            self._process(pending, 0)
+        # Process the complete blocks, but keep the last one
+        while length - offset > 8:
+            self._process(view, offset)
+            offset += 8
+        self._pending = bytearray(view[offset:])
 
     def digest(self):
-        """ Returns the current MAC """
+        """ Returns the current MAC, the calculation can go on afterward """
         # Process the remaining part
-        if len(self._msg) == 8:
+        if len(self._pending) == 8:
             # XOR with k1
-            block = i2msba(self.k1 ^ a2msbi(self._msg), 8)
+            last = U64BE.unpack_from(self._pending)[0] ^ self.k1
         else:
             # Add padding
-            block = self._msg
-            block.append(0x80)
-            block.extend(bytearray(8-len(self._msg)))
+            block = self._pending + bytearray([0x80])
+            block.extend(bytearray(8 - len(block)))
             # XOR with k2
-            block = i2msba(a2msbi(block) ^ self.k2, 8)
+            last = U64BE.unpack_from(block)[0] ^ self.k2
 
-        return xtea_encrypt(self.key, ba_xor(self._iv, block))
+        v0, v1 = self.cipher.encrypt_words(self._v0 ^ (last >> 32),
+                                           self._v1 ^ (last & self.MASK))
+        return bytearray(WORDS.pack(v0, v1))
     final = digest
 
 
@@ -75,23 +113,73 @@ def computeCounter(key, nonce):
     return counter
 
 
+def counterBlocks(start, count, width=8):
+    """ The `count` values that `counter` would yield after `start`, as one
+    buffer """
+    if numpy is not None and width == 8:
+        values = numpy.arange(1, count + 1, dtype='<u8') + numpy.uint64(start)
+        return bytearray(values.astype('<u8').tobytes())
+    modulo = 2**(8*width)
+    if width == 8:
+        return bytearray(struct.pack('<%dQ' % count, *[
+            (start + i) % modulo for i in range(1, count + 1)]))
+    blocks = bytearray()
+    for i in range(1, count + 1):
+        blocks.extend(i2lsba((start + i) % modulo, width))
+    return blocks
+
+
+def xor_into(buffer, offset, keystream):
+    """ xor `keystream` into `buffer` (a bytearray) starting at `offset` """
+    length = len(keystream)
+    if length == 0:
+        return
+    if numpy is not None:
+        view = numpy.frombuffer(buffer, dtype=numpy.uint8, count=length,
+                                offset=offset)
+        view ^= numpy.frombuffer(bytes(keystream), dtype=numpy.uint8)
+        return
+    value = (int.from_bytes(bytes(buffer[offset:offset + length]), 'big') ^
+             int.from_bytes(bytes(keystream), 'big'))
+    buffer[offset:offset + length] = value.to_bytes(length, 'big')
+
+
 class XTEA_CTR(object):
     def __init__(self, key, nonce):
-        self.key = key
-        self.counter = counter(nonce)
-
-    def _keygen(self):
-        while True:
-            for k in xtea_encrypt(self.key, next(self.counter)):
-                yield k
+        self.cipher = schedule(key)
+        self._width = len(nonce)
+        self._value = a2lsbi(nonce)
+        # Keystream bytes left from the last block
+        self._pending = bytearray()
+
+    def keystream(self, length):
+        """ Returns the next `length` bytes of the keystream """
+        stream = self._pending
+        missing = length - len(stream)
+        if missing > 0:
+            count = (missing + 7) // 8
+            blocks = counterBlocks(self._value, count, self._width)
+            self._value = (self._value + count) % 2**(8*self._width)
+            stream = stream + self.cipher.encrypt_blocks(blocks)
+        self._pending = stream[length:]
+        return stream[:length]
+
+    def decrypt_into(self, buffer, offset=0):
+        """ Decrypt the bytearray `buffer` in place from `offset` on """
+        xor_into(buffer, offset, self.keystream(len(buffer) - offset))
 
     def decrypt(self, data):
-        return [ x ^ y for (x,y) in zip(data,self._keygen) ]
+        data = bytearray(data)
+        self.decrypt_into(data)
+        return data
 
 
 def decrypt(dump, key, offset=16):
+    # The key is scheduled once for the whole dump
+    key = schedule(key)
     counter = computeCounter(key, dump.nonce)
     cipher = XTEA_CTR(key, nonce=counter)
-    decryptedData = cipher.decrypt(dump.data[offset:])
-    dump.data[offset:]= decryptedData
+    data = bytearray(dump.data)
+    cipher.decrypt_into(data, offset)
+    dump.data = data
     return dump
@@ -7,6 +7,8 @@ import xml.etree.ElementTree as ET
 import logging
 logger = logging.getLogger(__name__)
 
+import requests
+
 class BackOffException(Exception):
     def __init__(self, min, max):
         self.min = min
@@ -16,6 +18,35 @@ class BackOffException(Exception):
         return random.randint(self.min, self.max)
 
 
+def newSession(poolSize=4, keepAlive=True):
+    """ A `requests.Session` whose connections get reused across requests
+    :param poolSize: number of connections kept open per host
+    :param keepAlive: when False, connections are closed after each request
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=poolSize,
+                                            pool_maxsize=poolSize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keepAlive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def threadSession(session):
+    """ :returns: a session for another thread than the one of `session`,
+    sharing its connection pools (the adapters are thread-safe, the
+    sessions are not meant to be). Anything else than a `requests.Session`
+    is returned as is """
+    if not isinstance(session, requests.Session):
+        return session
+    clone = requests.Session()
+    clone.headers = session.headers.copy()
+    for prefix, adapter in session.adapters.items():
+        clone.mount(prefix, adapter)
+    return clone
+
+
 def toXML(name, attrs={}, childs=[], body=None):
     elem = ET.Element(name, attrib=attrs)
     if childs:
@@ -0,0 +1,78 @@
+"""\
+Sharing the trackers between several radios (Fitbit dongles or bluetooth
+adapters)
+
+Each radio discovers the trackers it can hear, and each tracker then gets
+synchronised by the radio that hears it the best.
+"""
+
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def discoverAll(radios, *args, **kwargs):
+    """ Run the discovery on all the radios, the args are the ones of
+    `API.discover`, and so are the kwargs, but `registry`: the
+    `TrackerRegistry` the trackers heard are recorded into.
+    The thread-safe radios discover at the same time, the others one after
+    the other.
+    :returns: a dict tracker id -> list of (RSSI, radio, tracker)
+    """
+    registry = kwargs.pop('registry', None)
+    # radio -> the trackers it heard
+    heard = {}
+    errors = []
+
+    def discover(radio):
+        logger.info('Discovering trackers with %s', radio.name)
+        try:
+            trackers = radio.discover(*args, **kwargs)
+            if registry is not None:
+                trackers = registry.watch(trackers, kwargs.get('expected'))
+            heard[radio] = list(trackers)
+        except Exception as e:
+            logger.error('Discovery with %s failed', radio.name)
+            errors.append(e)
+
+    threads = []
+    for radio in radios:
+        if getattr(radio, 'threadSafe', False):
+            thread = threading.Thread(target=discover, name=radio.name,
+                                      args=(radio,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+    for radio in radios:
+        if not getattr(radio, 'threadSafe', False):
+            discover(radio)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    discovered = {}
+    for radio in radios:
+        for tracker in heard[radio]:
+            logger.debug('%s heard tracker %s', radio.name, tracker.id)
+            discovered.setdefault(tracker.id, []).append(
+                (getattr(tracker, 'RSSI', -255), radio, tracker))
+    return discovered
+
+
+def assignTrackers(radios, discovered):
+    """ Give each tracker to the radio with the best RSSI, the radio with
+    the less trackers to synchronise wins in case of equality.
+    :returns: a dict radio -> list of the trackers (as discovered by that
+              radio)
+    """
+    assignment = dict((radio, []) for radio in radios)
+    for trackerId in sorted(discovered):
+        RSSI, radio, tracker = max(
+            discovered[trackerId],
+            key=lambda heard: (heard[0], -len(assignment[heard[1]])))
+        logger.info('Tracker %s assigned to %s (%ddBm)', trackerId,
+                    radio.name, RSSI)
+        assignment[radio].append(tracker)
+    return assignment
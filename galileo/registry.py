@@ -0,0 +1,102 @@
+"""\
+What is known about the trackers heard so far
+
+The registry remembers, for each tracker id, what its last discovery told
+(RSSI, address type, service UUID, synchronised recently) and how long
+after the start of the discovery it got heard. That allows to stop the
+discovery once all the trackers recently heard were heard again, and to not
+wait much longer than they usually take to show up.
+"""
+
+import os
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .utils import loadJSON, saveJSON
+
+
+class TrackerRegistry(object):
+    FILENAME = 'trackers.json'
+    # Number of discoveries the adaptive timeout is based on
+    HISTORY = 10
+    # msec, the adaptive timeout never goes below
+    MIN_TIMEOUT = 1000
+    # sec, the trackers not heard for that long are not expected anymore
+    MAX_AGE = 7 * 24 * 3600
+
+    def __init__(self, dirname=None):
+        """ :param dirname: where to keep the registry across the runs, in
+                            memory only if None """
+        self.filename = None
+        if dirname is not None:
+            self.filename = os.path.join(os.path.expanduser(dirname),
+                                         self.FILENAME)
+        self.trackers = {}
+        # msec it took to hear all the expected trackers
+        self.durations = []
+        # The radios discover in parallel
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        content = loadJSON(self.filename, 'tracker registry',
+                           lambda c: (c['trackers'], c['durations']))
+        if content is not None:
+            self.trackers, self.durations = content
+
+    def save(self):
+        saveJSON(self.filename, {'trackers': self.trackers,
+                                 'durations': self.durations},
+                 'tracker registry', indent=1, sort_keys=True)
+
+    def known(self, maxAge=MAX_AGE):
+        """ :returns: the set of the ids of the trackers heard within the
+                      last `maxAge` seconds """
+        oldest = time.time() - maxAge
+        with self.lock:
+            return set(trackerId for trackerId, entry in self.trackers.items()
+                       if entry.get('lastSeen', 0) >= oldest)
+
+    def seen(self, tracker, after):
+        """ Remember `tracker`, heard `after` msec in the discovery """
+        entry = {'lastSeen': int(time.time()), 'heardAfter': int(after),
+                 'syncedRecently': tracker.syncedRecently}
+        for attr in ('RSSI', 'addrType', 'serviceUUID'):
+            if hasattr(tracker, attr):
+                entry[attr] = getattr(tracker, attr)
+        with self.lock:
+            self.trackers[tracker.id] = entry
+
+    def watch(self, trackers, expected=None):
+        """ Record the `trackers` of a discovery as they are heard
+        :param expected: the ids of the trackers expected, for the time it
+                         takes to hear all of them
+        :returns: a generator of the trackers
+        """
+        start = time.time()
+        remaining = None
+        if expected:
+            remaining = set(expected)
+        for tracker in trackers:
+            after = (time.time() - start) * 1000
+            self.seen(tracker, after)
+            if remaining:
+                remaining.discard(tracker.id)
+                if not remaining:
+                    logger.debug("All the expected trackers heard after %d"
+                                 "ms", after)
+                    with self.lock:
+                        self.durations = (self.durations + [int(after)])[
+                            -self.HISTORY:]
+            yield tracker
+
+    def timeout(self, default):
+        """ :returns: the discovery timeout (msec): twice the longest time
+                      it recently took to hear all the expected trackers,
+                      but not more than `default` """
+        if not self.durations:
+            return default
+        return min(default, max(self.MIN_TIMEOUT, 2 * max(self.durations)))
@@ -0,0 +1,148 @@
+"""\
+Recording of the sessions with a Fitbit dongle, and their replay
+
+A `Recorder` writes all the messages exchanged with a radio to a file, in
+the format of `CommLog.dump`. `ReplayDongle` then plays such a session back
+instead of a real dongle: it checks that what galileo sends is what was
+sent then, and answers what the dongle answered then, with the original
+delays scaled by a speed factor, or at once.
+"""
+
+import collections
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .trace import IN, OUT, CommLogWriter, readCommLog
+from .tracker import FitbitClient
+from .utils import a2x
+
+
+class Recorder(object):
+    """ A communication log that also writes all the messages to a file """
+    def __init__(self, log, filename):
+        self.log = log
+        self.writer = CommLogWriter(filename)
+
+    def add(self, direction, data, endpoint=0):
+        self.log.add(direction, data, endpoint)
+        self.writer.add(direction, data, endpoint)
+
+    def __iter__(self):
+        return iter(self.log)
+
+    def __len__(self):
+        return len(self.log)
+
+    def dump(self, filename):
+        self.log.dump(filename)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+
+class Player(object):
+    """ Plays the recorded messages back, endpoint by endpoint
+
+    :param speed: 1 for the original timing, 2 for twice faster, ... and 0
+                  for as fast as possible.
+    """
+    def __init__(self, messages, speed=0):
+        self.speed = speed
+        # endpoint -> (direction, timestamp, data)
+        self.queues = collections.defaultdict(collections.deque)
+        for direction, endpoint, timestamp, data in messages:
+            self.queues[endpoint].append((direction, timestamp, data))
+        # Messages sent that were not the recorded ones
+        self.mismatches = 0
+        # (recorded time, time) of the first message played
+        self.origin = None
+
+    def _next(self, direction, endpoint):
+        queue = self.queues[endpoint]
+        if not queue:
+            logger.warning("Nothing more recorded on endpoint 0x%02x",
+                           endpoint)
+            return None
+        recorded, timestamp, data = queue.popleft()
+        if recorded != direction:
+            logger.warning("Recorded message in the other direction on"
+                           " endpoint 0x%02x", endpoint)
+            return None
+        self._wait(timestamp / 1000.)
+        return data
+
+    def _wait(self, timestamp):
+        now = time.time()
+        if self.origin is None:
+            self.origin = (timestamp, now)
+        if not self.speed:
+            return
+        due = self.origin[1] + (timestamp - self.origin[0]) / self.speed
+        if due > now:
+            time.sleep(due - now)
+
+    def write(self, endpoint, data):
+        """ :returns: the length written """
+        recorded = self._next(OUT, endpoint)
+        if recorded is None or bytearray(recorded) != bytearray(data):
+            self.mismatches += 1
+            logger.warning("Sent %s, was %s", a2x(data),
+                           a2x(recorded) if recorded is not None else '-')
+        return len(data)
+
+    def read(self, endpoint):
+        """ :returns: what was received then, None for a timeout """
+        data = self._next(IN, endpoint)
+        if not data:
+            return None
+        return bytearray(data)
+
+
+class ReplayDongle(FitbitClient):
+    """ A Fitbit dongle that replays a recorded session """
+    # Set from the configuration
+    filename = None
+    speed = 0
+
+    def __init__(self, logsize, filename=None, speed=None):
+        FitbitClient.__init__(self, logsize)
+        if filename is not None:
+            self.filename = filename
+        if speed is not None:
+            self.speed = speed
+        self.player = None
+
+    @classmethod
+    def all(klass, logsize):
+        return [klass(logsize)]
+
+    @property
+    def name(self):
+        return 'replay of %s' % self.filename
+
+    def setup(self):
+        if self.filename is None:
+            logger.error("No recorded session to replay")
+            return False
+        try:
+            self.player = Player(readCommLog(self.filename), self.speed)
+        except (IOError, OSError, ValueError) as e:
+            logger.error("Unable to read the recorded session: %s", e)
+            return False
+        return True
+
+    def write(self, endpoint, data, timeout):
+        self.log.add(OUT, data, endpoint)
+        return self.player.write(endpoint, data)
+
+    def read(self, endpoint, length, timeout):
+        data = self.player.read(endpoint)
+        if data is None:
+            logger.info('Got an I/O Timeout (> %dms) while reading!', timeout)
+        self.log.add(IN, data, endpoint)
+        return data
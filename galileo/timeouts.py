@@ -0,0 +1,72 @@
+"""\
+How long to wait for the answers of the trackers
+
+The waits of the protocol have a fixed ceiling (the timeouts galileo
+always used). The `TimeoutPolicy` learns how long each of them actually
+takes, per tracker model, and waits for a high percentile of that plus a
+margin instead, so that a tracker that went away doesn't hold the radio
+for the whole ceiling.
+"""
+
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .utils import loadJSON, saveJSON
+
+
+class TimeoutPolicy(object):
+    FILENAME = 'timeouts.json'
+    # Latencies kept per model and step
+    HISTORY = 100
+    # Below that, the ceiling is used
+    MIN_SAMPLES = 10
+    PERCENTILE = 95
+    # The timeout is the percentile * (1 + MARGIN) + MIN_MARGIN msec
+    MARGIN = 0.5
+    MIN_MARGIN = 200
+
+    def __init__(self, dirname=None):
+        """ :param dirname: where to keep the latencies across the runs, in
+                            memory only if None """
+        self.filename = None
+        if dirname is not None:
+            self.filename = os.path.join(os.path.expanduser(dirname),
+                                         self.FILENAME)
+        # model -> step -> latencies (msec)
+        self.latencies = {}
+        self.load()
+
+    def load(self):
+        latencies = loadJSON(self.filename, 'timeouts')
+        if latencies is not None:
+            self.latencies = latencies
+
+    def save(self):
+        saveJSON(self.filename, self.latencies, 'timeouts', sort_keys=True)
+
+    @staticmethod
+    def _model(model):
+        # json keys are strings
+        return 'unknown' if model is None else str(model)
+
+    def _samples(self, model, step):
+        return self.latencies.setdefault(self._model(model), {}).setdefault(
+            step, [])
+
+    def record(self, model, step, latency):
+        samples = self._samples(model, step)
+        samples.append(int(latency))
+        del samples[:-self.HISTORY]
+
+    def timeout(self, model, step, ceiling):
+        """ :returns: how long (msec) to wait for `step` """
+        samples = self.latencies.get(self._model(model), {}).get(step, [])
+        if len(samples) < self.MIN_SAMPLES:
+            return ceiling
+        samples = sorted(samples)
+        percentile = samples[min(len(samples) - 1,
+                                 len(samples) * self.PERCENTILE // 100)]
+        return min(ceiling, int(percentile * (1 + self.MARGIN)) +
+                   self.MIN_MARGIN)
@@ -0,0 +1,210 @@
+"""\
+Tracing of the communications with the radios
+
+Each radio keeps the last messages exchanged, as they are, in a
+`CommLog`; they only get rendered (in hex) in the report of a crash, or
+dumped to a file that the interactive mode can replay. The debug logging
+of the messages is only prepared when it is enabled, and all that tracing
+can be turned off.
+"""
+
+import logging
+import struct
+import time
+
+# Turned off by the `trace` setting
+enabled = True
+# The log of the last radio created, for the crash report
+last = None
+
+
+def tracing(logger):
+    """ :returns: whether the messages exchanged are to be logged """
+    return enabled and logger.isEnabledFor(logging.DEBUG)
+
+
+def newLog(logsize):
+    """ :returns: the `CommLog` for the communications of a new radio """
+    global last
+    last = CommLog(logsize if enabled else 0)
+    return last
+
+
+# The directions of the messages in the logs
+IN, OUT = 1, -1
+
+
+# direction, endpoint, part of the message, timestamp (msec), length
+ENTRY = struct.Struct('<bBBQH')
+# magic, version, number of entries
+COMMLOG_HEADER = struct.Struct('<4sBI')
+COMMLOG_MAGIC = b'GCOM'
+COMMLOG_VERSION = 1
+# Number of entries of a log still being written, it goes up to the end
+UNKNOWN = 0xffffffff
+
+
+def _view(data):
+    try:
+        return memoryview(data)
+    except TypeError:
+        # python2 arrays, lists
+        return bytearray(data)
+
+
+def _messages(entries):
+    """ Put the parts of the messages back together, the parts of the
+    oldest message might be missing, it is then skipped
+    :param entries: (direction, endpoint, part, timestamp, data)
+    """
+    current = None
+    for direction, endpoint, part, timestamp, data in entries:
+        if part == 0:
+            if current is not None:
+                yield current
+            current = (direction, endpoint, timestamp, data)
+        elif current is not None:
+            current = current[:3] + (bytearray(current[3]) + data,)
+    if current is not None:
+        yield current
+
+
+class CommLog(object):
+    """ The last `capacity` messages exchanged with a radio.
+
+    They are kept in an arena allocated once, made of slots of an `ENTRY`
+    header followed by up to SLOT_DATA bytes; the longer messages take
+    several slots. Adding a message doesn't allocate, and overwrites the
+    oldest ones once it is full.
+    """
+    SLOT_DATA = 64
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.slotSize = ENTRY.size + self.SLOT_DATA
+        self.arena = bytearray(capacity * self.slotSize)
+        # The next slot
+        self.head = 0
+        # The slots used, and the messages they hold
+        self.fill = 0
+        self.messages = 0
+
+    @property
+    def empty(self):
+        return self.fill == 0
+
+    @property
+    def full(self):
+        return self.fill == self.capacity
+
+    def __len__(self):
+        """ The number of messages, as given by iterating over the log """
+        return self.messages
+
+    def add(self, direction, data, endpoint=0):
+        """ :param data: the message, None when nothing was received """
+        if self.capacity == 0:
+            return
+        timestamp = int(time.time() * 1000)
+        data = _view(data if data is not None else b'')
+        length = len(data)
+        part = 0
+        while True:
+            size = min(length - part * self.SLOT_DATA, self.SLOT_DATA)
+            base = self.head * self.slotSize
+            if self.full and ENTRY.unpack_from(self.arena, base)[2] == 0:
+                # The oldest message loses its first part, it is gone
+                self.messages -= 1
+            if part == 0:
+                self.messages += 1
+            ENTRY.pack_into(self.arena, base, direction, endpoint, part,
+                            timestamp, size)
+            start = base + ENTRY.size
+            self.arena[start:start + size] = data[part * self.SLOT_DATA:
+                                                  part * self.SLOT_DATA + size]
+            self.head = (self.head + 1) % self.capacity
+            self.fill = min(self.fill + 1, self.capacity)
+            part += 1
+            if part * self.SLOT_DATA >= length:
+                break
+
+    def _entries(self):
+        view = memoryview(self.arena)
+        first = (self.head - self.fill) % self.capacity if self.capacity else 0
+        for i in range(self.fill):
+            base = ((first + i) % self.capacity) * self.slotSize
+            direction, endpoint, part, timestamp, length = ENTRY.unpack_from(
+                self.arena, base)
+            start = base + ENTRY.size
+            yield (direction, endpoint, part, timestamp,
+                   view[start:start + length])
+
+    def __iter__(self):
+        """ The (direction, endpoint, timestamp, data) of the messages, the
+        oldest first. data is a view on the arena, only valid until the next
+        message is added. """
+        return _messages(self._entries())
+
+    def dump(self, filename):
+        """ Write the log to a binary file, see `readCommLog` """
+        with open(filename, 'wb') as f:
+            f.write(COMMLOG_HEADER.pack(COMMLOG_MAGIC, COMMLOG_VERSION,
+                                        self.fill))
+            for direction, endpoint, part, timestamp, data in self._entries():
+                f.write(ENTRY.pack(direction, endpoint, part, timestamp,
+                                   len(data)))
+                f.write(data)
+
+
+class CommLogWriter(object):
+    """ Writes all the messages to a file, as `CommLog.dump` would """
+    def __init__(self, filename):
+        self.filename = filename
+        self.count = 0
+        self.f = open(filename, 'wb')
+        self.f.write(COMMLOG_HEADER.pack(COMMLOG_MAGIC, COMMLOG_VERSION,
+                                         UNKNOWN))
+
+    def add(self, direction, data, endpoint=0):
+        data = _view(data if data is not None else b'')
+        self.f.write(ENTRY.pack(direction, endpoint, 0,
+                                int(time.time() * 1000), len(data)))
+        self.f.write(data)
+        self.count += 1
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        if self.f.closed:
+            return
+        # The number of entries is only known now
+        self.f.seek(0)
+        self.f.write(COMMLOG_HEADER.pack(COMMLOG_MAGIC, COMMLOG_VERSION,
+                                         self.count))
+        self.f.close()
+
+
+def readCommLog(filename):
+    """ :returns: the list of the (direction, endpoint, timestamp, data) of
+                  the messages of a log written by `CommLog.dump` """
+    with open(filename, 'rb') as f:
+        content = f.read()
+    try:
+        magic, version, count = COMMLOG_HEADER.unpack_from(content)
+    except struct.error:
+        raise ValueError('%s is not a communication log' % filename)
+    if magic != COMMLOG_MAGIC or version != COMMLOG_VERSION:
+        raise ValueError('%s is not a communication log' % filename)
+    def entries():
+        offset = COMMLOG_HEADER.size
+        i = 0
+        while i < count and offset + ENTRY.size <= len(content):
+            i += 1
+            direction, endpoint, part, timestamp, length = ENTRY.unpack_from(
+                content, offset)
+            offset += ENTRY.size
+            yield (direction, endpoint, part, timestamp,
+                   bytearray(content[offset:offset + length]))
+            offset += length
+    return list(_messages(entries()))
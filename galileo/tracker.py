@@ -1,6 +1,7 @@
 from ctypes import c_byte
 
 import logging
+import time
 logger = logging.getLogger(__name__)
 
 from . import ble
@@ -75,6 +76,11 @@ class FBTracker(Tracker):
 
 
 class FitbitClient(dongle.FitBitDongle, ble.API):
+    # Each dongle has its own USB device
+    threadSafe = True
+    # The tracker we're connected to
+    tracker = None
+
     def disconnectAll(self):
         logger.info('Disconnecting from any connected trackers')
 
@@ -112,12 +118,15 @@ class FitbitClient(dongle.FitBitDongle, ble.API):
 #        self.revision = d.payload[19]
         return True
 
-    def discover(self, uuid, service1, read, write, minRSSI, timeout):
+    def discover(self, uuid, service1, read, write, minRSSI, timeout,
+                 expected=None):
         """\
         The uuid is a mask on the service (characteristics ?) we understand
         service1 parameter is unused (at lease for the 'One')
         read and write are the uuid of the characteristics we use for
         transmission and reception.
+        The discovery is cancelled once all the `expected` tracker ids were
+        heard, and at least `MIN_DISCOVERY` msec passed.
         """
         logger.debug('Discovering for UUID %s: %s', uuid,
                      ', '.join(hex(s) for s in (service1, read, write)))
@@ -125,14 +134,25 @@ class FitbitClient(dongle.FitBitDongle, ble.API):
         for i in (service1, read, write, timeout):
             data += i2lsba(i, 2)
         self.ctrl_write(CM(4, data))
+        remaining = None
+        if expected:
+            remaining = set(expected)
         amount = 0
+        start = time.time()
         while True:
             # Give the dongle 100ms margin
-            d = self.ctrl_read(timeout + 100)
+            wait = timeout + 100
+            if remaining is not None and not remaining:
+                # Still give the other trackers a chance to show up
+                wait = int(self.MIN_DISCOVERY - (time.time() - start) * 1000)
+                if wait <= 0:
+                    break
+            d = self.ctrl_read(wait)
             if d is None: break
             elif isStatus(d, None, False):
                 # We know this can happen almost any time during 'discovery'
-                logger.info('Ignoring message: %s' % a2s(d.payload))
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info('Ignoring message: %s', a2s(d.payload))
                 continue
             elif d.INS == 2:
                 # Last instruction of a discovery sequence has INS==1
@@ -140,14 +160,24 @@ class FitbitClient(dongle.FitBitDongle, ble.API):
             elif (d.INS != 3) or (len(d.payload) < 17):
                 logger.error('payload unexpected: %s', d)
                 break
-            yield FBTracker.fromDiscovery(d.payload, minRSSI)
+            tracker = FBTracker.fromDiscovery(d.payload, minRSSI)
+            yield tracker
             amount += 1
+            if remaining:
+                remaining.discard(tracker.id)
+                if not remaining:
+                    logger.info('All the expected trackers were heard')
 
-        if d != CM(2, [amount]):
+        early = remaining is not None and not remaining
+        if not early and d != CM(2, [amount]):
             logger.error('%d trackers discovered, dongle says %s', amount, d)
         # tracker found, cancel discovery
         self.ctrl_write(CM(5))
         d = self.ctrl_read()
+        if early:
+            # The dongle may have heard some more trackers meanwhile
+            while (d is not None) and (d.INS in (2, 3)):
+                d = self.ctrl_read()
         if isStatus(d, 'StartDiscovery', False):
             # We had not received the 'StartDiscovery' yet
             d = self.ctrl_read()
@@ -164,6 +194,7 @@ class FitbitClient(dongle.FitBitDongle, ble.API):
         return True
 
     def connect(self, tracker):
+        self.tracker = tracker
         if not self._establishLink(tracker):
             logger.error("establishLink failed")
             return False
@@ -177,7 +208,7 @@ class FitbitClient(dongle.FitBitDongle, ble.API):
 
         if not self.useEstablishLinkEx:
             # Not necessary when using establishLinkEx
-            d = self.ctrl_read(10000)
+            d = self._wait(self.ctrl_read, 'linkEstablished', 10000)
             #if d != CM(6, data[-6:]):
             #    logger.error("Unexpected message: %s != %s", d, CM(6, data[-6:]))
             #    return False
@@ -198,17 +229,17 @@ class FitbitClient(dongle.FitBitDongle, ble.API):
             return self._establishLinkEx(tracker)
         elif not isStatus(d, 'EstablishLink'):
             return False
-        d = self.ctrl_read(5000)
+        d = self._wait(self.ctrl_read, 'establishLink', 5000)
         if d != CM(4, [0]):
             logger.error('Unexpected message: %s', d)
             return False
         # established, waiting for service discovery
         # - This one takes long
-        if not isStatus(self.ctrl_read(8000),
+        if not isStatus(self._wait(self.ctrl_read, 'gapLinkEstablished', 8000),
                         'GAP_LINK_ESTABLISHED_EVENT'):
             return False
         # This one can also take some time (Charge tracker)
-        d = self.ctrl_read(5000)
+        d = self._wait(self.ctrl_read, 'serviceDiscovery', 5000)
         if d != CM(7):
             logger.error('Unexpected 2nd message: %s', d)
             return False
@@ -224,7 +255,7 @@ class FitbitClient(dongle.FitBitDongle, ble.API):
         self.ctrl_write(CM(0x12, data))
         if not isStatus(self.ctrl_read(), 'EstablishLinkEx'):
             return False
-        d = self.ctrl_read(5000)
+        d = self._wait(self.ctrl_read, 'establishLink', 5000)
         if d != CM(4, [0]):
             logger.error('Unexpected message: %s', d)
             return False
@@ -246,11 +277,17 @@ class FitbitClient(dongle.FitBitDongle, ble.API):
         :returns: a boolean about the successful execution
         """
         self.ctrl_write(CM(8, [int(on)]))
-        d = self.data_read(5000)
+        d = self._wait(self.data_read, 'txPipe', 5000)
         return d == DM([0xc0, 0xb])
 
+    @property
+    def currentModel(self):
+        if self.tracker is None:
+            return None
+        return self.tracker.productId
+
     def uploadResponse(self, response):
-        return self._uploadResponse(response, False)
+        return self._uploadResponse(response, False, self.currentModel)
 
     def disconnect(self, tracker):
         if not self._terminateAirlink():
@@ -276,7 +313,7 @@ class FitbitClient(dongle.FitBitDongle, ble.API):
         """ contrary to ``establishLink`` """
 
         self.ctrl_write(CM(7))
-        d = self.ctrl_read(5000)
+        d = self._wait(self.ctrl_read, 'ceaseLink', 5000)
         if d is None:
             return False
         if d.INS == 6:
@@ -285,7 +322,7 @@ class FitbitClient(dongle.FitBitDongle, ble.API):
         if not isStatus(d, 'TerminateLink'):
             return False
 
-        d = self.ctrl_read(3000)
+        d = self._wait(self.ctrl_read, 'linkTerminated', 3000)
         if (d is None) or (d.INS != 5):
             # Payload can be either 0x16 or 0x08
             return False
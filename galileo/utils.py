@@ -3,21 +3,71 @@ We internally use array of int as data representation, those routines
 translate them to one or the other format
 """
 
+import json
+import os
+import struct
 import sys
 
+import logging
+logger = logging.getLogger(__name__)
+
+# Precompiled codecs for the fixed-width integers, by width
+U16LE, U32LE, U64LE = struct.Struct('<H'), struct.Struct('<I'), struct.Struct('<Q')
+U16BE, U32BE, U64BE = struct.Struct('>H'), struct.Struct('>I'), struct.Struct('>Q')
+LSB = {2: U16LE, 4: U32LE, 8: U64LE}
+MSB = {2: U16BE, 4: U32BE, 8: U64BE}
+MASK = {2: 0xffff, 4: 0xffffffff, 8: 0xffffffffffffffff}
+
+def _a2x(a, delim):
+    return delim.join('%02X' % x for x in a)
+
+
 def a2x(a, delim=' '):
     """ array to string of hexa
     delim is the delimiter between the hexa
     """
-    return delim.join('%02X' % x for x in a)
+    if len(delim) <= 1:
+        try:
+            if delim:
+                return bytearray(a).hex(delim).upper()
+            return bytearray(a).hex().upper()
+        except (AttributeError, TypeError, ValueError):
+            # python2, or python3 before 3.8 (no separator), or not bytes
+            pass
+    return _a2x(a, delim)
 
 
-def x2a(hexstr):
-    """ String of hexa to array """
+def _x2a(hexstr):
     hexstr = hexstr.replace('\n', ' ').replace(':', ' ')
     return bytearray(int(x, 16) for x in hexstr.split(' '))
 
 
+def x2a(hexstr):
+    """ String of hexa to array
+
+    The bytes can be separated by spaces, colons or newlines, a whole text
+    dump can be converted at once.
+    """
+    try:
+        if ':' in hexstr:
+            return bytearray.fromhex(hexstr.replace(':', ' '))
+        return bytearray.fromhex(hexstr)
+    except (TypeError, ValueError):
+        # Single digit bytes, or python2 and python3 before 3.7 that
+        # don't skip the newlines.
+        return _x2a(hexstr)
+
+
+def iterx2a(lines):
+    """ Decode an iterable of lines of hexa (a file object for instance)
+    :returns: a generator of bytearray, one per non-empty line
+    """
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield x2a(line)
+
+
 def a2s(a, toPrint=True):
     """ array to string
     toPrint indicates that the resulting string is to be printed (stop at the
@@ -36,8 +86,7 @@ def a2b(a):
         return bytes(a)
     return a2s(a, False)
 
-def a2lsbi(array):
-    """ array to int (LSB first) """
+def _a2lsbi(array):
     integer = 0
     for i in range(len(array) - 1, -1, -1):
         integer *= 256
@@ -45,8 +94,19 @@ def a2lsbi(array):
     return integer
 
 
-def a2msbi(array):
-    """ array to int (MSB first) """
+def a2lsbi(array):
+    """ array to int (LSB first) """
+    codec = LSB.get(len(array))
+    if codec is not None and not isinstance(array, list):
+        try:
+            return codec.unpack_from(array)[0]
+        except TypeError:
+            # Not a buffer
+            pass
+    return _a2lsbi(array)
+
+
+def _a2msbi(array):
     integer = 0
     for i in range(len(array)):
         integer *= 256
@@ -54,23 +114,100 @@ def a2msbi(array):
     return integer
 
 
-def i2lsba(value, width):
-    """ int to array (LSB first) """
+def a2msbi(array):
+    """ array to int (MSB first) """
+    codec = MSB.get(len(array))
+    if codec is not None and not isinstance(array, list):
+        try:
+            return codec.unpack_from(array)[0]
+        except TypeError:
+            # Not a buffer
+            pass
+    return _a2msbi(array)
+
+
+def _i2lsba(value, width):
     a = [0] * width
     for i in range(width):
         a[i] = (value >> (i*8)) & 0xff
     return a
 
 
-def i2msba(value, width):
-    """ int to bytearray (MSB first) """
+def i2lsba(value, width):
+    """ int to array (LSB first) """
+    codec = LSB.get(width)
+    if codec is not None:
+        packed = codec.pack(value & MASK[width])
+        if sys.version_info < (3, 0):
+            packed = bytearray(packed)
+        return list(packed)
+    return _i2lsba(value, width)
+
+
+def _i2msba(value, width):
     a = bytearray(width)
     for i in range(width):
         a[width - i - 1] = (value >> (i*8)) & 0xff
     return a
 
+
+def i2msba(value, width):
+    """ int to bytearray (MSB first) """
+    codec = MSB.get(width)
+    if codec is not None:
+        return bytearray(codec.pack(value & MASK[width]))
+    return _i2msba(value, width)
+
+
+def iterUnpack(codec, buffer):
+    """ Unpack `buffer` as consecutive records of the `struct.Struct` codec
+    :returns: an iterator of tuples
+    """
+    if hasattr(codec, 'iter_unpack'):
+        return codec.iter_unpack(buffer)
+    return (codec.unpack_from(buffer, offset)
+            for offset in range(0, len(buffer), codec.size))
+
 def s2a(s):
     """ string to array """
     if isinstance(s, str):
         return [ord(c) for c in s]
     return [c for c in s]
+
+
+def loadJSON(filename, what, convert=None):
+    """ Read what was kept in the json file `filename`
+    :param what: what the file is about, for the warnings
+    :param convert: turns the content into what gets returned
+    :returns: None if there is no file, or it can't be read
+    """
+    if filename is None or not os.path.exists(filename):
+        return None
+    try:
+        with open(filename) as f:
+            content = json.load(f)
+        if convert is not None:
+            content = convert(content)
+        return content
+    except (IOError, OSError, ValueError, KeyError) as e:
+        logger.warning("Unable to read the %s %s: %s", what, filename, e)
+        return None
+
+def saveJSON(filename, content, what, **kwargs):
+    """ Keep `content` in the json file `filename`, which only gets replaced
+    once the new one is complete
+    :param what: what the file is about, for the warnings
+    :param kwargs: for `json.dump`
+    """
+    if filename is None:
+        return
+    dirname = os.path.dirname(filename)
+    tmpname = filename + '.tmp'
+    try:
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(tmpname, 'w') as f:
+            json.dump(content, f, **kwargs)
+        os.rename(tmpname, filename)
+    except (IOError, OSError) as e:
+        logger.warning("Unable to save the %s %s: %s", what, filename, e)
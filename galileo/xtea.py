@@ -8,7 +8,10 @@ This module provides a Python implementation of the XTEA block encryption
 algorithm (http://www.cix.co.uk/~klockstone/xtea.pdf).
 
 The module implements the basic XTEA block encryption algortithm
-(`xtea_encrypt`/`xtea_decrypt`).
+(`xtea_encrypt`/`xtea_decrypt`), as well as a bulk version
+(`xtea_encrypt_blocks`) that process a whole buffer of blocks at once, using
+NumPy when it is available. When multiple blocks are processed with the same
+key, use an `XTEA` object to schedule the key only once.
 
 This module is intended to provide a simple 'privacy-grade' Python encryption
 algorithm with no external dependencies. The implementation is relatively slow
@@ -24,7 +27,98 @@ IV to seed the key generator (the IV is not sensitive and does not need to be
 exchanged securely)
 """
 
-from .utils import i2msba, a2msbi
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import struct
+
+from .utils import iterUnpack
+
+# The key, and a block as two 32 bit words
+KEY = struct.Struct('>4I')
+WORDS = struct.Struct('>II')
+
+class XTEA(object):
+    """
+        XTEA block cypher with a key scheduled once for all
+        * key = 128 bit (16 char)
+        * rounds = rounds (default 32)
+        The two values added (`sum + k[...]`) to the half-blocks during each
+        round only depend on the key, they are computed here.
+    """
+    delta, mask = 0x9e3779b9, 0xffffffff
+
+    def __init__(self, key, rounds=32):
+        k = KEY.unpack(bytes(bytearray(key)))
+        self.rounds = rounds
+        self.schedule = []
+        sum, delta, mask = 0, self.delta, self.mask
+        for round in range(rounds):
+            ka = (sum + k[sum & 3]) & mask
+            sum = (sum + delta) & mask
+            kb = (sum + k[sum>>11 & 3]) & mask
+            self.schedule.append((ka, kb))
+
+    def encrypt_words(self, v0, v1):
+        """ Encrypt the block made of the two 32 bit words v0 and v1 """
+        mask = self.mask
+        for ka, kb in self.schedule:
+            v0 = (v0 + (((v1<<4 ^ v1>>5) + v1) ^ ka)) & mask
+            v1 = (v1 + (((v0<<4 ^ v0>>5) + v0) ^ kb)) & mask
+        return v0, v1
+
+    def decrypt_words(self, v0, v1):
+        """ Decrypt the block made of the two 32 bit words v0 and v1 """
+        mask = self.mask
+        for ka, kb in reversed(self.schedule):
+            v1 = (v1 - (((v0<<4 ^ v0>>5) + v0) ^ kb)) & mask
+            v0 = (v0 - (((v1<<4 ^ v1>>5) + v1) ^ ka)) & mask
+        return v0, v1
+
+    def encrypt_block(self, block):
+        """ Encrypt a 64 bit data block """
+        v0, v1 = self.encrypt_words(*WORDS.unpack(bytes(bytearray(block))))
+        return bytearray(WORDS.pack(v0, v1))
+
+    def decrypt_block(self, block):
+        """ Decrypt a 64 bit data block """
+        v0, v1 = self.decrypt_words(*WORDS.unpack(bytes(bytearray(block))))
+        return bytearray(WORDS.pack(v0, v1))
+
+    def encrypt_blocks(self, data):
+        """ Encrypt a buffer of consecutive 64 bit blocks, the rounds are
+        applied on all the blocks at once. """
+        if len(data) % 8:
+            raise ValueError("data length must be a multiple of 8: %d" % len(data))
+        if numpy is not None:
+            return self._encrypt_blocks_numpy(data)
+        return self._encrypt_blocks_python(data)
+
+    def _encrypt_blocks_numpy(self, data):
+        words = numpy.frombuffer(bytes(data), dtype='>u4').astype(numpy.uint32)
+        v0, v1 = words[0::2].copy(), words[1::2].copy()
+        for ka, kb in self.schedule:
+            v0 += (((v1 << 4) ^ (v1 >> 5)) + v1) ^ numpy.uint32(ka)
+            v1 += (((v0 << 4) ^ (v0 >> 5)) + v0) ^ numpy.uint32(kb)
+        words = numpy.empty(len(v0) * 2, dtype='>u4')
+        words[0::2] = v0
+        words[1::2] = v1
+        return bytearray(words.tobytes())
+
+    def _encrypt_blocks_python(self, data):
+        blocks = list(iterUnpack(WORDS, bytes(data)))
+        v0 = [b[0] for b in blocks]
+        v1 = [b[1] for b in blocks]
+        mask = self.mask
+        for ka, kb in self.schedule:
+            v0 = [(a + (((b<<4 ^ b>>5) + b) ^ ka)) & mask for a, b in zip(v0, v1)]
+            v1 = [(b + (((a<<4 ^ a>>5) + a) ^ kb)) & mask for a, b in zip(v0, v1)]
+        words = [0] * (len(v0) * 2)
+        words[0::2], words[1::2] = v0, v1
+        return bytearray(struct.pack('>%dI' % len(words), *words))
+
 
 def xtea_encrypt(key, block, n=32):
     """
@@ -33,14 +127,7 @@ def xtea_encrypt(key, block, n=32):
         * block = 64 bit (8 char)
         * n = rounds (default 32)
     """
-    v0, v1 = a2msbi(block[:4]), a2msbi(block[4:])
-    k = [a2msbi(key[:4]), a2msbi(key[4:8]), a2msbi(key[8:12]), a2msbi(key[12:])]
-    sum, delta, mask = 0, 0x9e3779b9, 0xffffffff
-    for round in range(n):
-        v0 = (v0 + (((v1<<4 ^ v1>>5) + v1) ^ (sum + k[sum & 3]))) & mask
-        sum = (sum + delta) & mask
-        v1 = (v1 + (((v0<<4 ^ v0>>5) + v0) ^ (sum + k[sum>>11 & 3]))) & mask
-    return i2msba(v0, 4) + i2msba(v1, 4)
+    return XTEA(key, n).encrypt_block(block)
 
 def xtea_decrypt(key, block, n=32):
     """
@@ -49,12 +136,13 @@ def xtea_decrypt(key, block, n=32):
         * block = 64 bit (8 char)
         * n = rounds (default 32
     """
-    v0, v1 = a2msbi(block[:4]), a2msbi(block[4:])
-    k = [a2msbi(key[:4]), a2msbi(key[4:8]), a2msbi(key[8:12]), a2msbi(key[12:])]
-    delta, mask = 0x9e3779b9, 0xffffffff
-    sum = (delta * n) & mask
-    for round in range(n):
-        v1 = (v1 - (((v0<<4 ^ v0>>5) + v0) ^ (sum + k[sum>>11 & 3]))) & mask
-        sum = (sum - delta) & mask
-        v0 = (v0 - (((v1<<4 ^ v1>>5) + v1) ^ (sum + k[sum & 3]))) & mask
-    return i2msba(v0, 4) + i2msba(v1, 4)
+    return XTEA(key, n).decrypt_block(block)
+
+def xtea_encrypt_blocks(key, data, n=32):
+    """
+        Encrypt a buffer of consecutive 64 bit blocks using XTEA block cypher
+        * key = 128 bit (16 char)
+        * data = multiple of 64 bit
+        * n = rounds (default 32)
+    """
+    return XTEA(key, n).encrypt_blocks(data)
@@ -17,3 +17,36 @@ class testCRC(unittest.TestCase):
         crc.update([0x31, 0x32, 0x33, 0x34, 0x35])
         crc.update([0x36, 0x37, 0x38, 0x39])
         self.assertEqual(crc.final(), 0x31c3)
+
+    def test_KERMIT_123456789(self):
+        # Reflected version, exercise the LSB tables
+        crc = CRC16(0x8408, False, 0x0000, 0x0000)
+        crc.update(bytearray(b'123456789'))
+        self.assertEqual(crc.final(), 0x2189)
+
+    def test_table_matches_bitwise(self):
+        data = bytearray((i * 37 + 11) & 0xff for i in range(1000))
+        for poly, invert in ((0x1021, True), (0x8408, False)):
+            for length in (0, 1, 7, 8, 9, 17, 1000):
+                crc = CRC16(poly, invert, 0xffff)
+                crc.update(data[:length])
+                ref = CRC16(poly, invert, 0xffff)
+                for c in data[:length]:
+                    if invert:
+                        ref.update_byte_MSB(c)
+                    else:
+                        ref.update_byte_LSB(c)
+                self.assertEqual(crc.final(), ref.final(), (invert, length))
+
+    def test_buffers(self):
+        data = b'123456789'
+        for buf in (data, bytearray(data), memoryview(data)):
+            crc = CRC16()
+            crc.update(buf)
+            self.assertEqual(crc.final(), 0x31c3)
+
+    def test_update_byte(self):
+        crc = CRC16()
+        for c in bytearray(b'123456789'):
+            crc.update_byte(c)
+        self.assertEqual(crc.final(), 0x31c3)
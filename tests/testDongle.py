@@ -1,8 +1,12 @@
+import array
 import errno
 import unittest
 
 import galileo.dongle
 from galileo.dongle import isStatus, FitBitDongle, CM, DM, isATimeout
+from galileo.dump import CRC16
+from galileo.tracker import FitbitClient
+from galileo.utils import i2lsba
 
 USBError = galileo.dongle.usb.core.USBError
 
@@ -77,6 +81,67 @@ class testDongle(unittest.TestCase):
         d = FitBitDongle(0)
         d.setup()
 
+class FakeUSBDevice(object):
+    """ The dongle queues the data messages of the tracker, a transfer only
+    ends once it got all the messages it asked for, or times out. It counts
+    the transfers. """
+    def __init__(self, messages):
+        self.messages = [DM(m).asList() for m in messages]
+        self.sent = 0
+        self.transfers = 0
+
+    def write(self, endpoint, data, timeout):
+        # The tracker starts sending the dump
+        self.sent = 1
+        return len(data)
+
+    def read(self, endpoint, length, timeout):
+        self.transfers += 1
+        count = length // DM.LENGTH
+        available = min(count, self.sent)
+        data = array.array('B')
+        for message in self.messages[:available]:
+            data.extend(message)
+        del self.messages[:available]
+        if available < count:
+            self.sent -= available
+            raise galileo.dongle.usb.core.USBError('Operation timed out',
+                                                   errno=errno.ETIMEDOUT)
+        # It sends the rest of the dump after the acknowledgement
+        self.sent = len(self.messages)
+        return data
+
+
+class testDataTransfers(unittest.TestCase):
+
+    def testMegadump(self):
+        data = [[i % 256] * 20 for i in range(100)]
+        crc = CRC16()
+        for d in data:
+            crc.update(d)
+        footer = [0xc0, 0, 13] + i2lsba(crc.final(), 2) + i2lsba(2000, 4)
+        dev = FakeUSBDevice([[0xc0, 0x41, 13]] + data + [footer])
+        c = FitbitClient(0, dev)
+        c.newerPyUSB = True
+        try:
+            dump = c.getDump(13)
+        finally:
+            c._dev = None
+        self.assertEqual(dump.len, 2000)
+        self.assertEqual(dump.data, bytearray().join(bytearray(d) for d in data))
+        self.assertEqual(dev.transfers, 102)
+
+    def testShortTransfer(self):
+        """ A message that is not 32 bytes long is kept as is """
+        c = FitbitClient(0, FakeUSBDevice([]))
+        c.newerPyUSB = True
+        c.dev.read = lambda *args: array.array('B', [0xc0, 2])
+        try:
+            self.assertEqual(c.data_read(), DM([0xc0, 2]))
+        finally:
+            c._dev = None
+
+
 class testisATimeout(unittest.TestCase):
 
     def testErrnoTIMEOUT(self):
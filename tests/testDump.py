@@ -1,6 +1,13 @@
+import base64
+import os
+import shutil
+import tempfile
 import unittest
 
-from galileo.dump import Dump, TrackerBlock
+from galileo.dump import CRC16, Dump, TrackerBlock
+from galileo.dump import Base64Encoder, StreamingDump, TextDumpWriter
+from galileo.dump import BINARY_HEADER, BinaryDump, BinaryDumpWriter
+from galileo.dump import convertTextDump, writeBinaryDump
 from galileo.utils import x2a
 
 class testDump(unittest.TestCase):
@@ -82,6 +89,43 @@ class testDump(unittest.TestCase):
         d.add([0xc0]+[0, 0, 0x44, 0x95, 0x96, 0x16, 0x01, 0x00])
         self.assertTrue(d.isValid())
 
+    def testManyChunks(self):
+        d = Dump(0)
+        expected = bytearray()
+        for i in range(100):
+            if i % 3 == 0:
+                d.add(bytearray([0xdb, 0xdc + (i % 2)]) + bytearray([i] * 19))
+                expected.append([0xc0, 0xdb][i % 2])
+            else:
+                d.add(bytearray([i] * 20))
+                expected.append(i)
+            expected.extend([i] * 19)
+        self.assertEqual(d.len, len(expected))
+        self.assertEqual(d.data, expected)
+        self.assertEqual(d.esc, [17, 17])
+        crc = CRC16()
+        crc.update(expected)
+        self.assertEqual(d.crc.final(), crc.final())
+
+    def testPreallocated(self):
+        d = Dump(0, 100)
+        self.assertEqual(d.len, 0)
+        d.add(bytearray(range(10)))
+        self.assertEqual(d.len, 10)
+        self.assertEqual(d.data, bytearray(range(10)))
+        self.assertEqual(len(d._buffer), 100)
+        d.finish()
+        self.assertEqual(len(d._buffer), 10)
+        self.assertEqual(d.data, bytearray(range(10)))
+
+    def testAddAfterData(self):
+        """ Reading the data doesn't prevent further additions """
+        d = Dump(0)
+        d.add(bytearray(range(10)))
+        self.assertEqual(d.data, bytearray(range(10)))
+        d.add(bytearray(range(10, 20)))
+        self.assertEqual(d.data, bytearray(range(20)))
+
     def testDumpProperties(self):
         dump = Dump(13)
         dump.data = bytearray(x2a('2E 02 00 00 01 00 D0 00 00 00 AB CD EF 12 34 56'))
@@ -99,3 +143,159 @@ class testTrackerBlock(unittest.TestCase):
         self.assertEqual(block.megadumpType, '2E')
         self.assertEqual(block.encryption, 1)
         self.assertEqual(block.nonce, bytearray([0xD0, 0x00, 0x00, 0x00]))
+
+
+class testBase64Encoder(unittest.TestCase):
+
+    def testSplits(self):
+        data = bytearray(range(50))
+        for size in (1, 2, 3, 4, 7, 50):
+            enc = Base64Encoder()
+            for i in range(0, len(data), size):
+                enc.update(data[i:i + size])
+            self.assertEqual(enc.final(),
+                             base64.b64encode(bytes(data)).decode('utf-8'))
+
+    def testEmpty(self):
+        self.assertEqual(Base64Encoder().final(), '')
+
+
+class testStreamingDump(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _chunks(self):
+        for i in range(10):
+            yield bytearray([0xdb, 0xdc]) + bytearray([i] * 18)
+            yield bytearray([i] * 20)
+        yield bytearray([0xc0, 0, 0, 0x78, 0x23, 10, 0])
+
+    def testSameAsDump(self):
+        filename = os.path.join(self.dir, 'streamed.txt')
+        streamed = StreamingDump(0, TextDumpWriter(filename))
+        d = Dump(0)
+        for chunk in self._chunks():
+            d.add(chunk)
+            streamed.add(chunk)
+        self.assertEqual(streamed.toBase64(), d.toBase64())
+        self.assertEqual(streamed.data, d.data)
+        reference = os.path.join(self.dir, 'reference.txt')
+        d.toFile(reference)
+        with open(filename) as f1:
+            with open(reference) as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def testResponse(self):
+        filename = os.path.join(self.dir, 'dump.txt')
+        streamed = StreamingDump(0, TextDumpWriter(filename))
+        for chunk in self._chunks():
+            streamed.add(chunk)
+        streamed.response(bytearray(range(25)))
+        with open(filename) as f:
+            content = f.read()
+        self.assertTrue(content.endswith(
+            '\n\n00 01 02 03 04 05 06 07 08 09 0A 0B 0C 0D 0E 0F 10 11 12 13\n'
+            '14 15 16 17 18\n'))
+
+    def testDiscard(self):
+        filename = os.path.join(self.dir, 'dump.txt')
+        streamed = StreamingDump(0, TextDumpWriter(filename))
+        streamed.add(bytearray(range(20)))
+        streamed.discard()
+        self.assertFalse(os.path.exists(filename))
+
+    def testNoWriter(self):
+        streamed = StreamingDump(0)
+        d = Dump(0)
+        for chunk in self._chunks():
+            d.add(chunk)
+            streamed.add(chunk)
+        self.assertEqual(streamed.toBase64(), d.toBase64())
+
+
+class testBinaryDump(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testRoundTrip(self):
+        filename = os.path.join(self.dir, 'dump.bin')
+        writeBinaryDump(filename, 'ABCDEF123456', 1400000000, 13,
+                        bytearray(range(10)), bytearray([0xc0, 0, 13, 0x78, 0x23, 10, 0]),
+                        bytearray(range(30)))
+        with BinaryDump.fromFile(filename) as dump:
+            self.assertEqual(dump.trackerId, 'ABCDEF123456')
+            self.assertEqual(dump.timestamp, 1400000000)
+            self.assertEqual(dump.dumpType, 13)
+            self.assertEqual(dump.crc, 0x2378)
+            self.assertEqual(dump.data, bytearray(range(10)))
+            self.assertEqual(dump.footer, bytearray([0xc0, 0, 13, 0x78, 0x23, 10, 0]))
+            self.assertEqual(dump.response, bytearray(range(30)))
+            d = dump.toDump()
+        self.assertTrue(d.isValid())
+        self.assertEqual(os.path.getsize(filename), BINARY_HEADER.size + 10 + 7 + 30)
+
+    def testStreamed(self):
+        filename = os.path.join(self.dir, 'dump.bin')
+        streamed = StreamingDump(0, BinaryDumpWriter(filename, 'ABCDEF123456', 42, 0))
+        streamed.add(bytearray(range(10)))
+        streamed.add(bytearray([0xc0, 0, 0, 0x78, 0x23, 10, 0]))
+        streamed.commit()
+        with BinaryDump.fromFile(filename) as dump:
+            self.assertEqual(dump.data, bytearray(range(10)))
+            self.assertEqual(len(dump.response), 0)
+        streamed.response(bytearray(range(5)))
+        with BinaryDump.fromFile(filename) as dump:
+            self.assertEqual(dump.data, bytearray(range(10)))
+            self.assertEqual(dump.response, bytearray(range(5)))
+
+    def testViewsInUse(self):
+        filename = os.path.join(self.dir, 'dump.bin')
+        writeBinaryDump(filename, 'ABCDEF123456', 42, 13,
+                        bytearray(range(10)), bytearray([0xc0, 0, 13]))
+        with BinaryDump.fromFile(filename) as dump:
+            kept = dump.data[2:5]
+        self.assertTrue(dump._file.closed)
+        self.assertEqual(kept.tolist(), [2, 3, 4])
+
+    def testInterrupted(self):
+        filename = os.path.join(self.dir, 'dump.bin')
+        self.assertRaises(TypeError, writeBinaryDump, filename,
+                          'ABCDEF123456', 42, 13, bytearray(range(10)),
+                          bytearray([0xc0, 0, 13]), object())
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def testBadTrackerId(self):
+        filename = os.path.join(self.dir, 'dump.bin')
+        for trackerId in ('ABCDEF', 'ABCDEF12345678'):
+            self.assertRaises(ValueError, BinaryDumpWriter, filename,
+                              trackerId, 42)
+
+    def testNotBinary(self):
+        self.assertRaises(ValueError, BinaryDump, bytearray(BINARY_HEADER.size))
+
+    def testConvert(self):
+        trackerDir = os.path.join(self.dir, 'ABCDEF123456')
+        os.mkdir(trackerDir)
+        filename = os.path.join(trackerDir, 'dump-1400000000.txt')
+        d = Dump(0)
+        d.add(bytearray(range(30)))
+        d.add(bytearray([0xc0, 0, 0, 1, 2, 30, 0]))
+        d.toFile(filename)
+        with open(filename, 'at') as f:
+            f.write('\n00 01 02\n')
+        binFilename = convertTextDump(filename)
+        self.assertEqual(binFilename, os.path.join(trackerDir, 'dump-1400000000.bin'))
+        with BinaryDump.fromFile(binFilename) as dump:
+            self.assertEqual(dump.trackerId, 'ABCDEF123456')
+            self.assertEqual(dump.timestamp, 1400000000)
+            self.assertEqual(dump.data, bytearray(range(30)))
+            self.assertEqual(dump.footer, bytearray([0xc0, 0, 0, 1, 2, 30, 0]))
+            self.assertEqual(dump.response, bytearray([0, 1, 2]))
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from galileo.dump import StreamingDump
+from galileo.dumpstore import (BinaryDumpStore, SegmentDumpStore,
+                               TextDumpStore, DUMP, RESPONSE)
+
+FOOTER = bytearray([0xc0, 0, 0, 0x78, 0x23, 10, 0])
+
+
+class testDumpStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _sync(self, store, timestamp, data, response=None):
+        streamed = StreamingDump(0, store.newDump('ABCDEF123456', timestamp))
+        streamed.add(data)
+        streamed.add(FOOTER)
+        streamed.commit()
+        if response is not None:
+            streamed.response(response)
+
+    def testText(self):
+        self._sync(TextDumpStore(self.dir), 42, bytearray(range(10)))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.dir, 'ABCDEF123456', 'dump-42.txt')))
+
+    def testBinary(self):
+        self._sync(BinaryDumpStore(self.dir), 42, bytearray(range(10)))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.dir, 'ABCDEF123456', 'dump-42.bin')))
+
+
+class testSegmentDumpStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _sync(self, store, timestamp, data, response=None):
+        streamed = StreamingDump(0, store.newDump('ABCDEF123456', timestamp))
+        streamed.add(data)
+        streamed.add(FOOTER)
+        streamed.commit()
+        if response is not None:
+            streamed.response(response)
+
+    def testAppendAndRead(self):
+        store = SegmentDumpStore(self.dir)
+        for i in range(5):
+            self._sync(store, 100 + i, bytearray([i] * (i + 1)),
+                       bytearray(range(i)))
+        store.close()
+        self.assertEqual(sorted(os.listdir(os.path.join(self.dir,
+                                                        'ABCDEF123456'))),
+                         ['index', 'segment-000000.seg'])
+        entries = store.find('ABCDEF123456')
+        self.assertEqual([(e.timestamp, e.kind) for e in entries],
+                         [(100, DUMP), (100, RESPONSE), (101, DUMP),
+                          (101, RESPONSE), (102, DUMP), (102, RESPONSE),
+                          (103, DUMP), (103, RESPONSE), (104, DUMP),
+                          (104, RESPONSE)])
+        dump = store.read('ABCDEF123456', entries[6])
+        self.assertEqual(dump.timestamp, 103)
+        self.assertEqual(dump.data, bytearray([3] * 4))
+        self.assertEqual(dump.footer, FOOTER)
+        response = store.read('ABCDEF123456', entries[7])
+        self.assertEqual(len(response.data), 0)
+        self.assertEqual(response.response, bytearray(range(3)))
+
+    def testFindRange(self):
+        store = SegmentDumpStore(self.dir)
+        for i in range(20):
+            self._sync(store, 1000 + 10 * i, bytearray(range(i + 1)))
+        store.close()
+        entries = store.find('ABCDEF123456', 1045, 1100)
+        self.assertEqual([e.timestamp for e in entries],
+                         [1050, 1060, 1070, 1080, 1090])
+        self.assertEqual(store.find('ABCDEF123456', 2000), [])
+        self.assertEqual(store.find('000000000000'), [])
+
+    def testRotation(self):
+        store = SegmentDumpStore(self.dir, segmentSize=100)
+        for i in range(4):
+            self._sync(store, i, bytearray(range(80)))
+        store.close()
+        entries = store.find('ABCDEF123456')
+        self.assertEqual([e.segment for e in entries], [0, 1, 2, 3])
+        for i, entry in enumerate(entries):
+            self.assertEqual(entry.offset, 0)
+            self.assertEqual(store.read('ABCDEF123456', entry).timestamp, i)
+        # A new store continues with the last segment
+        store = SegmentDumpStore(self.dir, segmentSize=100)
+        self._sync(store, 4, bytearray(range(80)))
+        self.assertEqual(store.find('ABCDEF123456', 4)[0].segment, 4)
+
+    def testDiscardKeepsPreviousDumps(self):
+        store = SegmentDumpStore(self.dir)
+        self._sync(store, 1, bytearray(range(10)))
+        streamed = StreamingDump(0, store.newDump('ABCDEF123456', 2))
+        streamed.add(bytearray(range(20)))
+        streamed.discard()
+        entries = store.find('ABCDEF123456')
+        self.assertEqual(len(entries), 1)
+        filename = store.segmentName('ABCDEF123456', 0)
+        self.assertEqual(os.path.getsize(filename), entries[0].length)
+
+    def testDiscardAfterFooter(self):
+        """ A dump with its footer can still turn out to be invalid """
+        store = SegmentDumpStore(self.dir)
+        streamed = StreamingDump(0, store.newDump('ABCDEF123456', 1))
+        streamed.add(bytearray(range(10)))
+        streamed.add(FOOTER)
+        streamed.discard()
+        filename = store.segmentName('ABCDEF123456', 0)
+        self.assertEqual(store.find('ABCDEF123456'), [])
+        self.assertEqual(os.path.getsize(filename), 0)
+        self._sync(store, 2, bytearray(range(10)))
+        streamed = StreamingDump(0, store.newDump('ABCDEF123456', 3))
+        streamed.add(bytearray(range(10)))
+        streamed.add(FOOTER)
+        streamed.commit()
+        streamed.discard()
+        entries = store.find('ABCDEF123456')
+        self.assertEqual([(e.timestamp, e.offset) for e in entries], [(2, 0)])
+        self.assertEqual(os.path.getsize(filename), entries[0].length)
+        self.assertEqual(store.read('ABCDEF123456', entries[0]).timestamp, 2)
+
+    def testSyncBatching(self):
+        store = SegmentDumpStore(self.dir, syncEvery=3)
+        self._sync(store, 1, bytearray(range(10)), bytearray(1))
+        self.assertEqual(store._unsynced, 2)
+        self._sync(store, 2, bytearray(range(10)))
+        self.assertEqual(store._unsynced, 0)
+        self._sync(store, 3, bytearray(range(10)))
+        store.close()
+        self.assertEqual(store._unsynced, 0)
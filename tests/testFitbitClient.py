@@ -232,6 +232,43 @@ class testDiscover(unittest.TestCase):
         t = ts[1]
         self.assertEqual(t.id, bytearray([0xbb] * 6))
 
+    def testEarlyExit(self):
+        """ The discovery is cancelled once the expected tracker is heard """
+        global FitbitClient
+        FitbitClient = type('FitbitClient', (MyDongle, ), dict(FitbitClient.__dict__))
+        c = FitbitClient([(0x20, 1, 0x53, 0x74, 0x61, 0x72, 0x74, 0x44, 0x69, 0x73, 0x63, 0x6F, 0x76, 0x65, 0x72, 0x79, 0 ),
+                      (0x13, 3, 0xaa,0xaa,0xaa,0xaa,0xaa,0xaa,1,0xe2, 2,6,4, 3,
+                       0x2c, 0x31, 0xf6, 0xd8, 0x58),
+                      # Heard before the cancellation got through
+                      (0x13, 3, 0xbb,0xbb,0xbb,0xbb,0xbb,0xbb,1,0xe2, 2,6,4, 3,
+                       0x2c, 0x31, 0xf6, 0xd8, 0x58),
+                      (3, 2, 2),
+                      (0x20, 1, 0x43, 0x61, 0x6E, 0x63, 0x65, 0x6C, 0x44, 0x69, 0x73, 0x63, 0x6F, 0x76, 0x65, 0x72, 0x79, 0),
+                     ])
+        c.MIN_DISCOVERY = 0
+        ts = [t for t in c.discover(MyUUID(), 0xfb00, 0xfb01, 0xfb02, -255,
+                                    4000, expected=set(['AAAAAAAAAAAA']))]
+        self.assertEqual([t.id for t in ts], ['AAAAAAAAAAAA'])
+        self.assertEqual(c.idx, len(c.responses))
+
+    def testMinDiscovery(self):
+        """ The trackers heard soon after the expected ones are kept """
+        global FitbitClient
+        FitbitClient = type('FitbitClient', (MyDongle, ), dict(FitbitClient.__dict__))
+        c = FitbitClient([(0x20, 1, 0x53, 0x74, 0x61, 0x72, 0x74, 0x44, 0x69, 0x73, 0x63, 0x6F, 0x76, 0x65, 0x72, 0x79, 0 ),
+                      (0x13, 3, 0xaa,0xaa,0xaa,0xaa,0xaa,0xaa,1,0xe2, 2,6,4, 3,
+                       0x2c, 0x31, 0xf6, 0xd8, 0x58),
+                      (0x13, 3, 0xbb,0xbb,0xbb,0xbb,0xbb,0xbb,1,0xe2, 2,6,4, 3,
+                       0x2c, 0x31, 0xf6, 0xd8, 0x58),
+                      (),
+                      (0x20, 1, 0x43, 0x61, 0x6E, 0x63, 0x65, 0x6C, 0x44, 0x69, 0x73, 0x63, 0x6F, 0x76, 0x65, 0x72, 0x79, 0),
+                     ])
+        c.MIN_DISCOVERY = 1000
+        ts = [t for t in c.discover(MyUUID(), 0xfb00, 0xfb01, 0xfb02, -255,
+                                    4000, expected=set(['AAAAAAAAAAAA']))]
+        self.assertEqual([t.id for t in ts], ['AAAAAAAAAAAA', 'BBBBBBBBBBBB'])
+        self.assertEqual(c.idx, len(c.responses))
+
     def testTimeout(self):
         global FitbitClient
         FitbitClient = type('FitbitClient', (MyDongle, ), dict(FitbitClient.__dict__))
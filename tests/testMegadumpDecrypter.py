@@ -1,7 +1,13 @@
 import unittest
 
-from galileo.megadumpDecrypter import computeCounter, counter, XTEA_CMAC
+from galileo import xtea
+import galileo.megadumpDecrypter as mod
+from galileo.megadumpDecrypter import computeCounter, counter, decrypt, XTEA_CMAC, XTEA_CTR
 from galileo.utils import x2a
+from galileo.xtea import xtea_encrypt
+
+KEY = bytearray(range(16))
+
 
 class TestXTEAMegadumpDecrypter(unittest.TestCase):
 
@@ -33,6 +39,29 @@ class testXTEA_CMAC(unittest.TestCase):
         expectedResult = bytearray(x2a('b5 f3 eb 27 15 45 e5 55'))
         self.assertEqual(result, expectedResult)
 
+    def testChunking(self):
+        """ The MAC doesn't depend on how the message is split """
+        msg = bytearray((i * 31) & 0xff for i in range(203))
+        for length in (0, 1, 8, 9, 16, 17, 203):
+            expected = XTEA_CMAC(KEY, msg[:length]).final()
+            for size in (1, 3, 7, 8, 9, 64):
+                cmac = XTEA_CMAC(KEY)
+                for i in range(0, length, size):
+                    cmac.update(msg[i:min(i + size, length)])
+                self.assertEqual(cmac.final(), expected, (length, size))
+
+    def testDigestTwice(self):
+        cmac = XTEA_CMAC(KEY, bytearray(range(12)))
+        first = cmac.digest()
+        self.assertEqual(cmac.digest(), first)
+        cmac.update(bytearray(range(12, 20)))
+        self.assertEqual(cmac.digest(), XTEA_CMAC(KEY, bytearray(range(20))).digest())
+
+    def testMemoryview(self):
+        msg = bytes(range(40))
+        self.assertEqual(XTEA_CMAC(KEY, memoryview(msg)).final(),
+                         XTEA_CMAC(KEY, bytearray(msg)).final())
+
 
 class testCounter(unittest.TestCase):
     def testSimple(self):
@@ -40,3 +69,51 @@ class testCounter(unittest.TestCase):
         self.assertEqual(bytearray(r'%2dUI84e', 'utf-8'), next(c))
         self.assertEqual(bytearray(r'&2dUI84e', 'utf-8'), next(c))
         self.assertEqual(bytearray(r"'2dUI84e", 'utf-8'), next(c))
+
+
+def referenceKeystream(key, nonce, length):
+    """ The byte-by-byte keystream, as it was computed before """
+    stream = bytearray()
+    c = counter(nonce)
+    while len(stream) < length:
+        stream.extend(xtea_encrypt(key, next(c)))
+    return stream[:length]
+
+
+class testXTEA_CTR(unittest.TestCase):
+
+    def _check(self):
+        nonce = bytearray([0xfe, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff])
+        data = bytearray((i * 7) & 0xff for i in range(101))
+        expected = bytearray(x ^ y for (x, y) in zip(
+            data, referenceKeystream(KEY, nonce, len(data))))
+        self.assertEqual(XTEA_CTR(KEY, nonce).decrypt(data), expected)
+        # Same thing, in pieces
+        cipher = XTEA_CTR(KEY, nonce)
+        result = bytearray()
+        for i in range(0, len(data), 13):
+            result.extend(cipher.decrypt(data[i:i + 13]))
+        self.assertEqual(result, expected)
+
+    def testNumpy(self):
+        if mod.numpy is None:
+            self.skipTest("NumPy not available")
+        self._check()
+
+    def testPurePython(self):
+        numpys = mod.numpy, xtea.numpy
+        mod.numpy = xtea.numpy = None
+        try:
+            self._check()
+        finally:
+            mod.numpy, xtea.numpy = numpys
+
+    def testDecryptInPlace(self):
+        class MyDump(object):
+            nonce = bytearray([0xD0, 0, 0, 0])
+        dump = MyDump()
+        dump.data = bytearray(range(16)) + bytearray(40)
+        decrypt(dump, KEY)
+        self.assertEqual(dump.data[:16], bytearray(range(16)))
+        c = computeCounter(KEY, MyDump.nonce)
+        self.assertEqual(dump.data[16:], referenceKeystream(KEY, c, 40))
@@ -0,0 +1,291 @@
+import unittest
+
+import galileo.ble.pydbus as mod
+from galileo.ble import DM
+from galileo.ble.pydbus import PyDBUS
+from galileo.dump import CRC16
+from galileo.utils import i2lsba
+
+
+class FakeContext(object):
+    """ A GLib main context with a fake clock """
+    def __init__(self):
+        self.now = 0
+        # the events ready to be dispatched
+        self.events = []
+        # id -> (time, callback)
+        self.timeouts = {}
+
+    def iteration(self, mayBlock):
+        if self.events:
+            self.events.pop(0)()
+            return True
+        if not mayBlock or not self.timeouts:
+            return False
+        id = min(self.timeouts, key=lambda i: self.timeouts[i][0])
+        self.now, callback = self.timeouts.pop(id)
+        callback()
+        return True
+
+
+class FakeGLib(object):
+    def __init__(self, context):
+        self.context = context
+        self.nextId = 0
+
+    def timeout_add(self, timeout, callback):
+        self.nextId += 1
+        self.context.timeouts[self.nextId] = (self.context.now + timeout,
+                                              callback)
+        return self.nextId
+
+    def source_remove(self, id):
+        del self.context.timeouts[id]
+
+
+class FakeLoop(object):
+    def __init__(self, context):
+        self.context = context
+
+    def get_context(self):
+        return self.context
+
+
+class FakeCharacteristic(object):
+    """ The write characteristic of a tracker that echoes what it gets on
+    the read one """
+    def __init__(self, context, read):
+        self.context = context
+        self.read = read
+
+    def WriteValue(self, value, options):
+        changed = {'Value': bytearray(value)}
+        self.context.events.append(
+            lambda: self.read.onPropertiesChanged(None, changed, []))
+
+
+class FakeRead(object):
+    onPropertiesChanged = None
+
+
+class testReadData(unittest.TestCase):
+
+    def setUp(self):
+        self.GLib = getattr(mod, 'GLib', None)
+        self.context = FakeContext()
+        mod.GLib = FakeGLib(self.context)
+        self.api = PyDBUS(0)
+        self.api.loop = FakeLoop(self.context)
+        self.api.read = FakeRead()
+        self.api.read.onPropertiesChanged = self.api._received
+        self.api.write = FakeCharacteristic(self.context, self.api.read)
+
+    def tearDown(self):
+        if self.GLib is None:
+            del mod.GLib
+        else:
+            mod.GLib = self.GLib
+
+    def testImmediate(self):
+        self.api._writeData(DM([0xc0, 6]))
+        self.assertEqual(self.api._readData(), DM([0xc0, 6]))
+        # No time was spent waiting
+        self.assertEqual(self.context.now, 0)
+        self.assertEqual(self.context.timeouts, {})
+
+    def testSeveral(self):
+        for i in range(10):
+            self.api._writeData(DM([0xc0, i]))
+        for i in range(10):
+            self.assertEqual(self.api._readData(), DM([0xc0, i]))
+        self.assertEqual(self.context.now, 0)
+
+    def testTimeout(self):
+        self.assertEqual(self.api._readData(500), None)
+        self.assertEqual(self.context.now, 500)
+        self.assertEqual(self.context.timeouts, {})
+
+    def testNoValue(self):
+        self.api._received(None, {}, [])
+        self.assertEqual(self.api._readData(10), None)
+
+    def testBatch(self):
+        for i in range(10):
+            self.api._writeData(DM([i]))
+        # Let the notifications come in
+        while self.context.events:
+            self.context.iteration(False)
+        self.assertEqual(self.api._readDataBatch(),
+                         [DM([i]) for i in range(10)])
+        self.assertEqual(self.api.readqueue.highWater, 10)
+        self.assertEqual(self.api._readDataBatch(10), [])
+
+    def testGetDump(self):
+        data = [DM([i] * 20) for i in range(30)]
+        crc = CRC16()
+        for d in data:
+            crc.update(d.data)
+        footer = DM([0xc0, 0, 13] + i2lsba(crc.final(), 2) + i2lsba(600, 4))
+        chunks = [DM([0xc0, 0x41, 13])] + data + [footer]
+        def write(value, options):
+            # The tracker sends the whole dump at once
+            for chunk in chunks:
+                self.api._received(None, {'Value': chunk.data}, [])
+        self.api.write.WriteValue = write
+        dump = self.api.getDump(13)
+        self.assertEqual(dump.len, 600)
+        self.assertEqual(len(self.api.readqueue), 0)
+
+
+class FakeSignal(object):
+    def __init__(self):
+        self.handlers = []
+
+    def connect(self, handler):
+        self.handlers.append(handler)
+        signal = self
+        class Subscription(object):
+            def disconnect(self):
+                signal.handlers.remove(handler)
+        return Subscription()
+
+    def __call__(self, *args):
+        for handler in self.handlers:
+            handler(*args)
+
+
+class FakeManager(object):
+    """ The BlueZ object manager """
+    def __init__(self, objects):
+        self.objects = objects
+        self.calls = 0
+        self.InterfacesAdded = FakeSignal()
+        self.InterfacesRemoved = FakeSignal()
+
+    def GetManagedObjects(self):
+        self.calls += 1
+        return self.objects
+
+
+class testObjectIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = FakeManager({
+            '/org/bluez/hci0': {'org.bluez.Adapter1': {'Powered': True}},
+            '/org/bluez/hci0/dev_A': {'org.bluez.Device1': {'Connected': False}},
+            '/org/bluez/hci0/dev_A/service1/char1': {
+                'org.bluez.GattCharacteristic1': {'UUID': 'a'}},
+            '/org/bluez/hci1/dev_B': {'org.bluez.Device1': {'Connected': True}},
+        })
+        self.index = mod.ObjectIndex(self.manager)
+
+    def testLoadedOnce(self):
+        for i in range(3):
+            self.assertEqual(len(list(self.index.objects('org.bluez.Device1'))), 2)
+        self.assertEqual(self.manager.calls, 1)
+
+    def testPrefix(self):
+        self.assertEqual(
+            [p for p, o in self.index.objects('org.bluez.Device1', '/org/bluez/hci0/')],
+            ['/org/bluez/hci0/dev_A'])
+        self.assertEqual(
+            list(self.index.objects('org.bluez.GattCharacteristic1',
+                                    '/org/bluez/hci1/dev_B/')), [])
+
+    def testAddedRemoved(self):
+        self.manager.InterfacesAdded('/org/bluez/hci0/dev_C', {
+            'org.bluez.Device1': {'Connected': False}})
+        self.assertEqual(len(list(self.index.objects('org.bluez.Device1'))), 3)
+        self.manager.InterfacesRemoved('/org/bluez/hci0/dev_A',
+                                       ['org.bluez.Device1'])
+        self.assertEqual(
+            sorted(p for p, o in self.index.objects('org.bluez.Device1')),
+            ['/org/bluez/hci0/dev_C', '/org/bluez/hci1/dev_B'])
+        self.index.close()
+        self.manager.InterfacesAdded('/org/bluez/hci0/dev_D', {
+            'org.bluez.Device1': {}})
+        self.assertEqual(len(list(self.index.objects('org.bluez.Device1'))), 2)
+
+    def testPropertiesChanged(self):
+        self.index._signal('org.bluez', '/org/bluez/hci0/dev_A', self.index.PROPERTIES,
+                           'PropertiesChanged',
+                           ('org.bluez.Device1', {'Connected': True, 'RSSI': -40}, []))
+        self.index.propertiesChanged('/org/bluez/hci0/dev_A', 'org.bluez.Device1',
+                                     {}, ['RSSI'])
+        self.assertEqual(list(self.index.objects('org.bluez.Device1', '/org/bluez/hci0/')),
+                         [('/org/bluez/hci0/dev_A', {'Connected': True})])
+
+
+class FakeAdapter(object):
+    Powered = True
+
+
+class FakeBus(object):
+    """ Counts the subscriptions to the PropertiesChanged signals """
+    def __init__(self, manager):
+        self.manager = manager
+        self.subscriptions = []
+
+    def get(self, service, path):
+        if path == '/':
+            return self.manager
+        return FakeAdapter()
+
+    def subscribe(self, **kwargs):
+        subscriptions = self.subscriptions
+        class Subscription(object):
+            def disconnect(self):
+                subscriptions.remove(self)
+        subscriptions.append(Subscription())
+        return subscriptions[-1]
+
+
+class FakePyDBUS(object):
+    def __init__(self, bus):
+        self.bus = bus
+
+    def SystemBus(self):
+        return self.bus
+
+
+class testTeardown(unittest.TestCase):
+
+    def setUp(self):
+        self.modules = mod.pydbus, getattr(mod, 'GLib', None)
+        self.manager = FakeManager({
+            '/org/bluez/hci0': {'org.bluez.Adapter1': {'Powered': True}}})
+        self.bus = FakeBus(self.manager)
+        mod.pydbus = FakePyDBUS(self.bus)
+        mod.GLib = FakeGLib(FakeContext())
+        mod.GLib.MainLoop = lambda: None
+
+    def tearDown(self):
+        mod.pydbus, GLib = self.modules
+        if GLib is None:
+            del mod.GLib
+        else:
+            mod.GLib = GLib
+
+    def _subscriptions(self):
+        return (len(self.manager.InterfacesAdded.handlers) +
+                len(self.manager.InterfacesRemoved.handlers) +
+                len(self.bus.subscriptions))
+
+    def testSetupAgain(self):
+        """ The index of the previous setup stops following the signals """
+        api = PyDBUS(0)
+        self.assertTrue(api.setup())
+        self.assertEqual(self._subscriptions(), 3)
+        self.assertTrue(api.setup())
+        self.assertEqual(self._subscriptions(), 3)
+        api.close()
+        self.assertEqual(self._subscriptions(), 0)
+        api.close()
+
+
+class testAddressToId(unittest.TestCase):
+
+    def testReversed(self):
+        self.assertEqual(mod.addressToId('AA:BB:CC:DD:EE:01'), '01EEDDCCBBAA')
+        self.assertEqual(mod.addressToId('AA:BB:CC:DD:EE:01', False),
+                         bytearray([1, 0xee, 0xdd, 0xcc, 0xbb, 0xaa]))
@@ -0,0 +1,78 @@
+import threading
+import unittest
+
+from galileo.radio import assignTrackers, discoverAll
+
+
+class MyTracker(object):
+    def __init__(self, id, RSSI):
+        self.id = id
+        self.RSSI = RSSI
+
+
+class MyRadio(object):
+    def __init__(self, name, heard):
+        self.name = name
+        self.heard = heard
+
+    def discover(self, *args):
+        return [MyTracker(id, RSSI) for id, RSSI in sorted(self.heard.items())]
+
+
+class MyThreadSafeRadio(MyRadio):
+    threadSafe = True
+
+    def __init__(self, name, heard):
+        MyRadio.__init__(self, name, heard)
+        self.discovering = threading.Event()
+        self.other = None
+        self.overlapped = False
+
+    def discover(self, *args):
+        self.discovering.set()
+        self.overlapped = self.other.discovering.wait(5)
+        return MyRadio.discover(self, *args)
+
+
+class testDiscoverAll(unittest.TestCase):
+
+    def testParallel(self):
+        r1 = MyThreadSafeRadio('r1', {'AA': -50})
+        r2 = MyThreadSafeRadio('r2', {'AA': -60, 'BB': -70})
+        r1.other, r2.other = r2, r1
+        discovered = discoverAll([r1, r2])
+        self.assertTrue(r1.overlapped)
+        self.assertTrue(r2.overlapped)
+        self.assertEqual([(RSSI, r) for RSSI, r, t in discovered['AA']],
+                         [(-50, r1), (-60, r2)])
+        self.assertEqual(sorted(discovered), ['AA', 'BB'])
+
+    def testError(self):
+        r1 = MyThreadSafeRadio('r1', {'AA': -50})
+        r1.other = r1
+        r2 = MyThreadSafeRadio('r2', {})
+        r2.discover = None
+        self.assertRaises(TypeError, discoverAll, [r1, r2])
+
+
+class testAssignTrackers(unittest.TestCase):
+
+    def testBestRSSI(self):
+        r1 = MyRadio('r1', {'AA': -50, 'BB': -80})
+        r2 = MyRadio('r2', {'BB': -60, 'CC': -90})
+        assignment = assignTrackers([r1, r2], discoverAll([r1, r2]))
+        self.assertEqual([t.id for t in assignment[r1]], ['AA'])
+        self.assertEqual([t.id for t in assignment[r2]], ['BB', 'CC'])
+        # The tracker object is the one from the radio it's assigned to
+        self.assertEqual(assignment[r2][0].RSSI, -60)
+
+    def testBalanceOnEquality(self):
+        r1 = MyRadio('r1', {'AA': -50, 'BB': -50, 'CC': -50, 'DD': -50})
+        r2 = MyRadio('r2', {'AA': -50, 'BB': -50, 'CC': -50, 'DD': -50})
+        assignment = assignTrackers([r1, r2], discoverAll([r1, r2]))
+        self.assertEqual(len(assignment[r1]), 2)
+        self.assertEqual(len(assignment[r2]), 2)
+
+    def testNothing(self):
+        r1 = MyRadio('r1', {})
+        self.assertEqual(assignTrackers([r1], discoverAll([r1])), {r1: []})
@@ -0,0 +1,26 @@
+import unittest
+
+from galileo.ble import ReceiveRing
+
+
+class testReceiveRing(unittest.TestCase):
+
+    def testFIFO(self):
+        r = ReceiveRing()
+        self.assertFalse(r)
+        for i in range(5):
+            r.append(i)
+        self.assertTrue(r)
+        self.assertEqual(len(r), 5)
+        self.assertEqual(r.popleft(), 0)
+        self.assertEqual(r.drain(), [1, 2, 3, 4])
+        self.assertEqual(len(r), 0)
+        self.assertEqual(r.highWater, 5)
+
+    def testDropOldest(self):
+        r = ReceiveRing(3)
+        for i in range(5):
+            r.append(i)
+        self.assertEqual(r.dropped, 2)
+        self.assertEqual(r.highWater, 3)
+        self.assertEqual(r.drain(), [2, 3, 4])
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from galileo.registry import TrackerRegistry
+
+
+class MyTracker(object):
+    def __init__(self, id, RSSI=-60):
+        self.id = id
+        self.RSSI = RSSI
+        self.addrType = 1
+        self.syncedRecently = True
+
+
+class testTrackerRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testPersistence(self):
+        registry = TrackerRegistry(self.dir)
+        self.assertEqual(registry.known(), set())
+        trackers = list(registry.watch([MyTracker('AA', -40), MyTracker('BB')],
+                                       set(['AA', 'BB'])))
+        self.assertEqual([t.id for t in trackers], ['AA', 'BB'])
+        registry.save()
+        self.assertTrue(os.path.exists(os.path.join(self.dir,
+                                                    'trackers.json')))
+        registry = TrackerRegistry(self.dir)
+        self.assertEqual(registry.known(), set(['AA', 'BB']))
+        self.assertEqual(registry.trackers['AA']['RSSI'], -40)
+        self.assertEqual(registry.trackers['AA']['addrType'], 1)
+        self.assertTrue(registry.trackers['BB']['syncedRecently'])
+        self.assertEqual(len(registry.durations), 1)
+
+    def testInMemory(self):
+        registry = TrackerRegistry()
+        list(registry.watch([MyTracker('AA')]))
+        registry.save()
+        self.assertEqual(registry.known(), set(['AA']))
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def testCorrupted(self):
+        with open(os.path.join(self.dir, 'trackers.json'), 'w') as f:
+            f.write('{"trackers": ')
+        self.assertEqual(TrackerRegistry(self.dir).known(), set())
+
+    def testMaxAge(self):
+        """ The trackers not heard for long are not expected anymore """
+        registry = TrackerRegistry()
+        list(registry.watch([MyTracker('AA'), MyTracker('BB')]))
+        registry.trackers['BB']['lastSeen'] = time.time() - 2 * registry.MAX_AGE
+        self.assertEqual(registry.known(), set(['AA']))
+        self.assertEqual(registry.known(3 * registry.MAX_AGE), set(['AA', 'BB']))
+
+    def testTimeout(self):
+        registry = TrackerRegistry()
+        self.assertEqual(registry.timeout(4000), 4000)
+        registry.durations = [300, 1200]
+        self.assertEqual(registry.timeout(4000), 2400)
+        self.assertEqual(registry.timeout(2000), 2000)
+        registry.durations = [10]
+        self.assertEqual(registry.timeout(4000), registry.MIN_TIMEOUT)
+
+    def testMissingExpected(self):
+        """ No duration when some expected tracker was not heard """
+        registry = TrackerRegistry()
+        list(registry.watch([MyTracker('AA')], set(['AA', 'CC'])))
+        self.assertEqual(registry.durations, [])
+
+    def testHistory(self):
+        registry = TrackerRegistry()
+        for i in range(registry.HISTORY + 5):
+            list(registry.watch([MyTracker('AA')], set(['AA'])))
+        self.assertEqual(len(registry.durations), registry.HISTORY)
@@ -1,3 +1,4 @@
+import threading
 import unittest
 import sys
 
@@ -5,6 +6,7 @@ from galileo import __version__
 
 from galileo.databases import SyncError
 import galileo.databases.xml as mod
+from galileo.databases.rest import RemoteRESTDatabase
 from galileo.databases.xml import RemoteXMLDatabase
 from galileo.netUtils import BackOffException
 
@@ -13,6 +15,16 @@ class requestResponse(object):
         self.text = """<?xml version="1.0" encoding="utf-8" standalone="yes"?><galileo-server version="2.0">%s%s</galileo-server>""" % (server_version, text)
     def raise_for_status(self): pass
 
+class MySession(object):
+    """ Stands for `requests.Session` """
+    def __init__(self, post):
+        self._post = post
+        self.timeouts = []
+
+    def post(self, url, data, headers, timeout=None):
+        self.timeouts.append(timeout)
+        return self._post(url, data, headers)
+
 class testStatus(unittest.TestCase):
 
     def testOk(self):
@@ -25,8 +37,7 @@ class testStatus(unittest.TestCase):
             self.assertEqual(headers['Content-Type'], 'text/xml')
             return requestResponse('')
 
-        mod.requests.post = mypost
-        gc = RemoteXMLDatabase('scheme', 'host', 'path/to/stuff', 8888)
+        gc = RemoteXMLDatabase('scheme', 'host', 'path/to/stuff', 8888, session=MySession(mypost))
         gc.requestStatus()
 
     def testError(self):
@@ -40,8 +51,7 @@ class testStatus(unittest.TestCase):
             self.assertEqual(headers['Content-Type'], 'text/xml')
             return requestResponse('<error>Something is Wrong</error>')
 
-        mod.requests.post = mypost
-        gc = RemoteXMLDatabase('h', 'c', 'p', 8)
+        gc = RemoteXMLDatabase('h', 'c', 'p', 8, session=MySession(mypost))
         self.assertRaises(SyncError, gc.requestStatus)
 
     def testBackOff(self):
@@ -66,8 +76,7 @@ class testStatus(unittest.TestCase):
         </client-display>
     </ui-request>""", '')
 
-        mod.requests.post = mypost
-        gc = RemoteXMLDatabase('h', 'c', 'p', 4)
+        gc = RemoteXMLDatabase('h', 'c', 'p', 4, session=MySession(mypost))
         with self.assertRaises(BackOffException) as cm:
             gc.requestStatus()
         e = cm.exception
@@ -91,8 +100,7 @@ class testStatus(unittest.TestCase):
             delattr(res, 'text')
             return res
 
-        mod.requests.post = mypost
-        gc = RemoteXMLDatabase('scheme', 'host', 'path/to/stuff', 8888)
+        gc = RemoteXMLDatabase('scheme', 'host', 'path/to/stuff', 8888, session=MySession(mypost))
         gc.requestStatus()
 
 class MyDongle(object):
@@ -121,8 +129,7 @@ class testSync(unittest.TestCase):
             self.assertEqual(headers['Content-Type'], 'text/xml')
             return requestResponse('<tracker tracker-id="abcd" type="megadumpresponse"><data>ZWZnaA==</data></tracker>')
 
-        mod.requests.post = mypost
-        gc = RemoteXMLDatabase('a', 'b', 'c', 0)
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=MySession(mypost))
         self.assertEqual(gc.sync(D, T_ID, d),
                          [101, 102, 103, 104])
 
@@ -144,8 +151,7 @@ class testSync(unittest.TestCase):
             self.assertEqual(headers['Content-Type'], 'text/xml')
             return requestResponse('')
 
-        mod.requests.post = mypost
-        gc = RemoteXMLDatabase('z', 'y', 'u', 42)
+        gc = RemoteXMLDatabase('z', 'y', 'u', 42, session=MySession(mypost))
         self.assertRaises(SyncError, gc.sync, D, T_ID, d)
 
     def testNoData(self):
@@ -166,8 +172,7 @@ class testSync(unittest.TestCase):
             self.assertEqual(headers['Content-Type'], 'text/xml')
             return requestResponse('<tracker tracker-id="abcd" type="megadumpresponse"></tracker>')
 
-        mod.requests.post = mypost
-        gc = RemoteXMLDatabase('y', 't', 'v', 8000)
+        gc = RemoteXMLDatabase('y', 't', 'v', 8000, session=MySession(mypost))
         self.assertRaises(SyncError, gc.sync, D, T_ID, d)
 
     def testNotData(self):
@@ -188,8 +193,7 @@ class testSync(unittest.TestCase):
             self.assertEqual(headers['Content-Type'], 'text/xml')
             return requestResponse('<tracker tracker-id="abcd" type="megadumpresponse"><not_data /></tracker>')
 
-        mod.requests.post = mypost
-        gc = RemoteXMLDatabase('rsync', 'ssh', 'a/b/c', 22)
+        gc = RemoteXMLDatabase('rsync', 'ssh', 'a/b/c', 22, session=MySession(mypost))
         self.assertRaises(SyncError, gc.sync, D, T_ID, d)
 
     def testConnectionError(self):
@@ -202,8 +206,7 @@ class testSync(unittest.TestCase):
                 reason = Error()
             raise mod.requests.exceptions.ConnectionError(Reason())
 
-        mod.requests.post = mypost
-        gc = RemoteXMLDatabase('a', 'b', 'c', 0)
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=MySession(mypost))
         self.assertRaises(SyncError, gc.sync,D, T_ID, d)
 
     def testHTTPError(self):  # issue147
@@ -217,16 +220,166 @@ class testSync(unittest.TestCase):
                 e = mod.requests.exceptions.HTTPError('bad')
             raise e
 
-        mod.requests.post = mypost
 
         T_ID = 'abcd'
         D = MyDongle(0, 0)
         d = MyMegaDump('YWJjZA==')
-        gc = RemoteXMLDatabase('a', 'b', 'c', 0)
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=MySession(mypost))
         with self.assertRaises(SyncError) as cm:
             gc.sync(D, T_ID, d)
         self.assertEqual(cm.exception.errorstring, 'HTTPError: bad (500)')
 
+    def testTimeout(self):
+        def mypost(url, data, headers):
+            raise mod.requests.exceptions.ReadTimeout()
+
+        session = MySession(mypost)
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=session, timeout=12)
+        with self.assertRaises(SyncError) as cm:
+            gc.sync(MyDongle(0, 0), 'abcd', MyMegaDump('YWJjZA=='))
+        self.assertEqual(cm.exception.errorstring, 'Timeout: no answer after 12s')
+        self.assertEqual(session.timeouts, [12])
+
+class testStatusCache(unittest.TestCase):
+
+    def setUp(self):
+        self.answers = []
+        self.session = MySession(lambda url, data, headers:
+                                 requestResponse(self.answers.pop(0)))
+
+    def testNoTTL(self):
+        self.answers = ['', '']
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=self.session)
+        self.assertTrue(gc.requestStatus())
+        self.assertTrue(gc.requestStatus())
+        self.assertEqual(len(self.session.timeouts), 2)
+
+    def testCached(self):
+        self.answers = ['']
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=self.session,
+                               statusTTL=60)
+        for i in range(40):
+            self.assertTrue(gc.requestStatus())
+        self.assertEqual(len(self.session.timeouts), 1)
+
+    def testExpired(self):
+        self.answers = ['', '']
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=self.session,
+                               statusTTL=60)
+        gc.requestStatus()
+        gc._statusTime -= 61
+        gc.requestStatus()
+        self.assertEqual(len(self.session.timeouts), 2)
+
+    def testRedirect(self):
+        self.answers = ['', '<redirect><host>d</host></redirect>'
+                        '<tracker tracker-id="abcd" type="megadumpresponse">'
+                        '<data>ZWZnaA==</data></tracker>', '']
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=self.session,
+                               statusTTL=60)
+        gc.requestStatus()
+        gc.sync(MyDongle(0, 0), 'abcd', MyMegaDump('YWJjZA=='))
+        self.assertEqual(gc.host, 'd')
+        gc.requestStatus()
+        self.assertEqual(len(self.session.timeouts), 3)
+
+    def testConnectionError(self):
+        def mypost(url, data, headers):
+            raise mod.requests.exceptions.ConnectionError(Exception())
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=MySession(mypost),
+                               statusTTL=60)
+        gc._statusTime = mod.time.time()
+        self.assertRaises(SyncError, gc.sync, MyDongle(0, 0), 'abcd',
+                          MyMegaDump('YWJjZA=='))
+        self.assertTrue(gc._statusTime is None)
+
+    def testHTTPError(self):
+        def mypost(url, data, headers):
+            raise mod.requests.exceptions.HTTPError('bad')
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=MySession(mypost),
+                               statusTTL=60)
+        gc._statusTime = mod.time.time()
+        self.assertRaises(SyncError, gc.sync, MyDongle(0, 0), 'abcd',
+                          MyMegaDump('YWJjZA=='))
+        self.assertTrue(gc._statusTime is None)
+
+    def testRESTTransportErrors(self):
+        class MyRESTDongle(MyDongle):
+            def info(self): return ''
+        for error in (mod.requests.exceptions.ReadTimeout(),
+                      mod.requests.exceptions.ConnectionError(Exception())):
+            def mypost(url, data, headers):
+                raise error
+            gc = RemoteRESTDatabase('a', 'b', 'c', 0,
+                                    session=MySession(mypost), statusTTL=60)
+            gc._statusTime = mod.time.time()
+            self.assertRaises(SyncError, gc.sync, MyRESTDongle(0, 0), 'abcd',
+                              MyMegaDump('YWJjZA=='))
+            self.assertTrue(gc._statusTime is None)
+
+class testThreads(unittest.TestCase):
+
+    def testRedirectDuringUpload(self):
+        urls = {'status': [], 'sync': []}
+        statusSent = threading.Event()
+        redirected = threading.Event()
+        def mypost(url, data, headers):
+            if b'<client-mode>status' in data:
+                urls['status'].append(url)
+                if not statusSent.is_set():
+                    statusSent.set()
+                    redirected.wait(5)
+                return requestResponse('')
+            urls['sync'].append(url)
+            statusSent.wait(5)
+            return requestResponse(
+                '<redirect><host>d</host></redirect>'
+                '<tracker tracker-id="abcd" type="megadumpresponse">'
+                '<data>ZWZnaA==</data></tracker>')
+
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=MySession(mypost),
+                               statusTTL=60)
+        def upload():
+            gc.sync(MyDongle(0, 0), 'abcd', MyMegaDump('YWJjZA=='))
+            redirected.set()
+        thread = threading.Thread(target=upload)
+        thread.start()
+        self.assertTrue(gc.requestStatus())
+        thread.join()
+        # The status request went on with the host it started with
+        self.assertEqual(urls, {'status': ['a://b:0/c'],
+                                'sync': ['a://b:0/c']})
+        self.assertEqual(gc.host, 'd')
+        # It doesn't count as a status from the new server
+        self.assertTrue(gc.requestStatus())
+        self.assertEqual(urls['status'], ['a://b:0/c', 'a://d:0/c'])
+
+    def testThreadSession(self):
+        session = mod.newSession(2)
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=session)
+        self.assertTrue(gc._session() is session)
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(gc._session()))
+        thread.start()
+        thread.join()
+        self.assertFalse(sessions[0] is session)
+        self.assertTrue(sessions[0].adapters['https://'] is
+                        session.adapters['https://'])
+
+
+class testSession(unittest.TestCase):
+
+    def testReused(self):
+        session = MySession(lambda url, data, headers: requestResponse(''))
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0, session=session, timeout=3)
+        gc.requestStatus()
+        gc.requestStatus()
+        self.assertEqual(session.timeouts, [3, 3])
+
+    def testDefault(self):
+        gc = RemoteXMLDatabase('a', 'b', 'c', 0)
+        self.assertTrue(isinstance(gc.session, mod.requests.Session))
+
 class testURL(unittest.TestCase):
 
     def testWithPort(self):
@@ -0,0 +1,191 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from galileo import main
+from galileo.ble import DM
+from galileo.dump import CRC16
+from galileo.replay import Player, ReplayDongle
+from galileo.trace import IN, OUT, COMMLOG_HEADER, UNKNOWN, readCommLog
+from galileo.tracker import FitbitClient
+from galileo.utils import i2lsba
+
+TRACKER_ID = [0xaa] * 6
+
+
+def status(text):
+    return bytearray([len(text) + 3, 1]) + bytearray(text.encode('ascii')) + bytearray(1)
+
+
+def ctrl(INS, payload=[]):
+    return bytearray([len(payload) + 2, INS] + payload)
+
+
+def data(payload):
+    return DM(payload).asList()
+
+
+def megadump():
+    chunks = [[i] * 20 for i in range(1, 11)]
+    crc = CRC16()
+    for chunk in chunks:
+        crc.update(chunk)
+    footer = [0xc0, 0, 13] + i2lsba(crc.final(), 2) + i2lsba(200, 4)
+    return [[0xc0, 0x41, 13]] + chunks + [footer]
+
+
+# What the dongle answers during the synchronisation of a tracker
+SCRIPT = {
+    0x82: [
+        # disconnectAll
+        status('CancelDiscovery'), status('TerminateLink'), None,
+        # getHardwareInfo
+        ctrl(8, [2, 0] + [1] * 6 + [0] * 11),
+        # discover
+        status('StartDiscovery'),
+        ctrl(3, TRACKER_ID + [1, 0xe2, 2, 6, 4, 3, 0x2c, 0x31, 0xf6, 0xd8, 0x58]),
+        ctrl(2, [1]), status('CancelDiscovery'),
+        # connect
+        status('EstablishLink'), ctrl(4, [0]),
+        status('GAP_LINK_ESTABLISHED_EVENT'), ctrl(7), ctrl(6, [0] * 6),
+        # disconnect
+        status('TerminateLink'), ctrl(5, [0x16]),
+        status('GAP_LINK_TERMINATED_EVENT'), status('22'),
+    ],
+    0x81: [data(d) for d in
+           # connect
+           [[0xc0, 0xb], [0xc0, 0x14, 0xc, 1, 0, 0] + TRACKER_ID] +
+           megadump() +
+           # upload of a response of 2 chunks
+           [[0xc0, 0x12, 4, 0, 0], [0xc0, 0x13, 0x14, 0, 0],
+            [0xc0, 0x13, 0x24, 0, 0], [0xc0, 2],
+           # disconnect
+            [0xc0, 1], [0xc0, 0xb]]],
+}
+
+
+class ScriptedDongle(FitbitClient):
+    """ Answers the SCRIPT """
+    def __init__(self, logsize):
+        FitbitClient.__init__(self, logsize)
+        self.script = dict((e, list(m)) for e, m in SCRIPT.items())
+
+    def setup(self):
+        return True
+
+    def write(self, endpoint, data, timeout):
+        self.log.add(OUT, data, endpoint)
+        return len(data)
+
+    def read(self, endpoint, length, timeout):
+        data = None
+        if self.script[endpoint]:
+            data = self.script[endpoint].pop(0)
+        self.log.add(IN, data, endpoint)
+        return data
+
+
+class MyDatabase(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def requestStatus(self, allowHTTP):
+        return True
+
+    def sync(self, fitbit, trackerId, dump):
+        return bytearray(range(30))
+
+
+class MyConfig(object):
+    logSize = 100
+    database = MyDatabase
+    fitbitServer = 'localhost'
+    keepDumps = False
+    doUpload = True
+    httpsOnly = True
+    multiRadio = False
+    httpTimeout = 1000
+    statusTTL = 0
+    httpPoolSize = 1
+    httpKeepAlive = True
+    uploadWorkers = 0
+    uploadWindow = 1
+    includeTrackers = None
+    excludeTrackers = set()
+    discoveryTimeout = 4000
+    adaptiveDiscovery = False
+    adaptiveTimeouts = False
+
+    def __init__(self, bluetoothConn, recordFile=None):
+        self.bluetoothConn = bluetoothConn
+        self.recordFile = recordFile
+
+    def shouldSkip(self, tracker):
+        return False
+
+
+class testRecordReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'session')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _sync(self, config):
+        session = main.SyncSession(config)
+        trackers = list(session.sync())
+        self.assertEqual([t.status for t in trackers],
+                         ['Synchronisation successful'])
+        return session.radios[0]
+
+    def testRecordReplay(self):
+        recorder = self._sync(MyConfig(ScriptedDongle, self.filename)).log
+        recorder.close()
+        self.assertEqual(recorder.writer.count, len(recorder))
+
+        class MyReplayDongle(ReplayDongle):
+            filename = self.filename
+        fitbit = self._sync(MyConfig(MyReplayDongle))
+        self.assertEqual(fitbit.player.mismatches, 0)
+        self.assertEqual([q for q in fitbit.player.queues.values() if q], [])
+
+    def testClosed(self):
+        """ The recording is complete once the session is over """
+        trackers = list(main.syncAllTrackers(MyConfig(ScriptedDongle,
+                                                      self.filename)))
+        self.assertEqual(len(trackers), 1)
+        with open(self.filename, 'rb') as f:
+            magic, version, count = COMMLOG_HEADER.unpack(
+                f.read(COMMLOG_HEADER.size))
+        self.assertEqual(count, len(readCommLog(self.filename)))
+        self.assertTrue(count < UNKNOWN)
+
+    def testMismatch(self):
+        self._sync(MyConfig(ScriptedDongle, self.filename)).log.close()
+        fitbit = ReplayDongle(10, self.filename)
+        self.assertTrue(fitbit.setup())
+        fitbit.ctrl_write(main.dgl.CM(2))
+        fitbit.ctrl_write(main.dgl.CM(2))
+        self.assertEqual(fitbit.player.mismatches, 1)
+        self.assertEqual(fitbit.ctrl_read().INS, 1)
+
+    def testNoFile(self):
+        self.assertFalse(ReplayDongle(10, self.filename).setup())
+
+
+class testPlayer(unittest.TestCase):
+
+    def testSpeed(self):
+        messages = [(IN, 0x81, 1000, bytearray([1])),
+                    (IN, 0x81, 1100, bytearray([2]))]
+        waits = []
+        player = Player(messages, 0.5)
+        player._wait = lambda timestamp: waits.append(timestamp)
+        self.assertEqual(player.read(0x81), bytearray([1]))
+        self.assertEqual(player.read(0x81), bytearray([2]))
+        self.assertEqual(waits, [1., 1.1])
+        # Nothing more: a timeout
+        self.assertEqual(player.read(0x81), None)
@@ -0,0 +1,308 @@
+import threading
+import time
+import unittest
+
+from galileo import main
+from galileo.databases import SyncError
+
+
+class MyTracker(object):
+    def __init__(self, id, RSSI=-60):
+        self.id = id
+        self.RSSI = RSSI
+        self.status = 'unknown'
+        self.syncedRecently = False
+
+
+class MyFitbit(object):
+    """ Records what happens on the radio """
+    name = 'fake'
+    trackers = []
+
+    def __init__(self, logsize):
+        self.events = []
+        MyFitbit.instance = self
+
+    def setup(self):
+        self.events.append(('setup', None))
+        return True
+
+    def disconnectAll(self):
+        self.events.append(('disconnectAll', None))
+        return True
+
+    def getHardwareInfo(self): return True
+    def info(self): return 'fake'
+    def close(self): pass
+
+    def discover(self, *args, **kwargs):
+        return self.trackers
+
+    def connect(self, tracker):
+        self.events.append(('connect', tracker.id))
+        return True
+
+    def disconnect(self, tracker):
+        self.events.append(('disconnect', tracker.id))
+        return True
+
+    def getDump(self, dumptype, dump):
+        self.events.append(('dump', None))
+        dump.add(bytearray([0xc0, 0, dumptype, 0, 0, 0, 0, 0, 0]))
+        return dump
+
+    def uploadResponse(self, response):
+        self.events.append(('response', bytes(response)))
+        return True
+
+
+class MyDatabase(object):
+    """ The upload of the first tracker is only over once the second one has
+    been downloaded """
+    def __init__(self, *args, **kwargs):
+        self.downloaded = threading.Event()
+
+    def requestStatus(self, allowHTTP):
+        return True
+
+    def sync(self, fitbit, trackerId, dump):
+        if trackerId == 'AA':
+            self.downloaded.wait(5)
+        else:
+            self.downloaded.set()
+        if trackerId == 'CC':
+            raise SyncError('refused')
+        if trackerId == 'FF':
+            raise ValueError('garbage from the server')
+        return bytearray(trackerId.encode('ascii'))
+
+
+class MyConfig(object):
+    logSize = 10
+    bluetoothConn = MyFitbit
+    database = MyDatabase
+    fitbitServer = 'localhost'
+    keepDumps = False
+    doUpload = True
+    httpsOnly = True
+    multiRadio = False
+    httpTimeout = 1000
+    statusTTL = 0
+    httpPoolSize = 1
+    httpKeepAlive = True
+    uploadWindow = 1
+    includeTrackers = None
+    excludeTrackers = set()
+    discoveryTimeout = 4000
+    adaptiveDiscovery = False
+    adaptiveTimeouts = False
+    recordFile = None
+
+    def __init__(self, uploadWorkers, bluetoothConn=MyFitbit):
+        self.uploadWorkers = uploadWorkers
+        self.bluetoothConn = bluetoothConn
+        self.multiRadio = bluetoothConn is not MyFitbit
+
+    def shouldSkip(self, tracker):
+        return False
+
+
+class testSyncAllTrackers(unittest.TestCase):
+
+    def setUp(self):
+        MyFitbit.trackers = [MyTracker('AA'), MyTracker('BB')]
+
+    def testSequential(self):
+        MyFitbit.trackers = [MyTracker('BB'), MyTracker('DD')]
+        trackers = list(main.syncAllTrackers(MyConfig(0)))
+        self.assertEqual([t.status for t in trackers],
+                         ['Synchronisation successful'] * 2)
+        self.assertEqual(MyFitbit.instance.events, [
+            ('setup', None), ('disconnectAll', None), ('connect', 'BB'), ('dump', None), ('response', b'BB'),
+            ('disconnect', 'BB'),
+            ('connect', 'DD'), ('dump', None), ('response', b'DD'),
+            ('disconnect', 'DD')])
+
+    def testPipelined(self):
+        trackers = list(main.syncAllTrackers(MyConfig(2)))
+        self.assertEqual(sorted(t.id for t in trackers), ['AA', 'BB'])
+        self.assertEqual([t.status for t in trackers],
+                         ['Synchronisation successful'] * 2)
+        events = MyFitbit.instance.events
+        # Both dumps were downloaded before the answers came back
+        events = [e for e in events if e[0] not in ('setup', 'disconnectAll')]
+        self.assertEqual(events[:6], [
+            ('connect', 'AA'), ('dump', None), ('disconnect', 'AA'),
+            ('connect', 'BB'), ('dump', None), ('disconnect', 'BB')])
+        self.assertIn(('response', b'AA'), events[6:])
+        self.assertIn(('response', b'BB'), events[6:])
+
+    def testPipelinedRefused(self):
+        MyFitbit.trackers.append(MyTracker('CC'))
+        trackers = dict((t.id, t) for t in main.syncAllTrackers(MyConfig(2)))
+        self.assertEqual(trackers['CC'].status,
+                         'Synchronisation failed: refused')
+        self.assertEqual(trackers['AA'].status, 'Synchronisation successful')
+
+    def testPipelinedError(self):
+        MyFitbit.trackers.append(MyTracker('FF'))
+        trackers = dict((t.id, t) for t in main.syncAllTrackers(MyConfig(2)))
+        self.assertEqual(trackers['FF'].status,
+                         'Synchronisation failed: garbage from the server')
+        self.assertEqual(trackers['AA'].status, 'Synchronisation successful')
+        self.assertEqual(trackers['BB'].status, 'Synchronisation successful')
+
+    def testPipelinedInterrupted(self):
+        trackers = main.syncAllTrackers(MyConfig(2))
+        next(trackers)
+        trackers.close()
+        # The other tracker got its answer all the same
+        events = MyFitbit.instance.events
+        self.assertIn(('response', b'AA'), events)
+        self.assertIn(('response', b'BB'), events)
+
+
+class testSyncSession(unittest.TestCase):
+
+    def setUp(self):
+        MyFitbit.trackers = [MyTracker('BB')]
+        self.session = main.SyncSession(MyConfig(0))
+
+    def testSetupOnce(self):
+        list(self.session.sync())
+        fitbit = MyFitbit.instance
+        list(self.session.sync())
+        self.assertTrue(MyFitbit.instance is fitbit)
+        self.assertEqual([e[0] for e in fitbit.events].count('setup'), 1)
+        self.assertEqual([e[0] for e in fitbit.events].count('disconnectAll'), 1)
+
+    def testInterrupted(self):
+        for tracker in self.session.sync():
+            break
+        fitbit = MyFitbit.instance
+        list(self.session.sync())
+        self.assertTrue(MyFitbit.instance is fitbit)
+        self.assertEqual([e[0] for e in fitbit.events].count('disconnectAll'), 2)
+
+    def testDiscovery(self):
+        """ Only the adaptive discovery stops once some trackers are heard """
+        config = self.session.config
+        config.includeTrackers = ['AA']
+        self.assertEqual(self.session._discovery()[1], None)
+        config.adaptiveDiscovery = True
+        self.assertEqual(self.session._discovery()[1], set(['AA']))
+        config.includeTrackers = None
+        self.session.registry.trackers = {'BB': {'lastSeen': time.time()},
+                                          'CC': {'lastSeen': 0}}
+        self.assertEqual(self.session._discovery()[1], set(['BB']))
+
+    def testResetOnError(self):
+        def failing(tracker):
+            raise IOError('USB is gone')
+        list(self.session.sync())
+        fitbit = MyFitbit.instance
+        fitbit.connect = failing
+        self.assertRaises(IOError, list, self.session.sync())
+        list(self.session.sync())
+        self.assertFalse(MyFitbit.instance is fitbit)
+
+
+class MyBrokenFitbit(MyFitbit):
+    setups = 0
+
+    def setup(self):
+        MyBrokenFitbit.setups += 1
+        return True
+
+    def connect(self, tracker):
+        raise IOError('USB is gone')
+
+
+class testDaemon(unittest.TestCase):
+
+    def testGivesUp(self):
+        MyFitbit.trackers = [MyTracker('BB')]
+        config = MyConfig(0, MyBrokenFitbit)
+        config.multiRadio = False
+        config.daemonPeriod = 0
+        self.assertRaises(IOError, main.daemon, config)
+        self.assertEqual(MyBrokenFitbit.setups, main.DAEMON_MAX_FAILURES)
+
+
+class MyRadio(MyFitbit):
+    threadSafe = True
+    # radio name -> {tracker id: RSSI}
+    heard = {}
+    instances = []
+
+    @classmethod
+    def all(klass, logsize):
+        klass.instances = [klass(logsize, name) for name in sorted(klass.heard)]
+        return klass.instances
+
+    def __init__(self, logsize, name):
+        MyFitbit.__init__(self, logsize)
+        self.name = name
+
+    def discover(self, *args, **kwargs):
+        return [MyTracker(id, RSSI) for id, RSSI in self.heard[self.name].items()]
+
+
+class testMultiRadio(unittest.TestCase):
+
+    def _sync(self, threadSafe):
+        MyRadio.threadSafe = threadSafe
+        MyRadio.heard = {'r1': {'BB': -50, 'DD': -70, 'EE': -65},
+                         'r2': {'DD': -40, 'EE': -60}}
+        trackers = list(main.syncAllTrackers(MyConfig(0, MyRadio)))
+        self.assertEqual(sorted(t.id for t in trackers), ['BB', 'DD', 'EE'])
+        self.assertEqual(set(t.status for t in trackers),
+                         set(['Synchronisation successful']))
+        r1, r2 = MyRadio.instances
+        self.assertEqual([e[1] for e in r1.events if e[0] == 'connect'],
+                         ['BB'])
+        self.assertEqual([e[1] for e in r2.events if e[0] == 'connect'],
+                         ['DD', 'EE'])
+
+    def testParallel(self):
+        self._sync(True)
+
+    def testSharedDatabase(self):
+        """ What the server told applies to all the radios """
+        MyRadio.heard = {'r1': {'BB': -50}, 'r2': {'DD': -40}}
+        session = main.SyncSession(MyConfig(0, MyRadio))
+        list(session.sync())
+        self.assertEqual(len(session.databases), 2)
+        self.assertEqual(len(set(map(id, session.databases.values()))), 1)
+
+    def testSequential(self):
+        self._sync(False)
+
+
+class MyFailingRadio(MyRadio):
+    """ Can't connect to BB, and only goes on with the others once that
+    failure is known """
+    session = None
+
+    def connect(self, tracker):
+        if tracker.id == 'BB':
+            raise IOError('USB is gone')
+        self.session.stopping.wait(5)
+        return MyRadio.connect(self, tracker)
+
+
+class testMultiRadioFailure(unittest.TestCase):
+
+    def testWorkersStopped(self):
+        MyFailingRadio.threadSafe = True
+        MyFailingRadio.heard = {'r1': {'BB': -50},
+                                'r2': {'DD': -40, 'EE': -40}}
+        session = main.SyncSession(MyConfig(0, MyFailingRadio))
+        MyFailingRadio.session = session
+        self.assertRaises(IOError, list, session.sync())
+        r1, r2 = MyFailingRadio.instances
+        # r2 was done with DD when the error got raised, and skipped EE
+        self.assertEqual([e for e in r2.events
+                          if e[0] in ('connect', 'disconnect')],
+                         [('connect', 'DD'), ('disconnect', 'DD')])
+        self.assertEqual(session.radios, [])
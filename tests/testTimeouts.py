@@ -0,0 +1,79 @@
+import shutil
+import tempfile
+import unittest
+
+from galileo import ble
+from galileo.timeouts import TimeoutPolicy
+
+
+class testTimeoutPolicy(unittest.TestCase):
+
+    def testCeilingFirst(self):
+        policy = TimeoutPolicy()
+        self.assertEqual(policy.timeout(0x12, 'uploadDone', 60000), 60000)
+        for i in range(policy.MIN_SAMPLES - 1):
+            policy.record(0x12, 'uploadDone', 1000)
+        self.assertEqual(policy.timeout(0x12, 'uploadDone', 60000), 60000)
+
+    def testPercentile(self):
+        policy = TimeoutPolicy()
+        for latency in range(100, 2100, 100):
+            policy.record(0x12, 'uploadDone', latency)
+        # 95th of 20 samples is the highest one
+        self.assertEqual(policy.timeout(0x12, 'uploadDone', 60000),
+                         2000 * 1.5 + 200)
+        # Capped
+        self.assertEqual(policy.timeout(0x12, 'uploadDone', 3000), 3000)
+        # Per model and step
+        self.assertEqual(policy.timeout(0x11, 'uploadDone', 60000), 60000)
+        self.assertEqual(policy.timeout(0x12, 'txPipe', 5000), 5000)
+
+    def testHistory(self):
+        policy = TimeoutPolicy()
+        for i in range(policy.HISTORY):
+            policy.record(None, 'txPipe', 4000)
+        for i in range(policy.HISTORY):
+            policy.record(None, 'txPipe', 100)
+        self.assertEqual(policy.timeout(None, 'txPipe', 5000), 350)
+
+    def testPersistence(self):
+        dirname = tempfile.mkdtemp()
+        try:
+            policy = TimeoutPolicy(dirname)
+            for i in range(20):
+                policy.record(0x12, 'txPipe', 100)
+            policy.save()
+            self.assertEqual(TimeoutPolicy(dirname).timeout(0x12, 'txPipe',
+                                                            5000), 350)
+        finally:
+            shutil.rmtree(dirname)
+
+
+class MyRadio(ble.API):
+    def __init__(self, answers):
+        self.answers = answers
+        self.timeoutsAsked = []
+
+    def _readData(self, timeout=0):
+        self.timeoutsAsked.append(timeout)
+        return self.answers.pop(0)
+
+
+class testWait(unittest.TestCase):
+
+    def testNoPolicy(self):
+        r = MyRadio(['a'])
+        self.assertEqual(r._wait(r._readData, 'txPipe', 5000), 'a')
+        self.assertEqual(r.timeoutsAsked, [5000])
+
+    def testLearnt(self):
+        r = MyRadio(['a'] * 20 + [None, 'b'])
+        r.timeouts = TimeoutPolicy()
+        for i in range(20):
+            r._wait(r._readData, 'txPipe', 5000)
+        self.assertEqual(r.timeoutsAsked[0], 5000)
+        self.assertTrue(r.timeoutsAsked[-1] < 5000)
+        self.assertEqual(r._wait(r._readData, 'txPipe', 5000), None)
+        # The miss counts as a wait up to the ceiling
+        self.assertEqual(max(r.timeouts.latencies['unknown']['txPipe']),
+                         5000)
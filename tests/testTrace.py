@@ -0,0 +1,99 @@
+import array
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from galileo import trace
+from galileo.dongle import FitBitDongle
+
+
+class testTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('galileo.test.trace')
+
+    def tearDown(self):
+        trace.enabled = True
+        self.logger.setLevel(logging.NOTSET)
+
+    def testTracing(self):
+        self.logger.setLevel(logging.DEBUG)
+        self.assertTrue(trace.tracing(self.logger))
+        self.logger.setLevel(logging.INFO)
+        self.assertFalse(trace.tracing(self.logger))
+        self.logger.setLevel(logging.DEBUG)
+        trace.enabled = False
+        self.assertFalse(trace.tracing(self.logger))
+
+    def testLast(self):
+        d = FitBitDongle(5)
+        self.assertTrue(trace.last is d.log)
+        d.log.add(trace.IN, bytearray(3), 0x81)
+        self.assertEqual([(e[0], e[1], bytes(e[3])) for e in trace.last],
+                         [(trace.IN, 0x81, b'\0\0\0')])
+
+    def testDisabled(self):
+        trace.enabled = False
+        log = trace.newLog(10)
+        log.add(trace.OUT, bytearray(3))
+        self.assertTrue(log.empty)
+
+
+class testCommLog(unittest.TestCase):
+
+    def _messages(self, log):
+        return [(d, e, bytes(data)) for d, e, t, data in log]
+
+    def testOrder(self):
+        log = trace.CommLog(3)
+        self.assertTrue(log.empty)
+        for i in range(5):
+            log.add(trace.OUT, bytearray([i] * 32), 0x01)
+        self.assertTrue(log.full)
+        self.assertEqual(len(log), 3)
+        self.assertEqual(self._messages(log), [
+            (trace.OUT, 0x01, bytes(bytearray([i] * 32))) for i in (2, 3, 4)])
+
+    def testNoCopy(self):
+        log = trace.CommLog(2)
+        log.add(trace.IN, array.array('B', [1, 2, 3]), 0x82)
+        arena = log.arena
+        for d, e, t, data in log:
+            self.assertTrue(isinstance(data, memoryview))
+        log.add(trace.IN, None, 0x82)
+        self.assertTrue(log.arena is arena)
+        self.assertEqual(self._messages(log), [(trace.IN, 0x82, b'\1\2\3'),
+                                               (trace.IN, 0x82, b'')])
+
+    def testLongMessages(self):
+        log = trace.CommLog(4)
+        long = bytearray(range(150))
+        log.add(trace.IN, long, 0x81)
+        self.assertEqual(len(log), 1)
+        self.assertEqual(self._messages(log), [(trace.IN, 0x81, bytes(long))])
+        # The first part gets overwritten, the message is gone
+        log.add(trace.OUT, bytearray(2), 0x01)
+        self.assertEqual(len(log), 2)
+        log.add(trace.OUT, bytearray(3), 0x01)
+        self.assertEqual(self._messages(log), [(trace.OUT, 0x01, b'\0\0'),
+                                               (trace.OUT, 0x01, b'\0\0\0')])
+        self.assertEqual(len(log), 2)
+
+    def testDump(self):
+        dirname = tempfile.mkdtemp()
+        try:
+            log = trace.CommLog(10)
+            log.add(trace.OUT, bytearray([2, 1]), 0x02)
+            log.add(trace.IN, bytearray(range(100)), 0x82)
+            filename = os.path.join(dirname, 'comlog')
+            log.dump(filename)
+            messages = trace.readCommLog(filename)
+            self.assertEqual([(d, e, bytes(data)) for d, e, t, data in messages],
+                             self._messages(log))
+            with open(filename, 'wb') as f:
+                f.write(b'something else')
+            self.assertRaises(ValueError, trace.readCommLog, filename)
+        finally:
+            shutil.rmtree(dirname)
@@ -0,0 +1,117 @@
+import shutil
+import tempfile
+import unittest
+
+from galileo import ble
+from galileo.ble import DM, UploadWindows
+
+
+class MyTracker(ble.API):
+    """ Acknowledges each chunk it gets, the events record how many chunks
+    were waiting for their acknowledgement when we read one """
+    def __init__(self, badAck=None):
+        self.pending = []
+        self.chunks = 0
+        self.inFlight = []
+        self.badAck = badAck
+
+    def _writeData(self, dm):
+        if dm.data[:2] == bytearray([0xc0, 0x24]):
+            # A new upload
+            self.chunks = 0
+            self.pending.append(DM([0xc0, 0x12, 4, 0, 0]))
+        elif dm.data == bytearray([0xc0, 2]):
+            self.pending.append(DM([0xc0, 2]))
+        else:
+            self.chunks += 1
+            seq = self.chunks
+            if seq == self.badAck:
+                seq += 1
+                self.badAck = None
+            self.pending.append(DM([0xc0, 0x13, ((seq % 16) << 4) + 4, 0, 0]))
+
+    def _readData(self, timeout=0):
+        if self.chunks:
+            self.inFlight.append(len(self.pending))
+        if not self.pending:
+            return None
+        return self.pending.pop(0)
+
+
+class testWindowedUpload(unittest.TestCase):
+
+    RESPONSE = [1] * 400  # 20 chunks
+
+    def testStopAndWait(self):
+        t = MyTracker()
+        self.assertTrue(t._uploadResponse(self.RESPONSE, False, 0x12))
+        self.assertEqual(t.chunks, 20)
+        self.assertEqual(set(t.inFlight), set([1]))
+
+    def testWindow(self):
+        t = MyTracker()
+        t.uploadWindows = UploadWindows(4)
+        t.uploadWindows._windows[0x12] = 4
+        self.assertTrue(t._uploadResponse(self.RESPONSE, False, 0x12))
+        self.assertEqual(t.chunks, 20)
+        self.assertEqual(max(t.inFlight), 4)
+
+    def testGrowth(self):
+        windows = UploadWindows(6)
+        for expected in (2, 4, 6, 6):
+            t = MyTracker()
+            t.uploadWindows = windows
+            self.assertTrue(t._uploadResponse(self.RESPONSE, False, 0x12))
+            self.assertEqual(windows.get(0x12), expected)
+        # Only for that product
+        self.assertEqual(windows.get(0x11), 1)
+
+    def testFallBack(self):
+        windows = UploadWindows(8)
+        windows._windows[0x12] = 8
+        t = MyTracker(badAck=17)
+        t.uploadWindows = windows
+        # Sent again chunk by chunk
+        self.assertTrue(t._uploadResponse(self.RESPONSE, False, 0x12))
+        self.assertEqual(t.chunks, 20)
+        self.assertEqual(t.pending, [])
+        self.assertEqual(windows.get(0x12), 1)
+        for expected in (2, 4, 7, 7):
+            t = MyTracker()
+            t.uploadWindows = windows
+            self.assertTrue(t._uploadResponse(self.RESPONSE, False, 0x12))
+            self.assertEqual(windows.get(0x12), expected)
+
+    def testStopAndWaitFailure(self):
+        """ Not sent again """
+        t = MyTracker(badAck=3)
+        self.assertFalse(t._uploadResponse(self.RESPONSE, False, 0x12))
+        self.assertEqual(t.chunks, 3)
+
+    def testPersistence(self):
+        dirname = tempfile.mkdtemp()
+        try:
+            windows = UploadWindows(8, dirname)
+            windows.succeeded(0x12, 2)
+            windows.failed(0x11, 4)
+            windows.save()
+            windows = UploadWindows(8, dirname)
+            self.assertEqual(windows.get(0x12), 4)
+            self.assertEqual(windows._limits, {0x11: 3})
+            # The maximum got lowered
+            self.assertEqual(UploadWindows(2, dirname).get(0x12), 2)
+        finally:
+            shutil.rmtree(dirname)
+
+    def testFastAirlink(self):
+        """ No acknowledgement to wait for """
+        t = MyTracker()
+        t.pending.append(DM([0xc0, 0x12, 4, 0, 0, 0]))
+        t._writeData = lambda dm: t.pending.append(DM([0xc0, 2])) \
+            if dm.data == bytearray([0xc0, 2]) else None
+        self.assertTrue(t._uploadResponse(self.RESPONSE, True, 0x12))
+
+    def testMaximum(self):
+        """ The sequence number of the acknowledgements wraps at 16 """
+        self.assertEqual(UploadWindows(100).maximum, 15)
+        self.assertEqual(UploadWindows(0).maximum, 1)
@@ -1,6 +1,13 @@
 import unittest
 
 from galileo.utils import a2x, a2s, a2lsbi, a2msbi, i2lsba, i2msba, s2a, x2a
+from galileo.utils import iterx2a, iterUnpack, _a2lsbi, _a2msbi, _i2lsba, _i2msba
+from galileo.utils import loadJSON, saveJSON
+
+import os
+import shutil
+import struct
+import tempfile
 
 class testa2x(unittest.TestCase):
 
@@ -13,6 +20,17 @@ class testa2x(unittest.TestCase):
     def testDelim(self):
         self.assertEqual(a2x(range(190, 196), '|'), 'BE|BF|C0|C1|C2|C3')
 
+    def testNoDelim(self):
+        self.assertEqual(a2x(bytearray([0xab, 0xcd, 0xef]), ''), 'ABCDEF')
+
+    def testLongDelim(self):
+        self.assertEqual(a2x([1, 2, 3], ', '), '01, 02, 03')
+
+    def testRoundTrip(self):
+        data = bytearray(range(256)) * 4
+        self.assertEqual(x2a(a2x(data)), data)
+        self.assertEqual(x2a(a2x(data, ':')), data)
+
 
 class testx2a(unittest.TestCase):
 
@@ -25,6 +43,16 @@ class testx2a(unittest.TestCase):
         self.assertEqual(x2a('00\n01\n02\n03'), [0, 1, 2, 3])
         self.assertEqual(x2a('00 01\n02 03'), [0, 1, 2, 3])
 
+    def testColons(self):
+        self.assertEqual(x2a('AB:CD:EF'), bytearray([0xab, 0xcd, 0xef]))
+
+
+class testiterx2a(unittest.TestCase):
+
+    def testLines(self):
+        self.assertEqual(list(iterx2a(['00 01\n', '\n', 'FF 2\n'])),
+                         [bytearray([0, 1]), bytearray([0xff, 2])])
+
 class testa2s(unittest.TestCase):
 
     def testSimple(self):
@@ -125,6 +153,29 @@ class testi2msba(unittest.TestCase):
         self.assertEqual(i2msba(0x8000, 2), bytearray([0x80, 0]))
 
 
+class testStructCodecs(unittest.TestCase):
+
+    def testSameAsLoops(self):
+        for width in (1, 2, 3, 4, 8):
+            for _ in range(20):
+                data = bytearray(os.urandom(width))
+                value = _a2lsbi(data)
+                self.assertEqual(a2lsbi(data), value)
+                self.assertEqual(a2lsbi(memoryview(data)), value)
+                self.assertEqual(a2msbi(bytes(data)), _a2msbi(data))
+                self.assertEqual(i2lsba(value, width), _i2lsba(value, width))
+                self.assertEqual(i2msba(value, width), _i2msba(value, width))
+
+    def testTruncate(self):
+        self.assertEqual(i2lsba(0x12345, 2), [0x45, 0x23])
+        self.assertEqual(i2msba(-1, 4), bytearray([0xff] * 4))
+
+    def testIterUnpack(self):
+        codec = struct.Struct('<HB')
+        self.assertEqual(list(iterUnpack(codec, bytearray(range(6)))),
+                         [(0x100, 2), (0x403, 5)])
+
+
 class tests2a(unittest.TestCase):
 
     def testSimple(self):
@@ -134,3 +185,35 @@ class tests2a(unittest.TestCase):
         self.assertEqual(s2a('abcd\0\0\0efghi'),
                          list(range(ord('a'), ord('d')+1)) +
                         [0] * 3 + list(range(ord('e'), ord('i') + 1)))
+
+
+class testJSON(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'sub', 'content.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testRoundTrip(self):
+        saveJSON(self.filename, {'a': [1, 2]}, 'test', sort_keys=True)
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)),
+                         ['content.json'])
+        self.assertEqual(loadJSON(self.filename, 'test'), {'a': [1, 2]})
+        self.assertEqual(loadJSON(self.filename, 'test', lambda c: c['a']),
+                         [1, 2])
+
+    def testMissing(self):
+        self.assertEqual(loadJSON(self.filename, 'test'), None)
+        self.assertEqual(loadJSON(None, 'test'), None)
+        saveJSON(None, {}, 'test')
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def testUnreadable(self):
+        saveJSON(self.filename, {'a': 1}, 'test')
+        self.assertEqual(loadJSON(self.filename, 'test', lambda c: c['b']),
+                         None)
+        with open(self.filename, 'w') as f:
+            f.write('{"a": ')
+        self.assertEqual(loadJSON(self.filename, 'test'), None)
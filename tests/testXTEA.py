@@ -1,7 +1,10 @@
 import unittest
 
+from galileo import xtea
 from galileo.utils import a2x, a2s, x2a
-from galileo.xtea import xtea_encrypt, xtea_decrypt
+from galileo.xtea import xtea_encrypt, xtea_decrypt, XTEA
+
+KEY = bytearray('0123456789012345', 'utf-8')
 
 class testXTEA(unittest.TestCase):
     def testEncrypt(self):
@@ -11,3 +14,43 @@ class testXTEA(unittest.TestCase):
     def testDecrypt(self):
         z = xtea_decrypt(bytearray('0123456789012345', 'utf-8'), bytearray(x2a('B6 7C 01 66 2F F6 96 4A')))
         self.assertEqual(a2s(z), 'ABCDEFGH')
+
+
+class testXTEAObject(unittest.TestCase):
+    def testEncryptBlock(self):
+        z = XTEA(KEY).encrypt_block(bytearray('ABCDEFGH', 'utf-8'))
+        self.assertEqual(a2x(z), 'B6 7C 01 66 2F F6 96 4A')
+
+    def testDecryptBlock(self):
+        z = XTEA(KEY).decrypt_block(bytearray(x2a('B6 7C 01 66 2F F6 96 4A')))
+        self.assertEqual(a2s(z), 'ABCDEFGH')
+
+    def testRounds(self):
+        block = bytearray(range(8))
+        for n in (1, 16, 64):
+            cipher = XTEA(KEY, n)
+            self.assertEqual(cipher.encrypt_block(block), xtea_encrypt(KEY, block, n))
+            self.assertEqual(cipher.decrypt_block(cipher.encrypt_block(block)), block)
+
+    def _checkBlocks(self):
+        data = bytearray((i * 13) & 0xff for i in range(8 * 10))
+        cipher = XTEA(KEY)
+        expected = bytearray()
+        for i in range(0, len(data), 8):
+            expected.extend(cipher.encrypt_block(data[i:i + 8]))
+        self.assertEqual(cipher.encrypt_blocks(data), expected)
+        self.assertEqual(cipher.encrypt_blocks(bytearray()), bytearray())
+        self.assertRaises(ValueError, cipher.encrypt_blocks, bytearray(7))
+
+    def testEncryptBlocksNumpy(self):
+        if xtea.numpy is None:
+            self.skipTest("NumPy not available")
+        self._checkBlocks()
+
+    def testEncryptBlocksPurePython(self):
+        numpy = xtea.numpy
+        xtea.numpy = None
+        try:
+            self._checkBlocks()
+        finally:
+            xtea.numpy = numpy